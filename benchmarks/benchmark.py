@@ -0,0 +1,259 @@
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import sys
+import time
+
+import pandas as pd
+from furbain import config
+from furbain import converter
+from furbain import databaseTools
+from furbain import generator
+from furbain import queries
+
+
+# Times the converters and the queries on synthetic simulation outputs (see furbain.generator) of several sizes
+# Each size is imported in its own database, recreated at each run, then the queries are run on it
+# Each step runs in a new process, its peak memory (RSS) is the peak memory of the process
+#
+# The results are written as json and compared with a baseline, a step is a regression if its wall time
+# or its peak memory is more than threshold (eg: 0.2 for 20%) above the baseline
+#
+# Usage : python benchmarks/benchmark.py -f 0.1 1 10 -o results.json -b baseline.json
+#         python benchmarks/benchmark.py -f 0.1 1 10 -b baseline.json --save-baseline
+
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_ZONES_PATH = os.path.join(REPOSITORY_PATH, 'resources', 'sample', '5zones.geojson')
+DEFAULT_DATA_DIRECTORY_PATH = os.path.join(REPOSITORY_PATH, 'output', 'benchmarks')
+DEFAULT_DATABASE_PREFIX = 'furbain_benchmark'
+
+MIN_WALL_TIME_DIFFERENCE_IN_SECONDS = 0.5 # smaller differences are noise, they are never regressions
+
+# Converters in the order of their dependencies, with the tables whose rows they import
+CONVERTER_STEPS = {
+    'importNetworkLinks': [config.DB_NETWORK_TABLE],
+    'importFacilities': [config.DB_FACILITIES_TABLE],
+    'importHouseholds': [config.DB_HOUSEHOLDS_TABLE],
+    'importPersons': [config.DB_PERSONS_TABLE],
+    'importVehicles': [config.DB_ALLVEHICLES_TYPES_TABLE, config.DB_ALLVEHICLES_TABLE],
+    'importActivities': [config.DB_PLANS_TABLE],
+    'importTrips': [config.DB_TRIPS_TABLE],
+    'importEvents': [config.DB_EVENTS_TABLE],
+    'importBuildings': [config.DB_BUILDINGS_TABLE],
+}
+
+# Queries with the table they read (its rows give the throughput) and the call on a zone file
+QUERY_STEPS = {
+    'agentActivity': (config.DB_PLANS_TABLE, lambda zonesPath: queries.agentActivity(zonesPath, '06:00:00', '10:00:00')),
+    'agentActivity[batched]': (config.DB_PLANS_TABLE, lambda zonesPath: queries.agentActivity(zonesPath, '06:00:00', '10:00:00', batched=True)),
+    'iterateAgentActivity': (config.DB_PLANS_TABLE, lambda zonesPath: list(queries.iterateAgentActivity(zonesPath, '06:00:00', '10:00:00'))),
+    'odMatrix': (config.DB_TRIPS_TABLE, lambda zonesPath: queries.odMatrix(zonesPath, '06:00:00', '10:00:00')),
+    'odMatrix[arrivalTime]': (config.DB_TRIPS_TABLE, lambda zonesPath: queries.odMatrix(zonesPath, '06:00:00', '10:00:00', ignoreArrivalTime=False)),
+    'odMatrix[concurrency]': (config.DB_TRIPS_TABLE, lambda zonesPath: queries.odMatrix(zonesPath, '06:00:00', '10:00:00', concurrency=4)),
+    'odCube': (config.DB_TRIPS_TABLE, lambda zonesPath: queries.odCube(zonesPath, '06:00:00', '10:00:00', 60, ['main_mode'])),
+    'activitySequences': (config.DB_PLANS_TABLE, lambda zonesPath: queries.activitySequences(zonesPath, '06:00:00', '10:00:00', 15)),
+    'activitySequences[sql]': (config.DB_PLANS_TABLE, lambda zonesPath: queries.activitySequences(zonesPath, '06:00:00', '10:00:00', 15, engine='sql')),
+    'iterateActivitySequences': (config.DB_PLANS_TABLE, lambda zonesPath: list(queries.iterateActivitySequences(zonesPath, '06:00:00', '10:00:00', 15))),
+}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark of the furbain converters and queries')
+    parser.add_argument('-f', '--scale-factors', type=float, nargs='+', default=[1], help=f'Sizes of the generated simulation outputs ({config.GENERATOR_AGENTS_PER_SCALE_FACTOR} agents per unit)')
+    parser.add_argument('-s', '--steps', nargs='+', choices=list(CONVERTER_STEPS) + list(QUERY_STEPS), help='Steps to run, by default all the converters then all the queries')
+    parser.add_argument('-o', '--output', help='Json file in which the results are written')
+    parser.add_argument('-b', '--baseline', help='Json file of the results the run is compared with')
+    parser.add_argument('-t', '--threshold', type=float, default=0.2, help='Relative increase of wall time or peak memory above which a step is a regression (default: 0.2)')
+    parser.add_argument('--save-baseline', action='store_true', help='Write the results in the baseline file instead of comparing them')
+    parser.add_argument('--skip-import', action='store_true', help='Keep the databases of the previous run and only run the queries')
+    parser.add_argument('--database-prefix', default=DEFAULT_DATABASE_PREFIX, help=f'Prefix of the databases, they are dropped and created again (default: {DEFAULT_DATABASE_PREFIX})')
+    parser.add_argument('--data-directory', default=DEFAULT_DATA_DIRECTORY_PATH, help='Directory of the generated simulation outputs, they are reused between runs')
+    parser.add_argument('--zones', default=DEFAULT_ZONES_PATH, help='Geojson file of the zones used by the queries')
+    parser.add_argument('--no-compact-types', action='store_true', help='Keep the types of the parsed files (config.USE_COMPACT_TYPES = False), to measure the memory saved by the compact types')
+    args = parser.parse_args(args)
+
+    steps = args.steps or list(CONVERTER_STEPS) + list(QUERY_STEPS)
+    if args.skip_import:
+        steps = [step for step in steps if step in QUERY_STEPS]
+
+    results = runBenchmarks(args.scale_factors, steps, args.database_prefix, args.data_directory, args.zones, not args.skip_import, not args.no_compact_types)
+    report = {
+        'createdAt': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'compactTypes': not args.no_compact_types,
+        'results': results,
+    }
+
+    if args.output:
+        _writeJson(args.output, report)
+
+    if args.save_baseline:
+        if not args.baseline:
+            raise Exception('--save-baseline needs the path of the baseline file (--baseline)')
+        _writeJson(args.baseline, report)
+        print(f'Baseline saved in {args.baseline}')
+    elif args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        regressions = compareWithBaseline(results, baseline['results'], args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+# Runs the steps on a simulation output of each scale factor, returns one result per step and scale factor
+# the simulation outputs are generated in dataDirectoryPath if they don't exist yet
+def runBenchmarks(scaleFactors, steps, databasePrefix=DEFAULT_DATABASE_PREFIX, dataDirectoryPath=DEFAULT_DATA_DIRECTORY_PATH, zonesPath=DEFAULT_ZONES_PATH, importData=True, useCompactTypes=True):
+    results = []
+
+    for scaleFactor in scaleFactors:
+        simulationOutputPath = os.path.join(dataDirectoryPath, f'scale_{scaleFactor:g}') + '/'
+        if not os.path.exists(simulationOutputPath + config.getVariableInConfigurationFile('events_filename')):
+            generator.generateSimulationOutput(simulationOutputPath, scaleFactor)
+
+        databaseName = f'{databasePrefix}_{scaleFactor:g}'.replace('.', '_')
+        if importData:
+            _createEmptyDatabase(databaseName)
+
+        for step in steps:
+            print(f'----- {step} (scale factor {scaleFactor:g}) -----')
+            result = _runStepInNewProcess(step, databaseName, simulationOutputPath, zonesPath, useCompactTypes)
+            result.update({'scaleFactor': scaleFactor, 'nbAgents': max(1, round(config.GENERATOR_AGENTS_PER_SCALE_FACTOR * scaleFactor)), 'step': step})
+            results.append(result)
+
+            if 'error' in result:
+                print(f'{step} failed : {result["error"]}')
+            else:
+                print(f'{step} : {result["wallTimeInSeconds"]:.2f} s, {result["rowsPerSecond"]:.0f} rows/s, {result["peakRSSInMB"]:.0f} MB')
+
+    return results
+
+
+# Prints the comparison of the results with the baseline results and returns the regressions
+# the steps missing from the baseline, or failing in one of the runs, are not compared
+def compareWithBaseline(results, baselineResults, threshold):
+    baselineResultsByStep = {(result['scaleFactor'], result['step']): result for result in baselineResults}
+    regressions = []
+
+    print(f'{"step":<30}{"scale":>8}{"time (s)":>12}{"baseline":>12}{"memory (MB)":>14}{"baseline":>12}')
+    for result in results:
+        baselineResult = baselineResultsByStep.get((result['scaleFactor'], result['step']))
+        if baselineResult is None or 'error' in result or 'error' in baselineResult:
+            continue
+
+        isTimeRegression = (result['wallTimeInSeconds'] > baselineResult['wallTimeInSeconds'] * (1 + threshold)
+                            and result['wallTimeInSeconds'] - baselineResult['wallTimeInSeconds'] > MIN_WALL_TIME_DIFFERENCE_IN_SECONDS)
+        isMemoryRegression = result['peakRSSInMB'] > baselineResult['peakRSSInMB'] * (1 + threshold)
+        if isTimeRegression or isMemoryRegression:
+            regressions.append(result)
+
+        print(f'{result["step"]:<30}{result["scaleFactor"]:>8g}'
+              f'{result["wallTimeInSeconds"]:>12.2f}{baselineResult["wallTimeInSeconds"]:>12.2f}'
+              f'{result["peakRSSInMB"]:>14.0f}{baselineResult["peakRSSInMB"]:>12.0f}'
+              f'{"  REGRESSION" if isTimeRegression or isMemoryRegression else ""}')
+
+    print(f'{len(regressions)} regression(s) above {threshold:.0%}')
+    return regressions
+
+
+def _createEmptyDatabase(databaseName):
+    conn = databaseTools.connectToPostgres()
+    conn.execution_options(isolation_level="AUTOCOMMIT").execute(f'DROP DATABASE IF EXISTS "{databaseName}";')
+    conn.close()
+    databaseTools.createDatabase(databaseName)
+
+
+# Runs the step in a new process (not forked, its memory only holds the step) and returns its result
+def _runStepInNewProcess(step, databaseName, simulationOutputPath, zonesPath, useCompactTypes):
+    context = multiprocessing.get_context('spawn')
+    resultQueue = context.Queue()
+    process = context.Process(target=_runStep, args=(step, databaseName, simulationOutputPath, zonesPath, useCompactTypes, resultQueue))
+    process.start()
+    
+    # the process can be killed before putting its result (eg: by the out of memory killer), the queue is polled while it is alive
+    while True:
+        try:
+            result = resultQueue.get(timeout=1)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                try:
+                    result = resultQueue.get(timeout=1)
+                except queue.Empty:
+                    result = {'error': f'The process of the step exited with code {process.exitcode} without result', 'peakRSSInMB': None}
+                break
+    
+    process.join()
+    return result
+
+
+def _runStep(step, databaseName, simulationOutputPath, zonesPath, useCompactTypes, resultQueue):
+    # the simulation output path is only changed in this process, the configuration file is not modified
+    config.getSimulationOutputPath = lambda: simulationOutputPath
+    config.USE_COMPACT_TYPES = useCompactTypes
+    databaseTools.selectDatabase(databaseName, False)
+
+    try:
+        startTime = time.perf_counter()
+        if step in CONVERTER_STEPS:
+            getattr(converter, step)()
+            tables = CONVERTER_STEPS[step]
+            resultRows = None
+        else:
+            table, runQuery = QUERY_STEPS[step]
+            resultRows = _countResultRows(runQuery(zonesPath))
+            tables = [table]
+        wallTime = time.perf_counter() - startTime
+
+        conn = databaseTools.connectToDatabase()
+        rows = sum(conn.execute(f'SELECT count(*) FROM "{table}";').scalar() for table in tables)
+        conn.close()
+
+        resultQueue.put({
+            'rows': rows,
+            'resultRows': resultRows,
+            'wallTimeInSeconds': wallTime,
+            'rowsPerSecond': rows / wallTime if wallTime > 0 else 0,
+            'peakRSSInMB': _getPeakRSSInMB(),
+            'peakWorkersRSSInMB': _getPeakRSSInMB(resource.RUSAGE_CHILDREN),
+        })
+    except Exception as e:
+        resultQueue.put({'error': repr(e), 'peakRSSInMB': _getPeakRSSInMB()})
+
+
+# Peak memory of the process of the step plus the peak memory of its largest worker process (eg: the activity sequences pool),
+# the workers run while the process holds its own memory
+# who : resource.RUSAGE_CHILDREN to get the peak memory of the largest worker only
+# ru_maxrss is in kilobytes on linux and in bytes on macOS
+def _getPeakRSSInMB(who=None):
+    whos = [resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN] if who is None else [who]
+    peakRSS = sum(resource.getrusage(currentWho).ru_maxrss for currentWho in whos)
+    return peakRSS / (1024 * 1024) if sys.platform == 'darwin' else peakRSS / 1024
+
+
+# Number of rows of the result of a query : dataframes, lists or dictionaries of dataframes, OD cubes and OD matrices
+def _countResultRows(result):
+    if isinstance(result, pd.DataFrame):
+        return len(result)
+    elif isinstance(result, dict):
+        return sum(_countResultRows(value) for value in result.values())
+    elif isinstance(result, list):
+        return sum(_countResultRows(value) if isinstance(value, (pd.DataFrame, list)) else 1 for value in result)
+    elif isinstance(result, queries.ODCube):
+        return result.nnz
+    return 1
+
+
+def _writeJson(filePath, content):
+    with open(filePath, 'w') as f:
+        json.dump(content, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -21,6 +21,7 @@ setup(
         "geoalchemy2 >= 0.12.2",
         "geopandas >= 0.9.0",
         "pandas >= 1.4.3",
+        "numpy >= 1.21.0",
         "sqlalchemy >= 1.4.39, <= 1.4.46", # https://stackoverflow.com/questions/75315117/attributeerror-connection-object-has-no-attribute-connect-when-use-df-to-sq
         "shapely >= 1.7.1",
         "tqdm >= 4.64.1",
@@ -28,6 +29,7 @@ setup(
         "geojson >= 2.5.0",
         "protobuf == 3.20.0",
         "psycopg2 == 2.9.3",
+        "pyarrow >= 7.0.0",
         f"matsim_tools @ file://localhost/{os.getcwd()}/resources/setup/matsim_tools-1.0.5-py3-none-any.whl"
     ],
     entry_points={
@@ -1,4 +1,16 @@
-from furbain import config
+import importlib
 
-# Create the config file if it doesn't exist
-config.createConfigurationFile()
\ No newline at end of file
+# The modules are imported when they are first used, so that importing furbain (or running the command line tool)
+# does not load the database, dataframe and geometry libraries
+# The configuration file is created when it is first read or written (see config.loadConfigurationFile)
+_SUBMODULES = ['compactTypes', 'config', 'converter', 'databaseTools', 'exporter', 'generator', 'inputCache', 'parquetCache', 'profiler', 'queries', 'queryCache', 'tools']
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals()) + _SUBMODULES)
@@ -0,0 +1,135 @@
+from furbain import config
+from furbain import profiler
+import numpy as np
+import pandas as pd
+
+
+# Converts the columns of the dataframe to compact types, right after the file is parsed, and returns it
+# categories : string columns with repeated values (link ids, facility ids, types, modes...), stored as categorical (an integer code per row)
+# integers : integer columns (person ids, counts, distances), stored with the smallest integer type holding their values
+# times : times ('hh:mm:ss' strings, or seconds), stored as integer seconds, converted even if config.USE_COMPACT_TYPES is False
+# The missing columns are ignored
+# If profiled, the memory of the dataframe before and after the conversion is added to the stage "compact" (see profiler.stage)
+def compactDataframe(dataframe, categories=[], integers=[], times=[]):
+    with profiler.stage('compact') as currentStage:
+        # the stage is an empty dictionary outside of a profile, the memory is not computed
+        if currentStage:
+            currentStage['rows'] = len(dataframe)
+            currentStage['memoryBeforeInMB'] = _getMemoryInMB(dataframe)
+
+        dataframe = _compactColumns(dataframe, categories, integers, times)
+
+        if currentStage:
+            currentStage['memoryAfterInMB'] = _getMemoryInMB(dataframe)
+    return dataframe
+
+
+# Same as compactDataframe for the records (dictionaries) of an iterable (eg: the events of the events reader)
+# the records are converted by chunks of config.LOAD_CHUNK_SIZE, so they are never all in memory as python objects
+# columns : the attributes kept, by default all of them
+def readCompactDataframe(records, categories=[], integers=[], times=[], columns=None):
+    if not config.USE_COMPACT_TYPES:
+        return compactDataframe(pd.DataFrame.from_records(records, columns=columns), times=times)
+
+    with profiler.stage('compact') as currentStage:
+        # the integer types and the types of the times are chosen on the whole dataframe, they could be different in each chunk
+        # (eg: a chunk with integer times and a chunk with fractions of seconds), the times are converted again after the concatenation
+        chunks = [_compactColumns(pd.DataFrame.from_records(chunk, columns=columns), categories, [], times) for chunk in _iterateChunks(records, config.LOAD_CHUNK_SIZE)]
+        dataframe = _compactColumns(_concatCompactChunks(chunks, categories), [], integers, times)
+
+        if currentStage:
+            currentStage['rows'] = len(dataframe)
+            currentStage['memoryAfterInMB'] = _getMemoryInMB(dataframe)
+    return dataframe
+
+
+# Same as compactDataframe for a csv file, the categorical columns are read as categorical, without creating a string per row
+def readCompactCsv(filePath, separator, categories=[], integers=[], times=[]):
+    if not config.USE_COMPACT_TYPES:
+        return compactDataframe(pd.read_csv(filePath, sep=separator), times=times)
+
+    with profiler.stage('compact') as currentStage:
+        dataframe = pd.read_csv(filePath, sep=separator, dtype={column: 'category' for column in categories})
+        dataframe = _compactColumns(dataframe, [], integers, times)
+
+        if currentStage:
+            currentStage['rows'] = len(dataframe)
+            currentStage['memoryAfterInMB'] = _getMemoryInMB(dataframe)
+    return dataframe
+
+
+def _compactColumns(dataframe, categories, integers, times):
+    for column in [column for column in times if column in dataframe.columns]:
+        dataframe[column] = _getTimesInSeconds(dataframe[column])
+
+    if not config.USE_COMPACT_TYPES:
+        return dataframe
+
+    for column in [column for column in categories if column in dataframe.columns]:
+        dataframe[column] = dataframe[column].astype('category')
+
+    for column in [column for column in integers if column in dataframe.columns]:
+        if pd.api.types.is_numeric_dtype(dataframe[column]):
+            dataframe[column] = dataframe[column].astype(_getSmallestIntegerType(dataframe[column]))
+    return dataframe
+
+
+# Same as tools.getTimeInSeconds for a column of times, returns integer seconds
+# the numbers are already seconds (eg: the times of the events), they are kept as floats if they are not all integers
+# the fractions of seconds of the 'hh:mm:ss' strings are truncated (eg: '09:30:12.5' is 34212)
+def _getTimesInSeconds(times):
+    if pd.api.types.is_numeric_dtype(times):
+        values = times.dropna()
+        return times.astype('Int32') if (values == values.round()).all() else times.astype('float64')
+
+    timeParts = times.where(times.map(lambda time: isinstance(time, str))).str.split(':', expand=True)
+    if timeParts.shape[1] < 3:
+        return pd.Series(pd.NA, index=times.index, dtype='Int32')
+    hours, minutes, seconds = [np.floor(pd.to_numeric(timeParts[index])).astype('Int32') for index in range(3)]
+    return hours * 3600 + minutes * 60 + seconds
+
+
+# Returns the smallest integer type holding the values of the column, nullable if it has missing values
+# the type of the column is kept if its values are not all integers
+def _getSmallestIntegerType(column):
+    values = column.dropna()
+    if len(values) > 0 and not (values == values.round()).all():
+        return column.dtype
+
+    nullable = column.isna().any() or pd.api.types.is_extension_array_dtype(column)
+    for bits in [8, 16, 32]:
+        integerInfo = np.iinfo(f'int{bits}')
+        if len(values) == 0 or (values.min() >= integerInfo.min and values.max() <= integerInfo.max):
+            return f'Int{bits}' if nullable else f'int{bits}'
+    return 'Int64' if nullable else 'int64'
+
+
+def _iterateChunks(records, chunkSize):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunkSize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Concatenates the chunks, the categorical columns keep their type (the categories of the chunks are merged)
+def _concatCompactChunks(chunks, categories):
+    if not chunks:
+        return pd.DataFrame()
+
+    for column in categories:
+        chunksColumn = [chunk[column] for chunk in chunks if column in chunk.columns]
+        if not chunksColumn:
+            continue
+
+        dtype = pd.CategoricalDtype(pd.api.types.union_categoricals(chunksColumn, ignore_order=True).categories)
+        for chunk in chunks:
+            chunk[column] = chunk[column].astype(dtype) if column in chunk.columns else pd.Series(None, index=chunk.index, dtype=dtype)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def _getMemoryInMB(dataframe):
+    return dataframe.memory_usage(deep=True).sum() / (1024 * 1024)
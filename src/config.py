@@ -1,4 +1,3 @@
-import sqlalchemy.types as types
 import pathlib
 import json
 from os.path import isdir
@@ -16,6 +15,11 @@ DB_PERSONS_TABLE = 'person'
 DB_PLANS_TABLE = 'activity'
 DB_TRIPS_TABLE = 'trip'
 DB_BUILDINGS_TABLE = 'building'
+DB_AGENT_TIMELINES_TABLE = 'agentTimeline' # derived from the activity table at import
+DB_ACTIVITIES_AGGREGATE_TABLE = 'activityFacilityHour' # aggregate tables, derived from the imported tables
+DB_TRIPS_AGGREGATE_TABLE = 'tripFacilityHour'
+DB_LINK_TRAFFIC_AGGREGATE_TABLE = 'linkTrafficRoadClassHour'
+DB_IMPORT_MANIFEST_TABLE = 'importManifest' # last import of each table, used as the data version of the query cache
 
 # Separators for the csv files
 PERSONS_CSV_SEPARATOR = ';'
@@ -27,21 +31,41 @@ DETAILED_NETWORK_CSV_SEPARATOR = ','
 ARABESQUE_DEFAULT_SRID = '4326' # EPSG used by Arabesque
 ARABESQUE_GENERATED_FILES_DIRECTORY_PATH = './output/'
 
+OD_CUBE_BREAKDOWNS = ['main_mode', 'longest_distance_mode'] # trip columns that can be used as dimensions of the OD cube
+OD_CUBE_UNKNOWN_LABEL = 'unknown' # label used in the OD cube when the breakdown column of a trip is null
+
+STREAM_CHUNK_SIZE = 100000 # number of rows of the chunks yielded by the iterate functions (server-side cursors)
+
+QUERIES_ZONE_TABLE_NAME = 'queryZone' # temporary table (one per connection) in which the zones of the geojson file are uploaded
+QUERIES_FACILITY_ZONE_TABLE_NAME = 'queryFacilityZone' # zones of the facilities, shared by the connections of a concurrent query then dropped
+
 ACTIVITY_SEQUENCES_TABLE_NAME = 'activitySequences'
 ACTIVITY_SEQUENCES_TABLE_TIME_FORMAT = '%d_%m_%Y_%H_%M_%S' # time used to indicate when the table was generated, it will be added to the table name
-ACTIVITY_SEQUENCES_TABLE_COLUMNS = {
-    "id": types.Integer,
-    "personId": types.Integer,
-    "periodStart": types.Interval,
-    "periodEnd": types.Interval,
-    "mainActivityId": types.Integer,
-    "startActivityId": types.Integer,
-    "endActivityId": types.Integer,
-    "mainActivityStartTime": types.Interval,
-    "mainActivityEndTime": types.Interval,
-    "timeSpentInMainActivity": types.Interval
-}
-ACTIVITY_SEQUENCES_DB_PROGRESS_BAR_PERCENTAGE = 5 # the progress bar will be updated every 10% of the table
+# ACTIVITY_SEQUENCES_TABLE_COLUMNS : sqlalchemy types of the columns of the table, see __getattr__ at the end of the file
+ACTIVITY_SEQUENCES_MIN_AGENTS_PER_TASK = 500 # minimum number of agents computed by a process at once, smaller zones use less processes
+ACTIVITY_SEQUENCES_TASKS_PER_PROCESS = 4 # number of tasks given to each process when the batch size is not set, to balance the load
+
+QUERY_CACHE_DIRECTORY_PATH = pathlib.Path.home() / '.furbain' / 'cache' # results of the queries called with useCache=True
+QUERY_CACHE_MAX_SIZE_IN_MB = 1024 # the least recently used results are deleted when the cache is bigger
+
+
+# ===== IMPORT =====
+LOAD_CONCURRENCY = 4 # number of connections loading the activity, trip and traffic tables in parallel
+LOAD_CHUNK_SIZE = 100000 # number of rows copied at once by each connection
+PARTITION_HASH_MODULUS = 8 # number of partitions of the tables partitioned by the hash of personId
+PARTITION_TIME_RANGE_IN_SECONDS = 4 * 3600 # time span of each partition of the tables partitioned by time
+
+USE_INPUT_CACHE = True # the parsed network and facilities files are stored and reused until the files are modified
+INPUT_CACHE_DIRECTORY_PATH = pathlib.Path.home() / '.furbain' / 'inputs'
+INPUT_CACHE_MAX_SIZE_IN_MB = 4096 # the least recently used parsed files are deleted when the cache is bigger
+USE_COMPACT_TYPES = True # the parsed activities, trips and events are stored with compact types (categorical strings, small integers), see compactTypes
+
+
+# ===== GENERATOR =====
+GENERATOR_AGENTS_PER_SCALE_FACTOR = 1000 # number of agents generated with a scale factor of 1
+GENERATOR_CENTER = (354650, 6692110) # center of the generated network (EPSG:2154), the zones of resources/sample can be used on the generated data
+GENERATOR_NODE_SPACING_IN_METERS = 200 # distance between two nodes of the generated grid network
+GENERATOR_EVENTS_BUCKET_IN_SECONDS = 300 # the events are written in time buckets then sorted bucket by bucket
 
 
 # ===== CONFIGURATION ENV =====
@@ -196,4 +220,25 @@ def getDetailedNetworkPath():
     return getSimulationOutputPath() + getVariableInConfigurationFile('detailed_network_filename')
 
 def getBuildingsPath():
-    return getSimulationOutputPath() + getVariableInConfigurationFile('buildings_filename')
\ No newline at end of file
+    return getSimulationOutputPath() + getVariableInConfigurationFile('buildings_filename')
+
+
+# The constants holding sqlalchemy types are created when they are first used, so reading the configuration does not import sqlalchemy
+def __getattr__(name):
+    if name == 'ACTIVITY_SEQUENCES_TABLE_COLUMNS':
+        import sqlalchemy.types as types
+        globals()[name] = {
+            "id": types.Integer,
+            "zoneId": types.Integer,
+            "personId": types.Integer,
+            "periodStart": types.Interval,
+            "periodEnd": types.Interval,
+            "mainActivityId": types.Integer,
+            "startActivityId": types.Integer,
+            "endActivityId": types.Integer,
+            "mainActivityStartTime": types.Interval,
+            "mainActivityEndTime": types.Interval,
+            "timeSpentInMainActivity": types.Interval
+        }
+        return globals()[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -1,11 +1,32 @@
-from . import activities, events, facilities, households, networkLinks, persons, trips, vehicles, buildings
-
-importActivities = activities.importActivities
-importEvents = events.importEvents
-importFacilities = facilities.importFacilities
-importHouseholds = households.importHouseholds
-importNetworkLinks = networkLinks.importNetworkLinks
-importPersons = persons.importPersons
-importTrips = trips.importTrips
-importVehicles = vehicles.importVehicles
-importBuildings = buildings.importBuildings
\ No newline at end of file
+import importlib
+
+# The converters are imported when they are first used, the readers and dataframe libraries are only loaded by the called converter
+# name of each converter : module defining it
+_CONVERTERS = {
+    'importActivities': 'activities',
+    'importEvents': 'events',
+    'importFacilities': 'facilities',
+    'importHouseholds': 'households',
+    'importNetworkLinks': 'networkLinks',
+    'importPersons': 'persons',
+    'importTrips': 'trips',
+    'importVehicles': 'vehicles',
+    'importBuildings': 'buildings',
+    'importAgentTimelines': 'agentTimelines',
+    'importAggregates': 'aggregates',
+}
+_SUBMODULES = sorted(set(_CONVERTERS.values()))
+
+
+def __getattr__(name):
+    if name in _CONVERTERS:
+        converter = getattr(importlib.import_module(f'.{_CONVERTERS[name]}', __name__), name)
+        globals()[name] = converter
+        return converter
+    if name in _SUBMODULES:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_CONVERTERS) + _SUBMODULES)
@@ -1,26 +1,55 @@
-import matsim.Plans as Plans
 from furbain import config
-from furbain import tools
+from furbain import compactTypes
 from furbain import databaseTools
-import pandas as pd
-from geoalchemy2 import Geometry
+from furbain import profiler
+from furbain.converter import plansReader
+from furbain.converter.agentTimelines import importAgentTimelines
+from furbain.converter.aggregates import importActivitiesAggregate
 
 
-def importActivities():
-    plansDataframes = Plans.plan_reader_dataframe(experienced_plans_filepath=config.getExperiencedPlansPath(), plans_filepath=config.getPlansPath(), facilities_file_path=config.getFacilitiesPath())
-    activitiesDataframe = plansDataframes.activities
-    plans = plansDataframes.plans
+# partitioning : if 'hash', the table is partitioned by the hash of personId, if 'time', by ranges of start_time_seconds (see databaseTools.createPartitions)
+#                the queries on a time window only read its partitions when the table is partitioned by time
+#                (and the default partition, holding the activities without start time)
+@profiler.profiled
+def importActivities(partitioning=None):
+    partitionByClause = databaseTools.getPartitionByClause(partitioning, hashColumn='personId', timeColumn='start_time_seconds')
+    # the rows are added to the existing table, it must have the seconds columns
+    conn = databaseTools.connectToDatabase()
+    databaseTools.checkTimesInSeconds(conn, config.DB_PLANS_TABLE)
+    conn.close()
     
-    # Correcting start_time and end_time format
-    activitiesDataframe['start_time'] = activitiesDataframe['start_time'].apply(lambda x: tools.formatTimeToIntervalType(x))
-    activitiesDataframe['end_time'] = activitiesDataframe['end_time'].apply(lambda x: tools.formatTimeToIntervalType(x))
+    # Creating the tables in the database
+    with profiler.stage('createTable'):
+        _createActivityTable(partitioning, partitionByClause)
+        if partitioning is not None:
+            # the time partitions are created while the activities are loaded
+            conn = databaseTools.connectToDatabase()
+            databaseTools.createPartitions(conn, config.DB_PLANS_TABLE, partitioning)
+            conn.close()
     
-    # Creating a point from coordinates
-    activitiesDataframe['location'] = activitiesDataframe.apply(lambda row: 'POINT({} {})'.format(row['x'], row['y']), axis=1)
+    # Reading, converting and importing the activities by batches, the plans files are parsed as a stream
+    with profiler.stage('load') as currentStage:
+        activitiesBatches = plansReader.iterateActivities(config.getExperiencedPlansPath(), config.getPlansPath(), config.getFacilitiesPath(), config.LOAD_CHUNK_SIZE)
+        timeColumn = 'start_time_seconds' if partitioning == 'time' else None
+        currentStage['rows'] = databaseTools.copyDataframesToTableConcurrently(map(_transformActivities, activitiesBatches), config.DB_PLANS_TABLE, timeColumn=timeColumn)
+        
+        conn = databaseTools.connectToDatabase()
+        databaseTools.recordTableImport(conn, config.DB_PLANS_TABLE)
+        conn.close()
+    
+    # The timelines of the agents and the aggregate table are derived from the imported activities
+    importAgentTimelines()
+    importActivitiesAggregate()
+
+
+def _transformActivities(activitiesDataframe):
+    # Converting start_time and end_time to seconds, the interval columns are generated by the database
+    activitiesDataframe = compactTypes.compactDataframe(activitiesDataframe, categories=['type', 'link', 'facility', 'typeBeforeCutting'], times=['start_time', 'end_time'])
+    activitiesDataframe['start_time_seconds'] = activitiesDataframe['start_time']
+    activitiesDataframe['end_time_seconds'] = activitiesDataframe['end_time']
     
-    # associating the activities to the persons in the plans
-    plans.rename(columns={'id':'plan_id'}, inplace=True)
-    activitiesDataframe = pd.merge(activitiesDataframe, plans, on=['plan_id'], how='left')
+    # Creating a point from coordinates, the locations are parsed by postgis from their wkt
+    activitiesDataframe['location'] = activitiesDataframe.apply(lambda row: 'POINT({} {})'.format(row['x'], row['y']), axis=1)
     
     # Renaming the columns to match the database
     activitiesDataframe.rename(columns={
@@ -30,18 +59,15 @@ def importActivities():
     }, inplace = True)
     
     # removing unused columns
-    activitiesDataframe.drop(columns=['x', 'y', 'plan_id', 'score', 'selected'], inplace=True)
-    
-    # Creating the tables in the database
-    _createActivityTable()
-    
-    # Importing the data to the database
-    conn = databaseTools.connectToDatabase()
-    activitiesDataframe.to_sql(config.DB_PLANS_TABLE, con=conn, if_exists='append', index=False, dtype={'location': Geometry('POINT', srid=config.getDatabaseSRID())})
-    conn.close()
+    activitiesDataframe.drop(columns=['x', 'y', 'start_time', 'end_time'], inplace=True)
+    return activitiesDataframe
 
 
-def _createActivityTable():
+# the partition key of a partitioned table is part of its primary key, the start time of the activities can be null
+# so the table partitioned by time has no primary key, the ids are indexed instead
+def _createActivityTable(partitioning=None, partitionByClause=''):
+    primaryKey = {None: 'CONSTRAINT activity_pkey PRIMARY KEY (id),', 'hash': 'CONSTRAINT activity_pkey PRIMARY KEY (id, "personId"),', 'time': ''}[partitioning]
+    
     conn = databaseTools.connectToDatabase()
     conn.execute(f"""
         CREATE TABLE IF NOT EXISTS "{config.DB_PLANS_TABLE}" (
@@ -49,14 +75,16 @@ def _createActivityTable():
             type character varying(40) COLLATE pg_catalog."default",
             location geometry,
             z numeric(40,20),
-            start_time interval,
-            end_time interval,
+            start_time_seconds integer,
+            end_time_seconds integer,
+            start_time interval GENERATED ALWAYS AS (start_time_seconds * interval '1 second') STORED,
+            end_time interval GENERATED ALWAYS AS (end_time_seconds * interval '1 second') STORED,
             max_dur interval,
             "typeBeforeCutting" character varying(40) COLLATE pg_catalog."default",
             "linkId" character varying(40) COLLATE pg_catalog."default",
             "facilityId" character varying(40) COLLATE pg_catalog."default",
             "personId" integer,
-            CONSTRAINT activity_pkey PRIMARY KEY (id),
+            {primaryKey}
             CONSTRAINT "activity_facilityId_fkey" FOREIGN KEY ("facilityId")
                 REFERENCES public.{config.DB_FACILITIES_TABLE} (id) MATCH SIMPLE
                 ON UPDATE NO ACTION
@@ -69,6 +97,10 @@ def _createActivityTable():
                 REFERENCES public.{config.DB_PERSONS_TABLE} (id) MATCH SIMPLE
                 ON UPDATE NO ACTION
                 ON DELETE NO ACTION
-        );
+        ) {partitionByClause};
     """)
+    conn.execute(f'CREATE INDEX IF NOT EXISTS "activity_start_time_seconds_idx" ON "{config.DB_PLANS_TABLE}" (start_time_seconds);')
+    conn.execute(f'CREATE INDEX IF NOT EXISTS "activity_end_time_seconds_idx" ON "{config.DB_PLANS_TABLE}" (end_time_seconds);')
+    if partitioning == 'time':
+        conn.execute(f'CREATE INDEX IF NOT EXISTS "activity_id_idx" ON "{config.DB_PLANS_TABLE}" (id);')
     conn.close()
\ No newline at end of file
@@ -0,0 +1,32 @@
+from furbain import config
+from furbain import databaseTools
+from furbain import profiler
+
+
+# Creates the table holding the timeline of each agent, derived from the activity table
+# one row per agent with the ids, start times and end times (in seconds) of its activities,
+# ordered by start time (null start times last) then id, the null times are kept as null elements
+# The queries read the timelines of the agents instead of sorting their activities again
+@profiler.profiled
+def importAgentTimelines():
+    conn = databaseTools.connectToDatabase()
+    with profiler.stage('query') as currentStage:
+        conn.execute(f'DROP TABLE IF EXISTS "{config.DB_AGENT_TIMELINES_TABLE}";')
+        # the agents of an activity table partitioned by personId are grouped partition by partition
+        conn.execute('SET enable_partitionwise_aggregate = on;')
+        result = conn.execute(f"""
+            CREATE TABLE "{config.DB_AGENT_TIMELINES_TABLE}" AS
+            SELECT "personId",
+                   array_agg(id ORDER BY start_time_seconds ASC NULLS LAST, id) AS "activityIds",
+                   array_agg(start_time_seconds ORDER BY start_time_seconds ASC NULLS LAST, id) AS "startTimes",
+                   array_agg(end_time_seconds ORDER BY start_time_seconds ASC NULLS LAST, id) AS "endTimes"
+            FROM "{config.DB_PLANS_TABLE}"
+            WHERE "personId" is not null
+            GROUP BY "personId";
+        """)
+        currentStage['rows'] = result.rowcount
+    
+    with profiler.stage('index'):
+        conn.execute(f'ALTER TABLE "{config.DB_AGENT_TIMELINES_TABLE}" ADD PRIMARY KEY ("personId");')
+    databaseTools.recordTableImport(conn, config.DB_AGENT_TIMELINES_TABLE)
+    conn.close()
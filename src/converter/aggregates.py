@@ -0,0 +1,80 @@
+from furbain import config
+from furbain import databaseTools
+from furbain import profiler
+
+
+# Creates (or refreshes) every aggregate table whose source tables exist
+# The aggregate tables are derived from the imported tables, the queries read them instead of the raw rows
+# when the request matches their granularity (one hour)
+def importAggregates():
+    tables = databaseTools.getTablesFromDatabase()
+
+    if config.DB_PLANS_TABLE in tables:
+        importActivitiesAggregate()
+    if config.DB_TRIPS_TABLE in tables:
+        importTripsAggregate()
+    if config.DB_EVENTS_TABLE in tables:
+        importLinkTrafficAggregate()
+
+
+# Number of activities starting in each facility during each hour, by type of activity
+# the activities without start time or facility are not counted
+@profiler.profiled
+def importActivitiesAggregate():
+    _createAggregateTable(config.DB_ACTIVITIES_AGGREGATE_TABLE, f"""
+        SELECT "facilityId", start_time_seconds / 3600 AS hour, type, count(*) AS "activityCount"
+        FROM "{config.DB_PLANS_TABLE}"
+        WHERE start_time_seconds is not null and "facilityId" is not null
+        GROUP BY "facilityId", start_time_seconds / 3600, type
+    """, ['"facilityId"', 'hour'])
+
+
+# Number of trips between each couple of facilities departing during each hour, by main mode and longest distance mode
+# dep_time_seconds is the start of the hour, the time conditions of the queries on the trip table can be used
+# on the aggregate table if their times are multiples of one hour
+@profiler.profiled
+def importTripsAggregate():
+    _createAggregateTable(config.DB_TRIPS_AGGREGATE_TABLE, f"""
+        SELECT start_facility_id, end_facility_id, dep_time_seconds / 3600 * 3600 AS dep_time_seconds,
+               main_mode, longest_distance_mode, count(*) AS "tripCount"
+        FROM "{config.DB_TRIPS_TABLE}"
+        WHERE dep_time_seconds is not null
+        GROUP BY start_facility_id, end_facility_id, dep_time_seconds / 3600, main_mode, longest_distance_mode
+    """, ['start_facility_id', 'end_facility_id', 'dep_time_seconds'])
+
+
+# Traffic of each road class (osm_way_highway of the links) during each hour
+# the hour of a time step is the hour of its start, the mean speed is weighted by the number of vehicles
+# The road classes are read from the network links, without them the table is not created and the aggregate of a previous
+# import is deleted (it would not match the imported traffic), roadClassTraffic() then reads the traffic table
+@profiler.profiled
+def importLinkTrafficAggregate():
+    tables = databaseTools.getTablesFromDatabase()
+    if config.DB_NETWORK_TABLE not in tables or config.DB_EVENTS_TABLE not in tables:
+        if config.DB_LINK_TRAFFIC_AGGREGATE_TABLE in tables:
+            databaseTools.deleteTable(config.DB_LINK_TRAFFIC_AGGREGATE_TABLE)
+        print(f"Aggregate table {config.DB_LINK_TRAFFIC_AGGREGATE_TABLE} not created, it needs the tables {config.DB_NETWORK_TABLE} and {config.DB_EVENTS_TABLE}")
+        return
+    
+    _createAggregateTable(config.DB_LINK_TRAFFIC_AGGREGATE_TABLE, f"""
+        SELECT t."startTimeSeconds" / 3600 AS hour, l.osm_way_highway,
+               sum(t."vehicleCount") AS "vehicleCount",
+               sum(t."meanSpeed" * t."vehicleCount") / nullif(sum(t."vehicleCount"), 0) AS "meanSpeed"
+        FROM "{config.DB_EVENTS_TABLE}" t
+        JOIN "{config.DB_NETWORK_TABLE}" l ON l.id = t."linkId"
+        GROUP BY t."startTimeSeconds" / 3600, l.osm_way_highway
+    """, ['hour'])
+
+
+# Replaces the aggregate table by the result of the query, then indexes the given columns
+def _createAggregateTable(tableName, query, indexedColumns):
+    print(f"Refreshing aggregate table {tableName}...")
+    conn = databaseTools.connectToDatabase()
+    with profiler.stage('query') as currentStage:
+        conn.execute(f'DROP TABLE IF EXISTS "{tableName}";')
+        currentStage['rows'] = conn.execute(f'CREATE TABLE "{tableName}" AS {query};').rowcount
+    with profiler.stage('index'):
+        conn.execute(f'CREATE INDEX ON "{tableName}" ({", ".join(indexedColumns)});')
+        conn.execute(f'ANALYZE "{tableName}";')
+    databaseTools.recordTableImport(conn, tableName)
+    conn.close()
@@ -1,14 +1,20 @@
 import collections
 from furbain import config
 from furbain import databaseTools
+from furbain import profiler
 import pandas as pd
 import json
 from geoalchemy2 import Geometry
 
+@profiler.profiled
 def importBuildings():
     
-    with open(config.getBuildingsPath(), 'r') as buildingsJson:
-        buildings = json.load(buildingsJson)        
+    with profiler.stage('read') as currentStage:
+        with open(config.getBuildingsPath(), 'r') as buildingsJson:
+            buildings = json.load(buildingsJson)
+        currentStage['rows'] = len(buildings['features'])
+    
+    with profiler.stage('transform'):
         polygonFeaturesDict = collections.defaultdict(list)
         
         for feature in buildings['features']:
@@ -32,13 +38,17 @@ def importBuildings():
             
         polygonDataframe = pd.DataFrame(polygonFeaturesDict)
         
-        # Creating the tables in the database
+    # Creating the tables in the database
+    with profiler.stage('createTable'):
         _createBuildingTable()
-        
-        # Importing the data to the database        
+    
+    # Importing the data to the database        
+    with profiler.stage('load') as currentStage:
         conn = databaseTools.connectToDatabase()
         polygonDataframe.to_sql(config.DB_BUILDINGS_TABLE, con=conn, if_exists='append', index=False, dtype={'geom': Geometry('POLYGON', srid=config.getDatabaseSRID())})
+        databaseTools.recordTableImport(conn, config.DB_BUILDINGS_TABLE)
         conn.close()
+        currentStage['rows'] = len(polygonDataframe)
 
 
 def _createBuildingTable():
@@ -1,37 +1,69 @@
 import matsim.Events as Events
-import matsim.Network as Network
+from furbain import compactTypes
 from furbain import config
-from furbain import tools
+from furbain import inputCache
 from furbain import databaseTools
+from furbain import profiler
+from furbain.converter.aggregates import importLinkTrafficAggregate
 import pandas as pd
 import collections
 import math
 
 
-def importEvents(timeStepInMinutes=60, useRoundedTime=True):
+# attributes of the events used to compute the traffic, the other attributes are not kept in memory
+EVENTS_COLUMNS = ['time', 'type', 'link']
+# attributes of the events stored as categorical (see compactTypes)
+EVENTS_CATEGORY_COLUMNS = ['type', 'link']
+
+# partitioning : if 'time', the table is partitioned by ranges of startTimeSeconds (see databaseTools.createPartitions),
+#                the queries on a time window only read its partitions
+@profiler.profiled
+def importEvents(timeStepInMinutes=60, useRoundedTime=True, partitioning=None):
+    partitionByClause = databaseTools.getPartitionByClause(partitioning, timeColumn='startTimeSeconds')
+    # the rows are added to the existing table, it must have the seconds columns
+    conn = databaseTools.connectToDatabase()
+    databaseTools.checkTimesInSeconds(conn, config.DB_EVENTS_TABLE)
+    conn.close()
+    
     eventsResultsDataframe = _getEventsVehicleCountAndMeanSpeed(timeStepInMinutes, useRoundedTime)
     
     # Creating the tables in the database
-    _createEventsTable()
+    with profiler.stage('createTable'):
+        _createEventsTable(partitionByClause)
+        if partitioning is not None:
+            conn = databaseTools.connectToDatabase()
+            databaseTools.createPartitions(conn, config.DB_EVENTS_TABLE, partitioning, eventsResultsDataframe['startTimeSeconds'])
+            conn.close()
     
     # Importing the data to the database
-    conn = databaseTools.connectToDatabase()
-    eventsResultsDataframe.to_sql(config.DB_EVENTS_TABLE, con=conn, if_exists='append', index=False)
-    conn.close()
+    with profiler.stage('load') as currentStage:
+        timeColumn = 'startTimeSeconds' if partitioning == 'time' else None
+        databaseTools.copyDataframeToTableConcurrently(eventsResultsDataframe, config.DB_EVENTS_TABLE, timeColumn=timeColumn)
+        
+        conn = databaseTools.connectToDatabase()
+        databaseTools.recordTableImport(conn, config.DB_EVENTS_TABLE)
+        conn.close()
+        currentStage['rows'] = len(eventsResultsDataframe)
+    
+    # The aggregate table is derived from the imported traffic and the road classes of the network links
+    importLinkTrafficAggregate()
     
 
-def _createEventsTable():
+def _createEventsTable(partitionByClause=''):
     conn = databaseTools.connectToDatabase()
     conn.execute(f"""
         CREATE TABLE IF NOT EXISTS "{config.DB_EVENTS_TABLE}" (
             "linkId" character varying(40) COLLATE pg_catalog."default" NOT NULL,
-            "startTime" interval NOT NULL,
-            "endTime" interval NOT NULL,
+            "startTimeSeconds" integer NOT NULL,
+            "endTimeSeconds" integer NOT NULL,
+            "startTime" interval GENERATED ALWAYS AS ("startTimeSeconds" * interval '1 second') STORED,
+            "endTime" interval GENERATED ALWAYS AS ("endTimeSeconds" * interval '1 second') STORED,
             "vehicleCount" integer,
             "meanSpeed" double precision,
-            CONSTRAINT "networkLinkTraffic_pkey" PRIMARY KEY ("linkId", "startTime", "endTime")
-        );
+            CONSTRAINT "networkLinkTraffic_pkey" PRIMARY KEY ("linkId", "startTimeSeconds", "endTimeSeconds")
+        ) {partitionByClause};
     """)
+    conn.execute(f'CREATE INDEX IF NOT EXISTS "networkLinkTraffic_startTimeSeconds_idx" ON "{config.DB_EVENTS_TABLE}" ("startTimeSeconds");')
     conn.close()
 
 
@@ -41,96 +73,98 @@ def _createEventsTable():
 def _getEventsVehicleCountAndMeanSpeed(timeStepInMinutes=60, useRoundedTime=True):
     timeStepInSeconds = timeStepInMinutes * 60
     
-    events = Events.event_reader(config.getEventsPath())    
-    eventsDataframe = pd.DataFrame(events)
+    with profiler.stage('read') as currentStage:
+        events = Events.event_reader(config.getEventsPath())
+        eventsDataframe = compactTypes.readCompactDataframe(events, categories=EVENTS_CATEGORY_COLUMNS, times=['time'], columns=EVENTS_COLUMNS)
     
-    network = Network.read_network(config.getNetworkPath())
-    networkLinksDataframe = network.links
-    networkLinksLengthDict = dict(zip(networkLinksDataframe['link_id'], networkLinksDataframe['length']))
-    networkLinksFreespeedDict = dict(zip(networkLinksDataframe['link_id'], networkLinksDataframe['freespeed']))
+        network = inputCache.readNetwork(config.getNetworkPath())
+        networkLinksDataframe = network.links
+        networkLinksLengthDict = dict(zip(networkLinksDataframe['link_id'], networkLinksDataframe['length']))
+        networkLinksFreespeedDict = dict(zip(networkLinksDataframe['link_id'], networkLinksDataframe['freespeed']))
+        currentStage['rows'] = len(eventsDataframe)
     
-    linksEntryKeyWords = ['entered link']
-    linksExitKeyWords = ['left link']
+    with profiler.stage('transform') as currentStage:
+        linksEntryKeyWords = ['entered link']
+        linksExitKeyWords = ['left link']
     
-    # keeping only useful events
-    eventsDataframe = eventsDataframe[eventsDataframe['type'].isin(linksEntryKeyWords + linksExitKeyWords)]
-    eventsDataframe.reset_index(drop=True, inplace=True)
+        # keeping only useful events
+        eventsDataframe = eventsDataframe[eventsDataframe['type'].isin(linksEntryKeyWords + linksExitKeyWords)]
+        eventsDataframe.reset_index(drop=True, inplace=True)
         
-    # Calculating the number of vehicles in each link at each time step
-    # Calculating the mean speed of each link at each time step
-    if useRoundedTime:
-        currentStartingTime = math.floor(eventsDataframe['time'][0] / 3600) * 3600
-        while eventsDataframe['time'][0] > currentStartingTime:
-            currentStartingTime += timeStepInSeconds
-        currentStartingTime -= timeStepInSeconds
-    else: 
-        currentStartingTime = eventsDataframe['time'][0]
+        # Calculating the number of vehicles in each link at each time step
+        # Calculating the mean speed of each link at each time step
+        if useRoundedTime:
+            currentStartingTime = math.floor(eventsDataframe['time'][0] / 3600) * 3600
+            while eventsDataframe['time'][0] > currentStartingTime:
+                currentStartingTime += timeStepInSeconds
+            currentStartingTime -= timeStepInSeconds
+        else: 
+            currentStartingTime = eventsDataframe['time'][0]
     
-    currentEndingTime = currentStartingTime + timeStepInSeconds
+        currentEndingTime = currentStartingTime + timeStepInSeconds
 
-    enteredLinksQueueDict = collections.defaultdict(list)
-    meanSpeedInLinksDict = collections.defaultdict(list)
-    vehiclesPerLinkDict = collections.defaultdict(int)
-    resultsDict = collections.defaultdict(list)
+        enteredLinksQueueDict = collections.defaultdict(list)
+        meanSpeedInLinksDict = collections.defaultdict(list)
+        vehiclesPerLinkDict = collections.defaultdict(int)
+        resultsDict = collections.defaultdict(list)
     
-    # Parsing the events
-    for row in eventsDataframe.itertuples():
-        # Checking if we are still in the current time span
-        if row.time > currentEndingTime:
-            for linkId, speeds in meanSpeedInLinksDict.items():
-                vehicleCount = vehiclesPerLinkDict[linkId] 
-                speeds = [i for i in speeds if i != 0] # removing 0 values
-                meanSpeed = sum(speeds) / vehicleCount if vehicleCount > 0 else 0
+        # Parsing the events
+        for row in eventsDataframe.itertuples():
+            # Checking if we are still in the current time span
+            if row.time > currentEndingTime:
+                for linkId, speeds in meanSpeedInLinksDict.items():
+                    vehicleCount = vehiclesPerLinkDict[linkId] 
+                    speeds = [i for i in speeds if i != 0] # removing 0 values
+                    meanSpeed = sum(speeds) / vehicleCount if vehicleCount > 0 else 0
                 
-                formattedStartingTime = tools.formatTimeToIntervalType(tools.getFormattedTime(currentStartingTime))
-                formattedEndingTime = tools.formatTimeToIntervalType(tools.getFormattedTime(currentEndingTime))
-
-                resultsDict['linkId'].append(linkId)
-                resultsDict['startTime'].append(formattedStartingTime)
-                resultsDict['endTime'].append(formattedEndingTime)
-                resultsDict['vehicleCount'].append(vehicleCount)
-                resultsDict['meanSpeed'].append(meanSpeed)
+                    resultsDict['linkId'].append(linkId)
+                    resultsDict['startTimeSeconds'].append(int(currentStartingTime))
+                    resultsDict['endTimeSeconds'].append(int(currentEndingTime))
+                    resultsDict['vehicleCount'].append(vehicleCount)
+                    resultsDict['meanSpeed'].append(meanSpeed)
             
-            meanSpeedInLinksDict.clear()
-            vehiclesPerLinkDict.clear()
-            currentStartingTime = currentEndingTime
-            currentEndingTime = currentEndingTime + timeStepInSeconds
+                meanSpeedInLinksDict.clear()
+                vehiclesPerLinkDict.clear()
+                currentStartingTime = currentEndingTime
+                currentEndingTime = currentEndingTime + timeStepInSeconds
         
-        if row.type in linksEntryKeyWords:
-            enteredLinksQueueDict[row.link].append(row.time)
-        else:
-            if row.link in enteredLinksQueueDict:
-                # Calculating time spent in the link
-                try: 
-                    startingTimeInLink = enteredLinksQueueDict[row.link].pop(0)
-                    secondsSpentInLink = row.time - startingTimeInLink
+            if row.type in linksEntryKeyWords:
+                enteredLinksQueueDict[row.link].append(row.time)
+            else:
+                if row.link in enteredLinksQueueDict:
+                    # Calculating time spent in the link
+                    try: 
+                        startingTimeInLink = enteredLinksQueueDict[row.link].pop(0)
+                        secondsSpentInLink = row.time - startingTimeInLink
             
-                    # Calculating the mean speed in the link (in meter/second)
-                    linkLength = networkLinksLengthDict[row.link]
-                    try:
-                        speed = linkLength / secondsSpentInLink
+                        # Calculating the mean speed in the link (in meter/second)
+                        linkLength = networkLinksLengthDict[row.link]
+                        try:
+                            speed = linkLength / secondsSpentInLink
                         
-                        # Checking if meanspeed is above links freespeed limit
-                        if speed > networkLinksFreespeedDict[row.link]:
-                            # print(f'Warning: speed {speed} > freespeed {networkLinksFreespeedDict[row.link]} for link {row.link}')
-                            raise ValueError('Speed above freespeed limit')
+                            # Checking if meanspeed is above links freespeed limit
+                            if speed > networkLinksFreespeedDict[row.link]:
+                                # print(f'Warning: speed {speed} > freespeed {networkLinksFreespeedDict[row.link]} for link {row.link}')
+                                raise ValueError('Speed above freespeed limit')
                         
-                    except Exception:
-                        # Case if a vehicle leaves the link at the same time it enters
-                        # print(f'Error: \nlink => {row.link} \nlinkLength => {linkLength} \nsecondsSpentInLink => {secondsSpentInLink} \nstartingTimeInLink => {startingTimeInLink} \nrow.time => {row.time} \ntype => {row.type} \nlegMode => {row.legMode}')
-                        continue
+                        except Exception:
+                            # Case if a vehicle leaves the link at the same time it enters
+                            # print(f'Error: \nlink => {row.link} \nlinkLength => {linkLength} \nsecondsSpentInLink => {secondsSpentInLink} \nstartingTimeInLink => {startingTimeInLink} \nrow.time => {row.time} \ntype => {row.type} \nlegMode => {row.legMode}')
+                            continue
                     
-                    meanSpeedInLinksDict[row.link].append(speed)
-                    vehiclesPerLinkDict[row.link] += 1
+                        meanSpeedInLinksDict[row.link].append(speed)
+                        vehiclesPerLinkDict[row.link] += 1
 
-                except Exception:
-                    # skipping the event if the vehicle has not entered the link
-                    # print(f'Error: link {row.link} has an empty queue at time {row.time}')
+                    except Exception:
+                        # skipping the event if the vehicle has not entered the link
+                        # print(f'Error: link {row.link} has an empty queue at time {row.time}')
+                        continue
+                else:
+                    # skipping the event if the vehicle has not entered the link yet
+                    # print(f'Error: link {row.link} not found in the queue person: {row.person} / legMode: {row.legMode}')
                     continue
-            else:
-                # skipping the event if the vehicle has not entered the link yet
-                # print(f'Error: link {row.link} not found in the queue person: {row.person} / legMode: {row.legMode}')
-                continue
 
-    resultsDict = pd.DataFrame(resultsDict)
+        resultsDict = pd.DataFrame(resultsDict)
+        currentStage['rows'] = len(resultsDict)
+    
     return resultsDict
\ No newline at end of file
@@ -1,30 +1,38 @@
-import matsim.Facility as Facility
 from furbain import config
+from furbain import inputCache
 from furbain import databaseTools
+from furbain import profiler
 import geopandas as gpd
 from geoalchemy2 import Geometry
 
+@profiler.profiled
 def importFacilities():
-    facilityReader = Facility.facility_reader(config.getFacilitiesPath())
-    facilities = gpd.GeoDataFrame(facilityReader.facilities)
+    with profiler.stage('read') as currentStage:
+        facilities = gpd.GeoDataFrame(inputCache.readFacilities(config.getFacilitiesPath()))
+        currentStage['rows'] = len(facilities)
     
-    # Renaming the columns to match the database
-    facilities.rename(columns={
-        'type': 'activityType'
-    }, inplace = True)
-    
-    
-    # Creating a point from coordinates
-    facilities['location'] = facilities.apply(lambda row: 'POINT({} {})'.format(row['x'], row['y']), axis=1)
-    facilities.drop(columns=['x', 'y'], inplace=True)
+    with profiler.stage('transform'):
+        # Renaming the columns to match the database
+        facilities.rename(columns={
+            'type': 'activityType'
+        }, inplace = True)
+        
+        
+        # Creating a point from coordinates
+        facilities['location'] = facilities.apply(lambda row: 'POINT({} {})'.format(row['x'], row['y']), axis=1)
+        facilities.drop(columns=['x', 'y'], inplace=True)
     
     # Creating the tables in the database
-    _createFacilityTable()
+    with profiler.stage('createTable'):
+        _createFacilityTable()
     
     # Importing the data to the database
-    conn = databaseTools.connectToDatabase()
-    facilities.to_sql(config.DB_FACILITIES_TABLE, con=conn, if_exists='append', index=False, dtype={'location': Geometry('POINT', srid=config.getDatabaseSRID())})
-    conn.close()
+    with profiler.stage('load') as currentStage:
+        conn = databaseTools.connectToDatabase()
+        facilities.to_sql(config.DB_FACILITIES_TABLE, con=conn, if_exists='append', index=False, dtype={'location': Geometry('POINT', srid=config.getDatabaseSRID())})
+        databaseTools.recordTableImport(conn, config.DB_FACILITIES_TABLE)
+        conn.close()
+        currentStage['rows'] = len(facilities)
 
 def _createFacilityTable():
     conn = databaseTools.connectToDatabase()
@@ -1,21 +1,30 @@
 import matsim.Household as Household
 from furbain import config
 from furbain import databaseTools
+from furbain import profiler
 
+@profiler.profiled
 def importHouseholds():
-    householdReader = Household.houshold_reader(config.getHouseholdsPath())
-    householdDataframe = householdReader.households
+    with profiler.stage('read') as currentStage:
+        householdReader = Household.houshold_reader(config.getHouseholdsPath())
+        householdDataframe = householdReader.households
+        currentStage['rows'] = len(householdDataframe)
     
     # Formating dataframe
-    householdDataframe.drop(columns=['members'], inplace=True)
+    with profiler.stage('transform'):
+        householdDataframe.drop(columns=['members'], inplace=True)
     
     # Creating the tables in the database
-    _createHouseholdTable()
+    with profiler.stage('createTable'):
+        _createHouseholdTable()
     
     # Importing the data to the database
-    conn = databaseTools.connectToDatabase()
-    householdDataframe.to_sql(config.DB_HOUSEHOLDS_TABLE, con=conn, if_exists='append', index=False)
-    conn.close()
+    with profiler.stage('load') as currentStage:
+        conn = databaseTools.connectToDatabase()
+        householdDataframe.to_sql(config.DB_HOUSEHOLDS_TABLE, con=conn, if_exists='append', index=False)
+        databaseTools.recordTableImport(conn, config.DB_HOUSEHOLDS_TABLE)
+        conn.close()
+        currentStage['rows'] = len(householdDataframe)
 
 
 def _createHouseholdTable():
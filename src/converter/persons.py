@@ -1,30 +1,40 @@
 from furbain import config
 from furbain import databaseTools
+from furbain import profiler
 import pandas as pd
 import geopandas as gpd
 from geoalchemy2 import Geometry
 
 
+@profiler.profiled
 def importPersons():
-    personsDataframe = pd.read_csv(config.getPersonsPath(), sep=config.PERSONS_CSV_SEPARATOR)
-    personGeoDataframe = gpd.GeoDataFrame(personsDataframe)
+    with profiler.stage('read') as currentStage:
+        personsDataframe = pd.read_csv(config.getPersonsPath(), sep=config.PERSONS_CSV_SEPARATOR)
+        currentStage['rows'] = len(personsDataframe)
     
-    # Renaming the columns to match the database
-    personGeoDataframe.rename(columns={
-        'person': 'id',
-    }, inplace = True)
-    
-    # Creating a point from first activity coordinates
-    personGeoDataframe['first_act_point'] = personGeoDataframe.apply(lambda row: 'POINT({} {})'.format(row['first_act_x'], row['first_act_y']), axis=1)
-    personGeoDataframe.drop(columns=['first_act_x', 'first_act_y'], inplace=True)
+    with profiler.stage('transform'):
+        personGeoDataframe = gpd.GeoDataFrame(personsDataframe)
+        
+        # Renaming the columns to match the database
+        personGeoDataframe.rename(columns={
+            'person': 'id',
+        }, inplace = True)
+        
+        # Creating a point from first activity coordinates
+        personGeoDataframe['first_act_point'] = personGeoDataframe.apply(lambda row: 'POINT({} {})'.format(row['first_act_x'], row['first_act_y']), axis=1)
+        personGeoDataframe.drop(columns=['first_act_x', 'first_act_y'], inplace=True)
     
     # Creating the tables in the database
-    _createPersonTable()
+    with profiler.stage('createTable'):
+        _createPersonTable()
     
     # Importing the data to the database
-    conn = databaseTools.connectToDatabase()
-    personGeoDataframe.to_sql(config.DB_PERSONS_TABLE, con=conn, if_exists='append', index=False, dtype={'first_act_coord': Geometry('POINT', srid=config.getDatabaseSRID())})
-    conn.close()
+    with profiler.stage('load') as currentStage:
+        conn = databaseTools.connectToDatabase()
+        personGeoDataframe.to_sql(config.DB_PERSONS_TABLE, con=conn, if_exists='append', index=False, dtype={'first_act_coord': Geometry('POINT', srid=config.getDatabaseSRID())})
+        databaseTools.recordTableImport(conn, config.DB_PERSONS_TABLE)
+        conn.close()
+        currentStage['rows'] = len(personGeoDataframe)
 
 def _createPersonTable():
     conn = databaseTools.connectToDatabase()
@@ -0,0 +1,101 @@
+from furbain import inputCache
+import xml.etree.ElementTree as ET
+import pandas as pd
+import gzip
+
+
+# Streams the activities of the experienced plans in dataframes of batchSize activities, with the same rows as Plans.plan_reader_dataframe :
+# - the persons whose experienced plans have no activities get the activities of their selected plan in the plans file (added after the others)
+# - the activities without coordinates get the coordinates of their facility
+# The columns are the attributes of the activities (type, link, facility, x, y, start_time, end_time...), their id and the id of their person (person_id)
+# The files are parsed one person at a time, the memory used does not depend on the number of persons (except for the facilities locations)
+def iterateActivities(experiencedPlansPath, plansPath, facilitiesPath, batchSize):
+    batch = []
+    personsWithoutActivities = set()
+    facilitiesLocations = {}
+    nextActivityId = 1
+
+    for personId, plans in _iteratePersonsPlans(experiencedPlansPath):
+        for planAttributes, activities in plans:
+            if not activities:
+                personsWithoutActivities.add(personId)
+
+            for activity in activities:
+                batch.append(_createActivityRecord(nextActivityId, personId, activity, facilitiesPath, facilitiesLocations))
+                nextActivityId += 1
+
+        if len(batch) >= batchSize:
+            yield _createActivitiesDataframe(batch)
+            batch = []
+
+    # the plans file is only read if an experienced plan has no activities
+    if personsWithoutActivities:
+        for personId, plans in _iteratePersonsPlans(plansPath):
+            if personId not in personsWithoutActivities or not plans:
+                continue
+
+            selectedPlans = [activities for planAttributes, activities in plans if planAttributes.get('selected') == 'yes']
+            for activity in (selectedPlans or [plans[0][1]])[0]:
+                batch.append(_createActivityRecord(nextActivityId, personId, activity, facilitiesPath, facilitiesLocations))
+                nextActivityId += 1
+
+            if len(batch) >= batchSize:
+                yield _createActivitiesDataframe(batch)
+                batch = []
+
+    if batch:
+        yield _createActivitiesDataframe(batch)
+
+
+# Yields the id and the plans of each person of a plans file : [(attributes of the plan, [attributes of each activity])]
+# the attributes of an activity are its xml attributes and its <attribute> elements
+def _iteratePersonsPlans(path):
+    with _openFile(path) as file:
+        tree = ET.iterparse(file, events=['start', 'end'])
+        xmlEvent, root = next(tree)
+
+        for xmlEvent, elem in tree:
+            if elem.tag != 'person' or xmlEvent != 'end':
+                continue
+
+            plans = []
+            for plan in elem.iterfind('plan'):
+                activities = []
+                for activity in plan.iterfind('activity'):
+                    attributes = dict(activity.attrib)
+                    for attribute in activity.iter('attribute'):
+                        attributes[attribute.attrib['name']] = attribute.text
+                    activities.append(attributes)
+                plans.append((plan.attrib, activities))
+
+            yield elem.attrib['id'], plans
+
+            # the parsed persons are removed from the tree, otherwise the whole file is kept in memory
+            root.clear()
+
+
+def _openFile(path):
+    return gzip.open(path, 'rb') if str(path).endswith('.gz') else open(path, 'rb')
+
+
+def _createActivityRecord(activityId, personId, activity, facilitiesPath, facilitiesLocations):
+    record = {'id': activityId, 'person_id': personId, **activity}
+
+    # the facilities are only read if an activity has no coordinates
+    if record.get('x') is None and facilitiesPath != "":
+        if not facilitiesLocations:
+            facilities = inputCache.readFacilities(facilitiesPath)
+            facilitiesLocations.update(zip(facilities['id'], zip(facilities['x'], facilities['y'])))
+
+        if record.get('facility') in facilitiesLocations:
+            record['x'], record['y'] = facilitiesLocations[record['facility']]
+    return record
+
+
+def _createActivitiesDataframe(records):
+    dataframe = pd.DataFrame.from_records(records)
+    # the columns used by the converter, missing if none of the activities of the batch has them
+    for column in ['x', 'y', 'start_time', 'end_time']:
+        if column not in dataframe.columns:
+            dataframe[column] = float('nan')
+    return dataframe
@@ -1,47 +1,84 @@
 from furbain import config
-from furbain import tools
+from furbain import compactTypes
 from furbain import databaseTools
-import pandas as pd
+from furbain import profiler
+from furbain.converter.aggregates import importTripsAggregate
 
 
-def importTrips():
-    tripsDataframe = pd.read_csv(config.getTripsPath(), sep=config.TRIPS_CSV_SEPARATOR)
-    
-    tripsDataframe.drop(columns=[
-        'start_activity_type',
-        'end_activity_type',
-        'start_x',
-        'start_y',
-        'end_x',
-        'end_y',
-    ], inplace=True)
+# columns of the trips file stored as categorical and as small integers (see compactTypes)
+TRIPS_CATEGORY_COLUMNS = ['wait_time', 'main_mode', 'longest_distance_mode', 'modes', 'start_activity_type', 'end_activity_type',
+                          'start_facility_id', 'start_link', 'end_facility_id', 'end_link', 'first_pt_boarding_stop', 'last_pt_egress_stop']
+TRIPS_INTEGER_COLUMNS = ['person', 'trip_number', 'traveled_distance', 'euclidean_distance']
+
+
+# partitioning : if 'hash', the table is partitioned by the hash of personId, if 'time', by ranges of dep_time_seconds (see databaseTools.createPartitions)
+#                the queries on a time window only read its partitions when the table is partitioned by time
+@profiler.profiled
+def importTrips(partitioning=None):
+    partitionByClause = databaseTools.getPartitionByClause(partitioning, hashColumn='personId', timeColumn='dep_time_seconds')
+    # the rows are added to the existing table, it must have the seconds columns
+    conn = databaseTools.connectToDatabase()
+    databaseTools.checkTimesInSeconds(conn, config.DB_TRIPS_TABLE)
+    conn.close()
     
-    # Renaming the columns to match the database
-    tripsDataframe.rename(columns={
-        'trip_id': 'id',
-        'person': 'personId',
-    }, inplace = True)
+    with profiler.stage('read') as currentStage:
+        # the times are converted to seconds, the interval columns are generated by the database
+        tripsDataframe = compactTypes.readCompactCsv(config.getTripsPath(), config.TRIPS_CSV_SEPARATOR,
+                                                     categories=TRIPS_CATEGORY_COLUMNS, integers=TRIPS_INTEGER_COLUMNS, times=['dep_time', 'trav_time'])
+        currentStage['rows'] = len(tripsDataframe)
     
-    # Correcting dep_time format
-    tripsDataframe['dep_time'] = tripsDataframe['dep_time'].apply(lambda x: tools.formatTimeToIntervalType(x))
+    with profiler.stage('transform'):
+        tripsDataframe.drop(columns=[
+            'start_activity_type',
+            'end_activity_type',
+            'start_x',
+            'start_y',
+            'end_x',
+            'end_y',
+        ], inplace=True)
+        
+        # Renaming the columns to match the database
+        tripsDataframe.rename(columns={
+            'trip_id': 'id',
+            'person': 'personId',
+            'dep_time': 'dep_time_seconds',
+            'trav_time': 'trav_time_seconds',
+        }, inplace = True)
     
     # Creating the tables in the database
-    _createTripTable()
+    with profiler.stage('createTable'):
+        _createTripTable(partitioning, partitionByClause)
+        if partitioning is not None:
+            conn = databaseTools.connectToDatabase()
+            databaseTools.createPartitions(conn, config.DB_TRIPS_TABLE, partitioning, tripsDataframe['dep_time_seconds'])
+            conn.close()
     
     # Importing the data to the database
-    conn = databaseTools.connectToDatabase()
-    tripsDataframe.to_sql(config.DB_TRIPS_TABLE, con=conn, if_exists='append', index=False)
-    conn.close()
+    with profiler.stage('load') as currentStage:
+        timeColumn = 'dep_time_seconds' if partitioning == 'time' else None
+        databaseTools.copyDataframeToTableConcurrently(tripsDataframe, config.DB_TRIPS_TABLE, timeColumn=timeColumn)
+        
+        conn = databaseTools.connectToDatabase()
+        databaseTools.recordTableImport(conn, config.DB_TRIPS_TABLE)
+        conn.close()
+        currentStage['rows'] = len(tripsDataframe)
+    
+    importTripsAggregate()
 
-def _createTripTable():
+# the partition key of a partitioned table is part of its primary key
+def _createTripTable(partitioning=None, partitionByClause=''):
+    primaryKey = {None: 'id', 'hash': 'id, "personId"', 'time': 'id, dep_time_seconds'}[partitioning]
+    
     conn = databaseTools.connectToDatabase()
     conn.execute(f"""
         CREATE TABLE IF NOT EXISTS "{config.DB_TRIPS_TABLE}" (
             id character varying(40) COLLATE pg_catalog."default" NOT NULL,
             "personId" integer,
             trip_number integer,
-            dep_time interval,
-            trav_time interval,
+            dep_time_seconds integer,
+            trav_time_seconds integer,
+            dep_time interval GENERATED ALWAYS AS (dep_time_seconds * interval '1 second') STORED,
+            trav_time interval GENERATED ALWAYS AS (trav_time_seconds * interval '1 second') STORED,
             wait_time interval,
             traveled_distance integer,
             euclidean_distance integer,
@@ -54,7 +91,7 @@ def _createTripTable():
             end_link character varying(40) COLLATE pg_catalog."default",
             first_pt_boarding_stop character varying(40) COLLATE pg_catalog."default",
             last_pt_egress_stop character varying(40) COLLATE pg_catalog."default",
-            CONSTRAINT trip_pkey PRIMARY KEY (id),
+            CONSTRAINT trip_pkey PRIMARY KEY ({primaryKey}),
             CONSTRAINT trip_end_facility_id_fkey FOREIGN KEY (end_facility_id)
                 REFERENCES public.{config.DB_FACILITIES_TABLE} (id) MATCH SIMPLE
                 ON UPDATE NO ACTION
@@ -75,6 +112,7 @@ def _createTripTable():
                 REFERENCES public."{config.DB_NETWORK_TABLE}" (id) MATCH SIMPLE
                 ON UPDATE NO ACTION
                 ON DELETE NO ACTION
-        );
+        ) {partitionByClause};
     """)
+    conn.execute(f'CREATE INDEX IF NOT EXISTS "trip_dep_time_seconds_idx" ON "{config.DB_TRIPS_TABLE}" (dep_time_seconds);')
     conn.close()
\ No newline at end of file
@@ -1,32 +1,42 @@
 import matsim.Vehicle as Vehicle
 from furbain import config
 from furbain import databaseTools
+from furbain import profiler
 
+@profiler.profiled
 def importVehicles():
-    vehicleDataframes = Vehicle.vehicle_reader(config.getAllVehiclesPath())
-    vehicleTypes = vehicleDataframes.vehicle_types
-    vehicles = vehicleDataframes.vehicles
+    with profiler.stage('read') as currentStage:
+        vehicleDataframes = Vehicle.vehicle_reader(config.getAllVehiclesPath())
+        vehicleTypes = vehicleDataframes.vehicle_types
+        vehicles = vehicleDataframes.vehicles
+        currentStage['rows'] = len(vehicleTypes) + len(vehicles)
     
     # Renamming the columns to match the database
-    vehicleTypes.rename(columns={
-        'pce':'passengerCarEquivalents',
-        'factor': 'flowEfficiencyFactor'
-    }, inplace = True)
-    
-    vehicles.rename(columns={
-        'type': 'vehicleTypeId'
-    }, inplace = True)
+    with profiler.stage('transform'):
+        vehicleTypes.rename(columns={
+            'pce':'passengerCarEquivalents',
+            'factor': 'flowEfficiencyFactor'
+        }, inplace = True)
+        
+        vehicles.rename(columns={
+            'type': 'vehicleTypeId'
+        }, inplace = True)
     
     # Creating the tables in the database
-    _createVehicleTypeTable()
-    _createVehicleTable()
+    with profiler.stage('createTable'):
+        _createVehicleTypeTable()
+        _createVehicleTable()
         
     # Importing the data to the database
-    conn = databaseTools.connectToDatabase()
-    
-    vehicleTypes.to_sql(config.DB_ALLVEHICLES_TYPES_TABLE, con=conn, if_exists='append', index=False)
-    vehicles.to_sql(config.DB_ALLVEHICLES_TABLE, con=conn, if_exists='append', index=False)
-    conn.close()
+    with profiler.stage('load') as currentStage:
+        conn = databaseTools.connectToDatabase()
+        
+        vehicleTypes.to_sql(config.DB_ALLVEHICLES_TYPES_TABLE, con=conn, if_exists='append', index=False)
+        databaseTools.recordTableImport(conn, config.DB_ALLVEHICLES_TYPES_TABLE)
+        vehicles.to_sql(config.DB_ALLVEHICLES_TABLE, con=conn, if_exists='append', index=False)
+        databaseTools.recordTableImport(conn, config.DB_ALLVEHICLES_TABLE)
+        conn.close()
+        currentStage['rows'] = len(vehicleTypes) + len(vehicles)
 
 
 def _createVehicleTypeTable():
@@ -1,6 +1,10 @@
-from furbain import config
+from furbain import config, profiler, tools
 from sqlalchemy import create_engine
+from sqlalchemy.sql import text
+from concurrent.futures import ThreadPoolExecutor
+import collections
 import pandas as pd
+import io
 
 
 def connectToDatabase():
@@ -8,6 +12,35 @@ def connectToDatabase():
     conn = engine.connect()
     return conn
 
+
+# Returns an engine keeping a pool of poolSize connections to the selected database
+def createDatabaseEngine(poolSize=5):
+    return create_engine(f'postgresql+psycopg2://{config.getDatabaseUser()}:{config.getDatabasePassword()}@{config.getDatabaseHost()}:{config.getDatabasePort()}/{config.DB_DBNAME}', pool_size=poolSize, max_overflow=0)
+
+
+# Calls function(conn, item) for each item, with up to concurrency calls running in parallel on pooled connections
+# if concurrency is 1, the items are processed one after another on a single connection
+# The results are returned in the order of the items
+def runConcurrently(function, items, concurrency):
+    if concurrency <= 1:
+        conn = connectToDatabase()
+        try:
+            return [function(conn, item) for item in items]
+        finally:
+            conn.close()
+    
+    engine = createDatabaseEngine(concurrency)
+    
+    def runWithPooledConnection(item):
+        with engine.connect() as conn:
+            return function(conn, item)
+    
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(runWithPooledConnection, items))
+    finally:
+        engine.dispose()
+
 def connectToPostgres():
     engine = create_engine(f'postgresql+psycopg2://{config.getDatabaseUser()}:{config.getDatabasePassword()}@{config.getDatabaseHost()}:{config.getDatabasePort()}')
     conn = engine.connect()
@@ -71,6 +104,94 @@ def executeSQLQueryOnDatabase(queryString):
     return result.fetchall()
 
 
+# Same as executeSQLQueryOnDatabase, but yields the rows in lists of at most chunkSize rows
+def iterateSQLQueryOnDatabase(queryString, chunkSize=config.STREAM_CHUNK_SIZE):
+    conn = connectToDatabase()
+    try:
+        yield from iterateQuery(conn, text(queryString), chunkSize, asRecords=True)
+    finally:
+        conn.close()
+
+
+# Yields the result of the query in dataframes of at most chunkSize rows, or in lists of rows if asRecords is True
+# the rows are read through a named server-side cursor, only one chunk is held in memory at once
+# readSqlOptions are given to pd.read_sql (eg: index_col), the connection can't be used until the iteration is finished
+# The cursor is closed when the iteration ends or is stopped, except for the dataframes of a connection in a transaction,
+# whose cursor is closed at the end of the transaction
+def iterateQuery(conn, query, chunkSize=config.STREAM_CHUNK_SIZE, asRecords=False, **readSqlOptions):
+    streamingConn = conn.execution_options(stream_results=True, max_row_buffer=chunkSize)
+    
+    if asRecords:
+        result = streamingConn.execute(query)
+        try:
+            for rows in result.partitions(chunkSize):
+                yield [tuple(row) for row in rows]
+        finally:
+            result.close()
+    else:
+        # pd.read_sql doesn't close its cursor, the query is run in its own transaction, rolled back to close it
+        transaction = None if conn.in_transaction() else streamingConn.begin()
+        try:
+            yield from pd.read_sql(query, streamingConn, chunksize=chunkSize, **readSqlOptions)
+        finally:
+            if transaction is not None:
+                transaction.rollback()
+
+
+# Returns True if the table exists in the selected database
+def tableExists(conn, tableName):
+    query = text("SELECT to_regclass(:tableName) is not null").bindparams(tableName=f'public."{tableName}"')
+    return conn.execute(query).scalar()
+
+
+# Seconds column of each table storing its times as integer seconds
+TIME_SECONDS_COLUMNS = {
+    config.DB_PLANS_TABLE: 'start_time_seconds',
+    config.DB_TRIPS_TABLE: 'dep_time_seconds',
+    config.DB_EVENTS_TABLE: 'startTimeSeconds',
+}
+
+
+# Raises an exception if the table has been imported by a previous version of furbain, which stored its times as intervals only
+# the converters and the queries use the seconds columns, the table has to be deleted and imported again
+def checkTimesInSeconds(conn, tableName):
+    query = text("""SELECT to_regclass(:relationName) is not null
+                    and not exists (SELECT 1 FROM information_schema.columns
+                                    WHERE table_schema = 'public' and table_name = :tableName and column_name = :columnName)""")
+    isOutdated = conn.execute(query.bindparams(relationName=f'public."{tableName}"', tableName=tableName, columnName=TIME_SECONDS_COLUMNS[tableName])).scalar()
+    if isOutdated:
+        raise Exception(f'The table "{tableName}" has been imported by a previous version of furbain, its times are not stored in seconds ({TIME_SECONDS_COLUMNS[tableName]}). '
+                        f'Delete it (databaseTools.deleteTable("{tableName}")) and import it again')
+
+
+# Records that the table has just been imported in the import manifest of the database
+# the manifest is the data version of the query cache, the cached results are invalidated when a table is imported again
+def recordTableImport(conn, tableName):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS "{config.DB_IMPORT_MANIFEST_TABLE}" (
+            "tableName" character varying(100) COLLATE pg_catalog."default" NOT NULL,
+            "importedAt" timestamp with time zone NOT NULL,
+            "importCount" integer NOT NULL,
+            CONSTRAINT "importManifest_pkey" PRIMARY KEY ("tableName")
+        );
+    """)
+    query = text(f"""INSERT INTO "{config.DB_IMPORT_MANIFEST_TABLE}" ("tableName", "importedAt", "importCount")
+                     VALUES (:tableName, clock_timestamp(), 1)
+                     ON CONFLICT ("tableName") DO UPDATE
+                     SET "importedAt" = excluded."importedAt", "importCount" = "{config.DB_IMPORT_MANIFEST_TABLE}"."importCount" + 1""")
+    conn.execute(query.bindparams(tableName=tableName))
+
+
+# Returns the import manifest as a list of (tableName, importedAt, importCount) sorted by table name
+# returns None if the database has no manifest (no table imported since the manifest exists)
+def getImportManifest(conn):
+    if not tableExists(conn, config.DB_IMPORT_MANIFEST_TABLE):
+        return None
+    
+    result = conn.execute(f'SELECT "tableName", "importedAt", "importCount" FROM "{config.DB_IMPORT_MANIFEST_TABLE}" ORDER BY "tableName";')
+    return [(tableName, importedAt.isoformat(), importCount) for tableName, importedAt, importCount in result.fetchall()]
+
+
 def getTablesFromDatabase():
     conn = connectToDatabase()
     tables = conn.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public';")
@@ -82,6 +203,8 @@ def deleteTable(tableName):
     # check if the table exists
     if tableName in getTablesFromDatabase():
         conn.execute(f'DROP TABLE "{tableName}";')
+        if tableExists(conn, config.DB_IMPORT_MANIFEST_TABLE):
+            conn.execute(text(f'DELETE FROM "{config.DB_IMPORT_MANIFEST_TABLE}" WHERE "tableName" = :tableName;').bindparams(tableName=tableName))
         print(f'Table "{tableName}" deleted.')
     else:
         raise Exception(f'The table "{tableName}" does not exist.')
@@ -93,4 +216,262 @@ def getDatabaseTableDataframe(tableName):
     if tableName in getTablesFromDatabase():
         return pd.read_sql(f'SELECT * FROM "{tableName}";', conn)
     else:
-        raise Exception(f'The table "{tableName}" does not exist.')
\ No newline at end of file
+        raise Exception(f'The table "{tableName}" does not exist.')
+
+
+# Same as getDatabaseTableDataframe, but yields the table in dataframes of at most chunkSize rows
+def iterateDatabaseTableDataframe(tableName, chunkSize=config.STREAM_CHUNK_SIZE):
+    if tableName not in getTablesFromDatabase():
+        raise Exception(f'The table "{tableName}" does not exist.')
+    
+    conn = connectToDatabase()
+    try:
+        yield from iterateQuery(conn, text(f'SELECT * FROM "{tableName}";'), chunkSize)
+    finally:
+        conn.close()
+
+
+# Bulk load the rows of the dataframe in an existing table with COPY, much faster than inserting them
+# the columns of the dataframe are matched by name with the columns of the table, the missing values are written as NULL
+def copyDataframeToTable(conn, dataframe, tableName):
+    buffer = io.StringIO()
+    dataframe.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    
+    columns = ", ".join(f'"{column}"' for column in dataframe.columns)
+    dbapiConnection = conn.connection
+    with profiler.databaseTime(), dbapiConnection.cursor() as cursor:
+        cursor.copy_expert(f'COPY "{tableName}" ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+    dbapiConnection.commit()
+
+
+# Same as copyDataframeToTable, but the rows are copied in chunks of config.LOAD_CHUNK_SIZE rows on up to concurrency connections in parallel
+# timeColumn : if the table is partitioned by time (see createPartitions), its partition key, each chunk only holds rows of one partition
+#              and the partitions of the time ranges without partition are created
+# The load is all or nothing : the chunks are copied in a staging table, a copy of the table, and the rows are only added to the table
+# in a single transaction once they are all copied (see _mergeStagingTable), the table is not modified if a chunk fails or if the process is stopped
+def copyDataframeToTableConcurrently(dataframe, tableName, concurrency=config.LOAD_CONCURRENCY, timeColumn=None):
+    return copyDataframesToTableConcurrently([dataframe], tableName, concurrency, timeColumn)
+
+
+# Same as copyDataframeToTableConcurrently for each dataframe of an iterable (eg: the batches of a file parsed as a stream), returns the number of rows copied
+# the next dataframe is read while the chunks of the previous ones are copied, at most concurrency chunks are waiting to be copied
+def copyDataframesToTableConcurrently(dataframes, tableName, concurrency=config.LOAD_CONCURRENCY, timeColumn=None):
+    stagingTableName = f'{tableName}_staging'
+    
+    conn = connectToDatabase()
+    try:
+        # the staging table of a load that has been stopped is dropped
+        partitionsNames = _createStagingTable(conn, tableName, stagingTableName)
+        try:
+            rowsCount = _copyChunksConcurrently(conn, dataframes, tableName, stagingTableName, partitionsNames, concurrency, timeColumn)
+            _mergeStagingTable(conn, tableName, stagingTableName)
+        except Exception:
+            conn.execute(f'DROP TABLE IF EXISTS "{stagingTableName}" CASCADE;')
+            raise
+    finally:
+        conn.close()
+    return rowsCount
+
+
+def _copyChunksConcurrently(conn, dataframes, tableName, stagingTableName, partitionsNames, concurrency, timeColumn):
+    engine = createDatabaseEngine(concurrency)
+    
+    def copyChunk(chunk):
+        with engine.connect() as chunkConn:
+            copyDataframeToTable(chunkConn, chunk, stagingTableName)
+    
+    rowsCount = 0
+    pendingCopies = collections.deque()
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for dataframe in dataframes:
+                groups = [dataframe]
+                if timeColumn is not None:
+                    groups = []
+                    for start, group in dataframe.groupby(getTimePartitionKeys(dataframe[timeColumn]), dropna=False, sort=False):
+                        # the rows without partition would be copied in the default partition
+                        if not pd.isna(start) and f'{tableName}_{int(start)}' not in partitionsNames:
+                            partitionsNames.add(f'{tableName}_{int(start)}')
+                            _createTimePartition(conn, stagingTableName, f'{tableName}_{int(start)}_staging', int(start))
+                        groups.append(group)
+                
+                for group in groups:
+                    for chunk in tools.chunker(group, config.LOAD_CHUNK_SIZE):
+                        pendingCopies.append(executor.submit(copyChunk, chunk))
+                        while len(pendingCopies) > concurrency:
+                            pendingCopies.popleft().result()
+                rowsCount += len(dataframe)
+            
+            while pendingCopies:
+                pendingCopies.popleft().result()
+    finally:
+        engine.dispose()
+    return rowsCount
+
+
+# Creates an empty copy of the table (columns, defaults, generated columns, constraints and indexes), without its foreign keys
+# if the table is partitioned, its partitions are copied too, the copy of a partition is named "{partitionName}_staging"
+# Returns the names of the partitions of the table
+def _createStagingTable(conn, tableName, stagingTableName):
+    conn.execute(f'DROP TABLE IF EXISTS "{stagingTableName}" CASCADE;')
+    
+    partitionKey = conn.execute(text("SELECT pg_get_partkeydef(to_regclass(:tableName))").bindparams(tableName=f'public."{tableName}"')).scalar()
+    partitionByClause = f'PARTITION BY {partitionKey}' if partitionKey else ''
+    partitions = _getPartitions(conn, tableName)
+    conn.execute(f'CREATE TABLE "{stagingTableName}" (LIKE "{tableName}" INCLUDING ALL) {partitionByClause};')
+    
+    for partitionName, partitionBound in partitions:
+        conn.execute(f'CREATE TABLE "{partitionName}_staging" PARTITION OF "{stagingTableName}" {partitionBound};')
+    return {partitionName for partitionName, partitionBound in partitions}
+
+
+# Adds the rows of the staging table to the table in a single transaction, then drops the staging table
+# if the table is empty (eg: a table created by the converter) and no view depends on it, the staging table replaces it (see _swapStagingTable),
+# the rows are not copied again
+# otherwise the rows are inserted in the table, which is not rebuilt and can be read during the insert,
+# the partitions of the staging table the table does not have are created first
+def _mergeStagingTable(conn, tableName, stagingTableName):
+    isEmpty = not conn.execute(f'SELECT EXISTS (SELECT 1 FROM "{tableName}");').scalar()
+    viewsQuery = text("""SELECT EXISTS (SELECT 1 FROM pg_depend d
+                                         JOIN pg_rewrite r ON r.oid = d.objid
+                                         WHERE d.classid = 'pg_rewrite'::regclass and d.refobjid = to_regclass(:tableName) and r.ev_class <> d.refobjid)""").bindparams(tableName=f'public."{tableName}"')
+    if isEmpty and not conn.execute(viewsQuery).scalar():
+        with conn.begin():
+            conn.execute(f'LOCK TABLE "{tableName}" IN ACCESS EXCLUSIVE MODE;')
+            # rows may have been added since the table was checked
+            if not conn.execute(f'SELECT EXISTS (SELECT 1 FROM "{tableName}");').scalar():
+                _swapStagingTable(conn, tableName, stagingTableName)
+                return
+    
+    # the partitions are created outside of the transaction, creating a partition locks the table,
+    # they are kept empty if the insert fails
+    partitionsNames = {partitionName for partitionName, partitionBound in _getPartitions(conn, tableName)}
+    for partitionName, partitionBound in _getPartitions(conn, stagingTableName):
+        if partitionName[:-len('_staging')] not in partitionsNames:
+            conn.execute(f'CREATE TABLE IF NOT EXISTS "{partitionName[:-len("_staging")]}" PARTITION OF "{tableName}" {partitionBound};')
+    
+    columns = ", ".join(f'"{column}"' for column, in conn.execute(text("""SELECT column_name FROM information_schema.columns
+                                                                         WHERE table_schema = 'public' and table_name = :tableName and is_generated = 'NEVER'
+                                                                         ORDER BY ordinal_position""").bindparams(tableName=tableName)))
+    with conn.begin():
+        conn.execute(f'INSERT INTO "{tableName}" ({columns}) SELECT {columns} FROM "{stagingTableName}";')
+        conn.execute(f'DROP TABLE "{stagingTableName}" CASCADE;')
+
+
+# Replaces the empty table by the staging table, in the transaction of the caller, the table must be locked
+# the foreign keys of the table and those referencing it are created again, the partitions, indexes and constraints keep their names
+# the foreign keys are checked on all the rows at once when they are created, the grants and the owner of the table are not kept
+def _swapStagingTable(conn, tableName, stagingTableName):
+    foreignKeysQuery = text("""SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid) FROM pg_constraint
+                               WHERE contype = 'f' and (conrelid = to_regclass(:tableName) or confrelid = to_regclass(:tableName))
+                               ORDER BY conrelid::regclass::text, conname""").bindparams(tableName=f'public."{tableName}"')
+    foreignKeys = conn.execute(foreignKeysQuery).fetchall()
+    # the staging table can have partitions the table does not have (see copyDataframesToTableConcurrently)
+    partitionsNames = [partitionName[:-len('_staging')] for partitionName, partitionBound in _getPartitions(conn, stagingTableName)]
+    tablesIndexes = {name: _getIndexes(conn, name) for name in [tableName] + partitionsNames}
+    
+    for constrainedTable, constraintName, definition in foreignKeys:
+        if constrainedTable not in [tableName, f'"{tableName}"']:
+            conn.execute(f'ALTER TABLE {_quoteRelationName(constrainedTable)} DROP CONSTRAINT "{constraintName}";')
+    # the views on the table would have to be dropped, _mergeStagingTable does not swap a table having views
+    conn.execute(f'DROP TABLE "{tableName}";')
+    conn.execute(f'ALTER TABLE "{stagingTableName}" RENAME TO "{tableName}";')
+    for partitionName in partitionsNames:
+        conn.execute(f'ALTER TABLE "{partitionName}_staging" RENAME TO "{partitionName}";')
+    
+    for name, indexes in tablesIndexes.items():
+        for definition, (indexName, isConstraint) in _getIndexes(conn, name).items():
+            # the indexes of the new partitions are named after the staging partitions
+            oldIndexName = indexes.get(definition, (indexName.replace('_staging', '', 1), isConstraint))[0]
+            if oldIndexName != indexName:
+                if isConstraint:
+                    conn.execute(f'ALTER TABLE "{name}" RENAME CONSTRAINT "{indexName}" TO "{oldIndexName}";')
+                else:
+                    conn.execute(f'ALTER INDEX "{indexName}" RENAME TO "{oldIndexName}";')
+    
+    for constrainedTable, constraintName, definition in foreignKeys:
+        constrainedTable = tableName if constrainedTable in [tableName, f'"{tableName}"'] else constrainedTable
+        conn.execute(f'ALTER TABLE {_quoteRelationName(constrainedTable)} ADD CONSTRAINT "{constraintName}" {definition};')
+
+
+# Returns the (name, bound clause) of the partitions of the table, an empty list if it is not partitioned
+def _getPartitions(conn, tableName):
+    query = text("""SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i
+                    JOIN pg_class c ON c.oid = i.inhrelid
+                    WHERE i.inhparent = to_regclass(:tableName)
+                    ORDER BY c.relname""").bindparams(tableName=f'public."{tableName}"')
+    return conn.execute(query).fetchall()
+
+
+# Returns the indexes of the table by definition (without their names) : (name, True if the index belongs to a constraint)
+def _getIndexes(conn, tableName):
+    query = text("""SELECT c.relname, pg_get_indexdef(i.indexrelid), EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = i.indexrelid and conrelid = i.indrelid)
+                    FROM pg_index i
+                    JOIN pg_class c ON c.oid = i.indexrelid
+                    WHERE i.indrelid = to_regclass(:tableName)""").bindparams(tableName=f'public."{tableName}"')
+    
+    indexes = {}
+    for indexName, indexDefinition, isConstraint in conn.execute(query):
+        # CREATE [UNIQUE] INDEX name ON [ONLY] table USING ...
+        isUnique = indexDefinition.startswith('CREATE UNIQUE')
+        indexes[(isUnique, indexDefinition[indexDefinition.index(' USING '):])] = (indexName, isConstraint)
+    return indexes
+
+
+def _quoteRelationName(relationName):
+    return relationName if relationName.startswith('"') else f'"{relationName}"'
+
+
+# Returns the PARTITION BY clause of a table created with the given partitioning, an empty string if partitioning is None
+# 'hash' : the rows are partitioned by the hash of hashColumn
+# 'time' : the rows are partitioned by ranges of timeColumn (in seconds)
+def getPartitionByClause(partitioning, hashColumn=None, timeColumn=None):
+    if partitioning is None:
+        return ''
+    elif partitioning == 'hash' and hashColumn is not None:
+        return f'PARTITION BY HASH ("{hashColumn}")'
+    elif partitioning == 'time' and timeColumn is not None:
+        return f'PARTITION BY RANGE ("{timeColumn}")'
+    
+    partitionings = [name for name, column in [('hash', hashColumn), ('time', timeColumn)] if column is not None]
+    raise Exception(f'The partitioning "{partitioning}" does not exist for this table, use one of {partitionings} or None')
+
+
+# Creates the partitions of a table created with getPartitionByClause
+# 'hash' : config.PARTITION_HASH_MODULUS partitions "{tableName}_{remainder}"
+# 'time' : a partition "{tableName}_{start}" for each range of config.PARTITION_TIME_RANGE_IN_SECONDS seconds containing one of the times (if given),
+#          and a default partition "{tableName}_default" holding the null times and the times outside of the ranges
+def createPartitions(conn, tableName, partitioning, times=None):
+    if partitioning == 'hash':
+        for remainder in range(config.PARTITION_HASH_MODULUS):
+            conn.execute(f'CREATE TABLE IF NOT EXISTS "{tableName}_{remainder}" PARTITION OF "{tableName}" FOR VALUES WITH (MODULUS {config.PARTITION_HASH_MODULUS}, REMAINDER {remainder});')
+    elif partitioning == 'time':
+        for start in sorted(getTimePartitionKeys(times).dropna().unique()) if times is not None else []:
+            _createTimePartition(conn, tableName, f'{tableName}_{int(start)}', int(start))
+        conn.execute(f'CREATE TABLE IF NOT EXISTS "{tableName}_default" PARTITION OF "{tableName}" DEFAULT;')
+
+
+def _createTimePartition(conn, tableName, partitionName, start):
+    conn.execute(f'CREATE TABLE IF NOT EXISTS "{partitionName}" PARTITION OF "{tableName}" FOR VALUES FROM ({start}) TO ({start + config.PARTITION_TIME_RANGE_IN_SECONDS});')
+
+
+# Returns the start of the time partition of each time (see createPartitions), null for the null times
+def getTimePartitionKeys(times):
+    return times // config.PARTITION_TIME_RANGE_IN_SECONDS * config.PARTITION_TIME_RANGE_IN_SECONDS
+
+
+# Upload the zones in a temporary table, only visible by the given connection and dropped when it is closed
+# zones is a list of (zoneId, polygon) with the polygons formatted for postgis in the geojsonEpsg projection
+# The polygons are transformed to the SRID of the database once, so the queries can join on the table directly
+def createTemporaryZoneTable(conn, zones, geojsonEpsg, tableName=config.QUERIES_ZONE_TABLE_NAME):
+    conn.execute(f'DROP TABLE IF EXISTS pg_temp."{tableName}";')
+    conn.execute(f'CREATE TEMPORARY TABLE "{tableName}" (zone_id integer NOT NULL PRIMARY KEY, geom geometry NOT NULL);')
+    
+    if len(zones) > 0:
+        insertQuery = text(f"""INSERT INTO "{tableName}" (zone_id, geom)
+                               VALUES (:zoneId, ST_Transform(ST_GeomFromText(:polygon, {geojsonEpsg}), {config.getDatabaseSRID()}))""")
+        conn.execute(insertQuery, [{"zoneId": zoneId, "polygon": polygon} for zoneId, polygon in zones])
+    
+    conn.execute(f'CREATE INDEX ON "{tableName}" USING GIST (geom);')
+    conn.execute(f'ANALYZE "{tableName}";')
\ No newline at end of file
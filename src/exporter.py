@@ -0,0 +1,203 @@
+from furbain import databaseTools
+from furbain import profiler
+from sqlalchemy.sql import text
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.ipc as paipc
+import pyarrow.parquet as pq
+import os
+import tempfile
+
+
+EXPORT_FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow'}
+GEOMETRY_FORMATS = ['wkb', 'wkt', 'coordinates']
+
+# arrow types of the postgresql types, the other types are exported as strings
+ARROW_TYPES = {
+    'int2': pa.int16(),
+    'int4': pa.int32(),
+    'int8': pa.int64(),
+    'float4': pa.float32(),
+    'float8': pa.float64(),
+    'numeric': pa.float64(),
+    'bool': pa.bool_(),
+}
+
+
+# Exports a table of the selected database to a csv, parquet or arrow (IPC file) file
+# the rows are streamed out of the database with COPY TO, without being converted to python objects
+#
+# format : 'csv', 'parquet' or 'arrow', by default it is chosen from the extension of the file
+# columns : list of the columns to export, by default all the columns of the table
+# where : sql condition on the rows to export, eg: "start_time_seconds >= 3600"
+# limit, offset : range of rows to export, in the order of orderBy (or in the order of the table if it is not set)
+# geometryFormat : how the geometry columns are exported
+#       'wkb' : well-known binary (hex string in csv files)
+#       'wkt' : well-known text
+#       'coordinates' : two columns "{column}_x" and "{column}_y", the coordinates of the centroid of the geometry
+# The interval columns are exported as durations in seconds (integers in csv files)
+def exportTable(tableName, filePath, format=None, columns=None, where=None, orderBy=None, limit=None, offset=None, geometryFormat='wkb'):
+    if tableName not in databaseTools.getTablesFromDatabase():
+        raise Exception(f'The table "{tableName}" does not exist.')
+
+    exportQuery(_getTableQuery(tableName, columns, where, orderBy, limit, offset), filePath, format, geometryFormat)
+
+
+# Exports the result of a sql query to a csv, parquet or arrow file, see exportTable
+@profiler.profiled
+def exportQuery(query, filePath, format=None, geometryFormat='wkb'):
+    format = _getFormat(filePath, format)
+    conn = databaseTools.connectToDatabase()
+
+    try:
+        copyQuery, arrowTypes, hexColumns = _getCopyQuery(conn, query, geometryFormat)
+
+        if format == 'csv':
+            with open(filePath, 'wb') as f:
+                _copyTo(conn, copyQuery, f)
+            return
+
+        schema = pa.schema(arrowTypes.items())
+        writer = pq.ParquetWriter(filePath, schema) if format == 'parquet' else paipc.new_file(filePath, schema)
+        with writer:
+            for batch in _iterateCopyBatches(conn, copyQuery, arrowTypes, hexColumns):
+                if format == 'parquet':
+                    writer.write_table(pa.Table.from_batches([batch], schema))
+                else:
+                    writer.write_batch(batch)
+    finally:
+        conn.close()
+
+
+# Yields a table (or the result of a query if tableName is None) in arrow record batches, see exportTable
+# the rows are copied in a temporary csv file, then read in batches of about batchSizeInMB
+def iterateArrowBatches(tableName=None, query=None, columns=None, where=None, orderBy=None, limit=None, offset=None, geometryFormat='wkb', batchSizeInMB=64):
+    if (tableName is None) == (query is None):
+        raise Exception('Either tableName or query has to be given')
+
+    if tableName is not None:
+        query = _getTableQuery(tableName, columns, where, orderBy, limit, offset)
+
+    conn = databaseTools.connectToDatabase()
+    try:
+        copyQuery, arrowTypes, hexColumns = _getCopyQuery(conn, query, geometryFormat)
+        yield from _iterateCopyBatches(conn, copyQuery, arrowTypes, hexColumns, batchSizeInMB)
+    finally:
+        conn.close()
+
+
+def _getFormat(filePath, format):
+    if format is None:
+        extension = os.path.splitext(filePath)[1].lower()
+        if extension not in EXPORT_FORMATS:
+            raise Exception(f'The format of the file "{filePath}" can\'t be found from its extension, use one of {list(EXPORT_FORMATS)} or set the format')
+        return EXPORT_FORMATS[extension]
+
+    if format not in EXPORT_FORMATS.values():
+        raise Exception(f'The format "{format}" does not exist, use "csv", "parquet" or "arrow"')
+    return format
+
+
+def _getTableQuery(tableName, columns, where, orderBy, limit, offset):
+    selectedColumns = ", ".join(f'"{column}"' for column in columns) if columns else "*"
+    query = f'SELECT {selectedColumns} FROM "{tableName}"'
+
+    if where:
+        query += f" WHERE {where}"
+    if orderBy:
+        query += f" ORDER BY {orderBy}"
+    if limit is not None:
+        query += f" LIMIT {int(limit)}"
+    if offset is not None:
+        query += f" OFFSET {int(offset)}"
+
+    return query
+
+
+# Returns the COPY query of the rows of the query with the geometry and interval columns converted,
+# the arrow type of each exported column and the columns holding hex strings to decode to binary
+def _getCopyQuery(conn, query, geometryFormat):
+    if geometryFormat not in GEOMETRY_FORMATS:
+        raise Exception(f'The geometry format "{geometryFormat}" does not exist, use one of {GEOMETRY_FORMATS}')
+
+    exportedColumns = []
+    arrowTypes = {}
+    hexColumns = []
+    for column, typeName in _getColumnsTypes(conn, query):
+        quotedColumn = '"' + column.replace('"', '""') + '"'
+
+        if typeName == 'geometry' and geometryFormat == 'wkb':
+            exportedColumns.append(f"encode(ST_AsBinary({quotedColumn}), 'hex') AS {quotedColumn}")
+            arrowTypes[column] = pa.binary()
+            hexColumns.append(column)
+        elif typeName == 'geometry' and geometryFormat == 'wkt':
+            exportedColumns.append(f"ST_AsText({quotedColumn}) AS {quotedColumn}")
+            arrowTypes[column] = pa.string()
+        elif typeName == 'geometry':
+            for axis in ['x', 'y']:
+                exportedColumns.append(f'ST_{axis.upper()}(ST_Centroid({quotedColumn})) AS "{column}_{axis}"')
+                arrowTypes[f"{column}_{axis}"] = pa.float64()
+        elif typeName == 'interval':
+            exportedColumns.append(f"extract(epoch from {quotedColumn})::bigint AS {quotedColumn}")
+            arrowTypes[column] = pa.duration('s')
+        else:
+            exportedColumns.append(quotedColumn)
+            arrowTypes[column] = ARROW_TYPES.get(typeName, pa.string())
+
+    copyQuery = f"COPY (SELECT {', '.join(exportedColumns)} FROM ({query}) AS exported) TO STDOUT WITH (FORMAT csv, HEADER)"
+    return copyQuery, arrowTypes, hexColumns
+
+
+# Returns the (name, postgresql type name) of the columns of the query, without running it
+def _getColumnsTypes(conn, query):
+    with conn.connection.cursor() as cursor:
+        cursor.execute(f"SELECT * FROM ({query}) AS exported LIMIT 0")
+        columns = [(column.name, column.type_code) for column in cursor.description]
+
+    typesOids = list({typeOid for name, typeOid in columns})
+    typesNames = dict(conn.execute(text("SELECT oid, typname FROM pg_type WHERE oid = ANY(:oids)").bindparams(oids=typesOids)).fetchall())
+    return [(name, typesNames.get(typeOid)) for name, typeOid in columns]
+
+
+def _copyTo(conn, copyQuery, fileObject):
+    dbapiConnection = conn.connection
+    with profiler.databaseTime(), dbapiConnection.cursor() as cursor:
+        cursor.copy_expert(copyQuery, fileObject)
+    dbapiConnection.commit()
+
+
+# Copies the rows in a temporary csv file, then reads it in arrow record batches with the given types
+def _iterateCopyBatches(conn, copyQuery, arrowTypes, hexColumns, batchSizeInMB=64):
+    temporaryFile = tempfile.NamedTemporaryFile(suffix='.csv', delete=False)
+    try:
+        with temporaryFile:
+            _copyTo(conn, copyQuery, temporaryFile)
+
+        # the hex columns are read as strings, then decoded
+        columnTypes = {column: pa.string() if column in hexColumns else pa.int64() if arrowType == pa.duration('s') else arrowType
+                       for column, arrowType in arrowTypes.items()}
+        reader = pacsv.open_csv(temporaryFile.name,
+                                read_options=pacsv.ReadOptions(block_size=batchSizeInMB * 1024 * 1024),
+                                convert_options=pacsv.ConvertOptions(column_types=columnTypes, true_values=['t'], false_values=['f'],
+                                                                     strings_can_be_null=True, quoted_strings_can_be_null=False))
+        schema = pa.schema(arrowTypes.items())
+        for batch in reader:
+            arrays = [_decodeHexArray(array) if column in hexColumns else array.cast(arrowTypes[column])
+                      for column, array in zip(batch.schema.names, batch.columns)]
+            yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+    finally:
+        os.remove(temporaryFile.name)
+
+
+# Decodes an array of hex strings to binary at once, the hex characters of all the values are contiguous in the data buffer,
+# so they are decoded together and the offsets are divided by two
+def _decodeHexArray(array):
+    array = pa.concat_arrays([array]) if array.offset != 0 else array
+    validityBuffer, offsetsBuffer, dataBuffer = array.buffers()
+    offsets = pa.Array.from_buffers(pa.int32(), len(array) + 1, [None, offsetsBuffer])
+    firstOffset, lastOffset = offsets[0].as_py(), offsets[-1].as_py()
+
+    data = bytes.fromhex(dataBuffer.to_pybytes()[firstOffset:lastOffset].decode()) if dataBuffer is not None else b''
+    binaryOffsets = pc.divide(pc.subtract(offsets, firstOffset), 2).cast(pa.int32())
+    return pa.Array.from_buffers(pa.binary(), len(array), [validityBuffer, binaryOffsets.buffers()[1], pa.py_buffer(data)], null_count=array.null_count)
@@ -1,6 +1,19 @@
 import argparse
 from furbain import config
 
+# converters run by the import command (in this order), by name of the imported files
+IMPORT_CONVERTERS = {
+    'networkLinks': 'importNetworkLinks',
+    'facilities': 'importFacilities',
+    'households': 'importHouseholds',
+    'persons': 'importPersons',
+    'vehicles': 'importVehicles',
+    'activities': 'importActivities',
+    'trips': 'importTrips',
+    'events': 'importEvents',
+    'buildings': 'importBuildings',
+}
+
 def main(args=None):
     parser = argparse.ArgumentParser(description='Command line tool for furbain')
     parser.add_argument('-u', '--user', help='The user to connect to the database')
@@ -10,8 +23,47 @@ def main(args=None):
     parser.add_argument('-s', '--srid', help='The SRID of the database')
     parser.add_argument('-o', '--output', help='The path to the output folder of the matsim simulation')
     
+    subparsers = parser.add_subparsers(dest='command')
+    exportParser = subparsers.add_parser('export', help='Export a table or the result of a query to a csv, parquet or arrow file')
+    exportParser.add_argument('file', help='The file to create, its extension gives the format if --format is not set (.csv, .parquet, .arrow)')
+    exportParser.add_argument('-d', '--database', required=True, help='The database to export from')
+    exportSource = exportParser.add_mutually_exclusive_group(required=True)
+    exportSource.add_argument('-t', '--table', help='The table to export')
+    exportSource.add_argument('-q', '--query', help='The sql query whose result is exported')
+    exportParser.add_argument('-f', '--format', choices=['csv', 'parquet', 'arrow'], help='The format of the file')
+    exportParser.add_argument('-c', '--columns', help='The columns of the table to export, separated by commas')
+    exportParser.add_argument('-w', '--where', help='The sql condition on the rows of the table to export')
+    exportParser.add_argument('--order-by', help='The sql ordering of the rows of the table, used by --limit and --offset')
+    exportParser.add_argument('--limit', type=int, help='The maximum number of rows of the table to export')
+    exportParser.add_argument('--offset', type=int, help='The number of rows of the table to skip')
+    exportParser.add_argument('-g', '--geometry', choices=['wkb', 'wkt', 'coordinates'], default='wkb', help='The format of the geometry columns')
+    _addProfileArguments(exportParser)
+    
+    importParser = subparsers.add_parser('import', help='Import the files of the simulation output in a database')
+    importParser.add_argument('-d', '--database', required=True, help='The database to import in')
+    importParser.add_argument('-t', '--tables', nargs='+', choices=list(IMPORT_CONVERTERS), metavar='TABLE', help=f'The files to import, by default all of them ({", ".join(IMPORT_CONVERTERS)})')
+    _addProfileArguments(importParser)
+    
+    generateParser = subparsers.add_parser('generate', help='Generate a synthetic matsim simulation output')
+    generateParser.add_argument('directory', help='The directory in which the files are written')
+    generateParser.add_argument('-f', '--scale-factor', type=float, default=1, help=f'The number of agents is {config.GENERATOR_AGENTS_PER_SCALE_FACTOR} times the scale factor')
+    generateParser.add_argument('--seed', type=int, default=0, help='The seed of the random generator')
+    
     args = parser.parse_args(args)
     
+    if args.command in ['export', 'import'] and args.cprofile_stage is not None and args.profile is None:
+        parser.error('--cprofile-stage requires --profile')
+    
+    if args.command == 'export':
+        _runProfiled(args, _export)
+        return
+    elif args.command == 'import':
+        _runProfiled(args, _import)
+        return
+    elif args.command == 'generate':
+        _generate(args)
+        return
+    
     for arg in vars(args):
         currentArg = getattr(args, arg)
         
@@ -31,4 +83,53 @@ def main(args=None):
             
             if arg == 'password':
                 currentArg = '********'
-            print('The ' + arg + ' has been set to ' + currentArg)
\ No newline at end of file
+            print('The ' + arg + ' has been set to ' + currentArg)
+
+
+def _addProfileArguments(subparser):
+    subparser.add_argument('--profile', metavar='REPORT', help='Write the time, database time, rows and peak memory of each stage in this json file')
+    subparser.add_argument('--cprofile-stage', help='The name or path of a stage to run under cProfile (eg: importTrips/read)')
+    subparser.add_argument('--cprofile-output', help='The file of the cProfile statistics, by default the report file with the .prof extension')
+
+
+# Runs the command, inside a profile if --profile is set (see profiler)
+def _runProfiled(args, command):
+    if args.profile is None:
+        command(args)
+        return
+    
+    from furbain import profiler
+    with profiler.profile(args.profile, args.cprofile_stage, args.cprofile_output):
+        command(args)
+    print(f'Profile report written in {args.profile}')
+
+
+def _export(args):
+    # imported here, so the other commands do not load pyarrow
+    from furbain import databaseTools, exporter
+    
+    databaseTools.selectDatabase(args.database, False)
+    
+    if args.table is not None:
+        columns = [column.strip() for column in args.columns.split(',')] if args.columns else None
+        exporter.exportTable(args.table, args.file, args.format, columns, args.where, args.order_by, args.limit, args.offset, args.geometry)
+    else:
+        exporter.exportQuery(args.query, args.file, args.format, args.geometry)
+    
+    print(f'Exported to {args.file}')
+
+
+def _import(args):
+    from furbain import converter, databaseTools
+    
+    databaseTools.selectDatabase(args.database, False)
+    
+    for table in args.tables or IMPORT_CONVERTERS:
+        print(f'Importing {table}...')
+        getattr(converter, IMPORT_CONVERTERS[table])()
+
+
+def _generate(args):
+    from furbain import generator
+    
+    generator.generateSimulationOutput(args.directory, args.scale_factor, args.seed)
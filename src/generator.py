@@ -0,0 +1,581 @@
+from furbain import config
+from furbain import tools
+import contextlib
+import gzip
+import json
+import math
+import os
+import random
+import tempfile
+
+
+# Road classes of the generated links : (freespeed in m/s, capacity in vehicles per hour, lanes)
+# every tenth line of the grid is a primary road, every fifth a secondary road
+ROAD_CLASSES = {
+    'primary': (13.89, 1800.0, 2),
+    'secondary': (11.11, 1200.0, 1),
+    'residential': (8.33, 600.0, 1),
+}
+
+# (x, y) step of the directions of the links leaving a node of the grid
+DIRECTIONS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+
+# Daily activity chains of the agents and their weights
+ACTIVITY_CHAINS = [
+    (['home', 'work', 'home'], 35),
+    (['home', 'work', 'shop', 'home'], 10),
+    (['home', 'work', 'leisure', 'home'], 8),
+    (['home', 'education', 'home'], 15),
+    (['home', 'shop', 'home'], 8),
+    (['home', 'leisure', 'home'], 8),
+    (['home', 'shop', 'leisure', 'home'], 8),
+    (['home'], 8),
+]
+OTHER_ACTIVITY_TYPES = ['work', 'education', 'shop', 'leisure']
+
+# mean and standard deviation of the duration of the activities (seconds)
+ACTIVITY_DURATIONS = {
+    'work': (8 * 3600, 3600),
+    'education': (7 * 3600, 1800),
+    'shop': (2400, 900),
+    'leisure': (2 * 3600, 2400),
+}
+
+# speed (m/s) of the teleported modes, their distance is the euclidean distance multiplied by BEELINE_DISTANCE_FACTOR
+TELEPORTED_MODES_SPEEDS = {'walk': 1.2, 'bike': 4.0, 'pt': 6.0}
+BEELINE_DISTANCE_FACTOR = 1.3
+
+DETAILED_GEOMETRY_OFFSET_IN_METERS = 10 # the detailed geometry of a link goes through a point shifted from its middle
+FACILITY_OFFSET_IN_METERS = 15 # distance between a facility and its link
+FACILITY_CELL_SIZE_IN_METERS = 1000 # the destinations of the trips are searched in cells of this size
+MEAN_TRIP_DISTANCE_IN_METERS = 2500
+
+PERSONS_CSV_COLUMNS = ['person', 'executed_score', 'first_act_x', 'first_act_y', 'first_act_type', 'htsPersonId', 'sex', 'bikeAvailability',
+                       'htsHouseholdId', 'censusPersonId', 'employed', 'motorbikesAvailability', 'householdId', 'hasLicense', 'carAvailability',
+                       'hasPtSubscription', 'isPassenger', 'age', 'householdIncome', 'censusHouseholdId', 'isOutside']
+TRIPS_CSV_COLUMNS = ['person', 'trip_number', 'trip_id', 'dep_time', 'trav_time', 'wait_time', 'traveled_distance', 'euclidean_distance',
+                     'main_mode', 'longest_distance_mode', 'modes', 'start_activity_type', 'end_activity_type', 'start_facility_id', 'start_link',
+                     'start_x', 'start_y', 'end_facility_id', 'end_link', 'end_x', 'end_y', 'first_pt_boarding_stop', 'last_pt_egress_stop']
+LEGS_CSV_COLUMNS = ['person', 'trip_id', 'dep_time', 'trav_time', 'wait_time', 'distance', 'mode', 'start_link', 'start_x', 'start_y',
+                    'end_link', 'end_x', 'end_y', 'access_stop_id', 'egress_stop_id', 'transit_line', 'transit_route', 'vehicle_id']
+
+XML_HEADER = '<?xml version="1.0" encoding="utf-8"?>\n'
+MATSIM_NAMESPACE = 'xmlns="http://www.matsim.org/files/dtd" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+CRS_ATTRIBUTES = '\t<attributes>\n\t\t<attribute name="coordinateReferenceSystem" class="java.lang.String">EPSG:2154</attribute>\n\t</attributes>\n'
+
+
+# Writes a consistent synthetic matsim simulation output in outputPath, with the file names of the configuration file
+# (network, detailed network, facilities, buildings, households, persons, plans, experienced plans, trips, legs, events and vehicles)
+# scaleFactor : the number of agents is config.GENERATOR_AGENTS_PER_SCALE_FACTOR * scaleFactor, the size of the network grows with it
+# seed : the same seed and scale factor always generate the same files
+#
+# The network is a grid of two-way links centered on config.GENERATOR_CENTER (EPSG:2154)
+# Each household lives in its own home facility, the agents follow a daily activity chain (home, work, education, shop, leisure)
+# and travel by car on the shortest path of the grid, or by a teleported mode (walk, bike, pt)
+# The files are written agent by agent, the memory used doesn't depend on the number of agents
+# (except the other facilities, about one for twenty agents, and one bucket of events sorted at once)
+def generateSimulationOutput(outputPath, scaleFactor=1, seed=0):
+    nbAgents = max(1, round(config.GENERATOR_AGENTS_PER_SCALE_FACTOR * scaleFactor))
+    gridSize = max(3, math.ceil(math.sqrt(nbAgents / 10)))
+    rng = random.Random(seed)
+    os.makedirs(outputPath, exist_ok=True)
+
+    print(f"Generating the network ({gridSize * gridSize} nodes)...")
+    _writeNetwork(outputPath, gridSize)
+
+    print(f"Generating {nbAgents} agents...")
+    with contextlib.ExitStack() as stack:
+        files = {name: stack.enter_context(_openOutputFile(outputPath, name))
+                 for name in ['facilities', 'buildings', 'households', 'persons', 'plans', 'experienced_plans', 'trips', 'legs', 'allvehicles']}
+        eventsDirectory = stack.enter_context(tempfile.TemporaryDirectory(dir=outputPath))
+        eventsBuckets = {}
+
+        _writeHeaders(files)
+
+        # the work, education, shop and leisure facilities are created first, the homes are created with the households
+        nbOtherFacilities = max(2 * len(OTHER_ACTIVITY_TYPES), nbAgents // 20)
+        facilitiesByType = {activityType: {} for activityType in OTHER_ACTIVITY_TYPES}
+        for index in range(nbOtherFacilities):
+            activityType = OTHER_ACTIVITY_TYPES[index % len(OTHER_ACTIVITY_TYPES)]
+            facility = _createFacility(rng, gridSize, f"{activityType}_{index // len(OTHER_ACTIVITY_TYPES) + 1}", activityType)
+            facilitiesByType[activityType].setdefault(_getCell(gridSize, facility['x'], facility['y']), []).append(facility)
+            _writeFacility(files, facility, index + 1)
+
+        personId = 0
+        householdId = 0
+        while personId < nbAgents:
+            householdId += 1
+            home = _createFacility(rng, gridSize, f"home_{householdId}", 'home')
+            _writeFacility(files, home, nbOtherFacilities + householdId)
+
+            household = {
+                'id': householdId,
+                'members': list(range(personId + 1, min(personId + rng.choice([1, 1, 2, 2, 2, 3, 3, 4]), nbAgents) + 1)),
+                'home': home,
+                'income': round(rng.lognormvariate(7.8, 0.4), 2),
+                'carAvailability': rng.choices(['all', 'some', 'none'], [6, 2, 2])[0],
+                'bikeAvailability': rng.choices(['all', 'some', 'none'], [5, 2, 3])[0],
+            }
+            _writeHousehold(files, household)
+
+            for memberId in household['members']:
+                _generateAgent(rng, gridSize, files, eventsDirectory, eventsBuckets, memberId, household, facilitiesByType)
+            personId = household['members'][-1]
+
+        _writeFooters(files)
+
+        print("Sorting the events...")
+        _writeEvents(outputPath, eventsBuckets)
+
+    print(f"Simulation output generated in {outputPath}")
+
+
+# Opens a file of the simulation output for writing, by the name of its variable in the configuration file (eg: 'network')
+# the .gz files are compressed with a low level, the generation is limited by the compression otherwise
+def _openOutputFile(outputPath, name):
+    filePath = os.path.join(outputPath, config.getVariableInConfigurationFile(f'{name}_filename'))
+    if filePath.endswith('.gz'):
+        return gzip.open(filePath, 'wt', compresslevel=1)
+    return open(filePath, 'w')
+
+
+# ----- Network -----
+
+def _getNodeCoordinates(gridSize, nodeIndex):
+    spacing = config.GENERATOR_NODE_SPACING_IN_METERS
+    x = config.GENERATOR_CENTER[0] - (gridSize - 1) * spacing / 2 + (nodeIndex % gridSize) * spacing
+    y = config.GENERATOR_CENTER[1] - (gridSize - 1) * spacing / 2 + (nodeIndex // gridSize) * spacing
+    return x, y
+
+
+# Returns the index of the node at the end of the link leaving nodeIndex in the direction, or None if it is outside the grid
+def _getLinkToNode(gridSize, nodeIndex, direction):
+    i = nodeIndex % gridSize + DIRECTIONS[direction][0]
+    j = nodeIndex // gridSize + DIRECTIONS[direction][1]
+    if 0 <= i < gridSize and 0 <= j < gridSize:
+        return j * gridSize + i
+    return None
+
+
+# The id of a link is computed from its starting node and its direction
+def _getLinkId(nodeIndex, direction):
+    return nodeIndex * 4 + direction + 1
+
+
+def _getLinkNodes(gridSize, linkId):
+    nodeIndex, direction = divmod(linkId - 1, 4)
+    return nodeIndex, _getLinkToNode(gridSize, nodeIndex, direction)
+
+
+# Returns the road class and the osm way id of the line of the grid holding the link
+def _getLinkRoad(gridSize, linkId):
+    nodeIndex, direction = divmod(linkId - 1, 4)
+    if direction < 2:
+        lineIndex = nodeIndex // gridSize
+        wayId = lineIndex + 1
+    else:
+        lineIndex = nodeIndex % gridSize
+        wayId = gridSize + lineIndex + 1
+
+    if lineIndex % 10 == 0:
+        return 'primary', wayId
+    elif lineIndex % 5 == 0:
+        return 'secondary', wayId
+    return 'residential', wayId
+
+
+# Length of the detailed geometry of the links, which all have the same shape
+def _getLinkLength():
+    return round(2 * math.hypot(config.GENERATOR_NODE_SPACING_IN_METERS / 2, DETAILED_GEOMETRY_OFFSET_IN_METERS), 2)
+
+
+# Returns the point at the given fraction of the link, shifted to its right by offset meters
+def _getPointOnLink(gridSize, linkId, fraction, offset):
+    fromNodeIndex, toNodeIndex = _getLinkNodes(gridSize, linkId)
+    fromX, fromY = _getNodeCoordinates(gridSize, fromNodeIndex)
+    toX, toY = _getNodeCoordinates(gridSize, toNodeIndex)
+    length = math.hypot(toX - fromX, toY - fromY)
+    x = fromX + fraction * (toX - fromX) + offset * (toY - fromY) / length
+    y = fromY + fraction * (toY - fromY) - offset * (toX - fromX) / length
+    return round(x, 2), round(y, 2)
+
+
+def _writeNetwork(outputPath, gridSize):
+    linkLength = _getLinkLength()
+
+    with _openOutputFile(outputPath, 'network') as networkFile, _openOutputFile(outputPath, 'detailed_network') as detailedNetworkFile:
+        networkFile.write(XML_HEADER + '<!DOCTYPE network SYSTEM "http://www.matsim.org/files/dtd/network_v2.dtd">\n<network>\n')
+        networkFile.write(CRS_ATTRIBUTES + '\n\t<nodes>\n')
+        for nodeIndex in range(gridSize * gridSize):
+            x, y = _getNodeCoordinates(gridSize, nodeIndex)
+            networkFile.write(f'\t\t<node id="{nodeIndex + 1}" x="{x}" y="{y}" >\n\t\t</node>\n')
+
+        networkFile.write('\t</nodes>\n\n\t<links capperiod="01:00:00" effectivecellsize="7.5" effectivelanewidth="3.75">\n')
+        detailedNetworkFile.write(f'LinkId{config.DETAILED_NETWORK_CSV_SEPARATOR}Geometry\n')
+        for nodeIndex in range(gridSize * gridSize):
+            for direction in range(len(DIRECTIONS)):
+                toNodeIndex = _getLinkToNode(gridSize, nodeIndex, direction)
+                if toNodeIndex is None:
+                    continue
+
+                linkId = _getLinkId(nodeIndex, direction)
+                roadClass, wayId = _getLinkRoad(gridSize, linkId)
+                freespeed, capacity, lanes = ROAD_CLASSES[roadClass]
+                networkFile.write(f'\t\t<link id="{linkId}" from="{nodeIndex + 1}" to="{toNodeIndex + 1}" length="{linkLength}" freespeed="{freespeed}" '
+                                  f'capacity="{capacity}" permlanes="{float(lanes)}" oneway="1" modes="car" >\n'
+                                  f'\t\t\t<attributes>\n'
+                                  f'\t\t\t\t<attribute name="osm:way:highway" class="java.lang.String">{roadClass}</attribute>\n'
+                                  f'\t\t\t\t<attribute name="osm:way:id" class="java.lang.Long">{wayId}</attribute>\n'
+                                  f'\t\t\t\t<attribute name="osm:way:lanes" class="java.lang.String">{lanes}</attribute>\n'
+                                  f'\t\t\t</attributes>\n\t\t</link>\n')
+
+                fromX, fromY = _getNodeCoordinates(gridSize, nodeIndex)
+                toX, toY = _getNodeCoordinates(gridSize, toNodeIndex)
+                middleX, middleY = _getPointOnLink(gridSize, linkId, 0.5, DETAILED_GEOMETRY_OFFSET_IN_METERS)
+                detailedNetworkFile.write(f'{linkId}{config.DETAILED_NETWORK_CSV_SEPARATOR}"LINESTRING({fromX} {fromY}, {middleX} {middleY}, {toX} {toY})"\n')
+
+        networkFile.write('\t</links>\n\n</network>\n')
+
+
+# Returns the links of the route between two links, going along the x axis then the y axis of the grid
+def _getRoute(gridSize, startLinkId, endLinkId):
+    if startLinkId == endLinkId:
+        return [startLinkId]
+
+    route = [startLinkId]
+    nodeIndex = _getLinkNodes(gridSize, startLinkId)[1]
+    targetNodeIndex = _getLinkNodes(gridSize, endLinkId)[0]
+    while nodeIndex != targetNodeIndex:
+        i, j = nodeIndex % gridSize, nodeIndex // gridSize
+        targetI, targetJ = targetNodeIndex % gridSize, targetNodeIndex // gridSize
+
+        if i != targetI:
+            direction = 0 if i < targetI else 1
+        else:
+            direction = 2 if j < targetJ else 3
+
+        route.append(_getLinkId(nodeIndex, direction))
+        nodeIndex = _getLinkToNode(gridSize, nodeIndex, direction)
+
+    route.append(endLinkId)
+    return route
+
+
+# ----- Facilities -----
+
+def _createFacility(rng, gridSize, facilityId, activityType):
+    while True:
+        nodeIndex = rng.randrange(gridSize * gridSize)
+        direction = rng.randrange(len(DIRECTIONS))
+        if _getLinkToNode(gridSize, nodeIndex, direction) is not None:
+            break
+
+    linkId = _getLinkId(nodeIndex, direction)
+    x, y = _getPointOnLink(gridSize, linkId, rng.uniform(0.2, 0.8), FACILITY_OFFSET_IN_METERS)
+    return {'id': facilityId, 'linkId': linkId, 'x': x, 'y': y, 'type': activityType}
+
+
+def _getCell(gridSize, x, y):
+    spacing = config.GENERATOR_NODE_SPACING_IN_METERS
+    originX = config.GENERATOR_CENTER[0] - (gridSize - 1) * spacing / 2
+    originY = config.GENERATOR_CENTER[1] - (gridSize - 1) * spacing / 2
+    return int((x - originX) // FACILITY_CELL_SIZE_IN_METERS), int((y - originY) // FACILITY_CELL_SIZE_IN_METERS)
+
+
+# Chooses a facility of the type at a random distance of the origin (exponential distribution),
+# or anywhere if there is no facility of the type around the chosen point
+def _chooseFacility(rng, gridSize, facilitiesByType, activityType, origin):
+    distance = rng.expovariate(1 / MEAN_TRIP_DISTANCE_IN_METERS)
+    angle = rng.uniform(0, 2 * math.pi)
+    cell = _getCell(gridSize, origin['x'] + distance * math.cos(angle), origin['y'] + distance * math.sin(angle))
+
+    candidates = facilitiesByType[activityType].get(cell)
+    if not candidates:
+        candidates = rng.choice(list(facilitiesByType[activityType].values()))
+    return rng.choice(candidates)
+
+
+# ----- Agents -----
+
+# Generates the plans, trips, legs and events of an agent of the household
+def _generateAgent(rng, gridSize, files, eventsDirectory, eventsBuckets, personId, household, facilitiesByType):
+    chain = rng.choices([chain for chain, weight in ACTIVITY_CHAINS], [weight for chain, weight in ACTIVITY_CHAINS])[0]
+    if 'education' in chain:
+        age = rng.randint(6, 24)
+    elif 'work' in chain:
+        age = rng.randint(18, 64)
+    else:
+        age = rng.randint(18, 90)
+
+    hasLicense = age >= 18 and rng.random() < 0.85
+    carAvailability = household['carAvailability'] if hasLicense else 'none'
+    if carAvailability != 'none' and rng.random() < (0.8 if carAvailability == 'all' else 0.5):
+        mainMode = 'car'
+    elif household['bikeAvailability'] != 'none' and rng.random() < 0.3:
+        mainMode = 'bike'
+    else:
+        mainMode = 'pt'
+
+    facilities = [household['home']]
+    for activityType in chain[1:-1]:
+        facilities.append(_chooseFacility(rng, gridSize, facilitiesByType, activityType, facilities[-1]))
+    if len(chain) > 1:
+        facilities.append(household['home'])
+
+    # activities : (facility, start time, end time), the first activity has no start time and the last one no end time
+    activities = []
+    legs = []
+    startTime = None
+    endTime = min(max(int(rng.gauss(7.5 * 3600, 3600)), 4 * 3600), 11 * 3600) if len(facilities) > 1 else None
+    for index, facility in enumerate(facilities):
+        if index > 0:
+            legs.append(_createLeg(rng, gridSize, facilities[index - 1], facility, mainMode, endTime))
+            startTime = endTime + legs[-1]['travelTime']
+
+            if index == len(facilities) - 1:
+                endTime = None
+            else:
+                mean, standardDeviation = ACTIVITY_DURATIONS[facility['type']]
+                endTime = startTime + max(600, int(rng.gauss(mean, standardDeviation)))
+        activities.append((facility, startTime, endTime))
+
+    # the alternative plan of the agent only uses the walk mode, it is written before or after the selected one
+    score = round(rng.uniform(80, 140), 4)
+    alternativeLegs = [_createLeg(rng, gridSize, activities[index][0], activities[index + 1][0], 'walk', leg['departureTime']) for index, leg in enumerate(legs)]
+    alternativePlan = (round(score - rng.uniform(5, 40), 4), 'no', activities, alternativeLegs)
+    plans = [(score, 'yes', activities, legs)]
+    if rng.random() < 0.5:
+        plans.insert(rng.randrange(2), alternativePlan)
+
+    _writePerson(files, personId, household, age, hasLicense, carAvailability, score, 'work' in chain)
+    _writePlans(files['plans'], personId, age, carAvailability, plans)
+    _writePlans(files['experienced_plans'], personId, None, None, [(score, 'yes', activities, legs)], experienced=True)
+    _writeTrips(files, personId, activities, legs)
+    _writeAgentEvents(eventsDirectory, eventsBuckets, personId, activities, legs)
+
+    if carAvailability != 'none':
+        files['allvehicles'].write(f'\t<vehicle id="{personId}" type="car"/>\n')
+
+
+# Returns the leg between two facilities, the car legs follow the route of the grid,
+# the other legs (and the car legs starting and ending on the same link) are teleported
+def _createLeg(rng, gridSize, origin, destination, mode, departureTime):
+    euclideanDistance = math.hypot(destination['x'] - origin['x'], destination['y'] - origin['y'])
+    if mode == 'car' and origin['linkId'] == destination['linkId']:
+        mode = 'walk'
+    elif mode != 'car' and euclideanDistance < 1000:
+        mode = 'walk'
+
+    leg = {'mode': mode, 'departureTime': departureTime, 'origin': origin, 'destination': destination,
+           'euclideanDistance': round(euclideanDistance), 'route': None, 'linkTimes': []}
+
+    if mode == 'car':
+        # the vehicle leaves the start link one second after the departure, then drives each link of the route
+        # at a random fraction of its freespeed, it arrives at the end of the last link
+        leg['route'] = _getRoute(gridSize, origin['linkId'], destination['linkId'])
+        linkLength = _getLinkLength()
+        time = departureTime + 1
+        for linkId in leg['route'][1:]:
+            freespeed = ROAD_CLASSES[_getLinkRoad(gridSize, linkId)[0]][0]
+            linkTravelTime = math.ceil(linkLength / (freespeed * rng.uniform(0.6, 1.0)))
+            leg['linkTimes'].append((linkId, time, time + linkTravelTime))
+            time += linkTravelTime
+        leg['distance'] = round(linkLength * (len(leg['route']) - 1), 2)
+        leg['travelTime'] = time - departureTime
+    else:
+        leg['distance'] = round(euclideanDistance * BEELINE_DISTANCE_FACTOR, 2)
+        leg['travelTime'] = max(1, math.ceil(leg['distance'] / TELEPORTED_MODES_SPEEDS[mode]))
+
+    return leg
+
+
+# ----- Writers -----
+
+def _writeHeaders(files):
+    files['facilities'].write(XML_HEADER + '<!DOCTYPE facilities SYSTEM "http://www.matsim.org/files/dtd/facilities_v1.dtd">\n<facilities>\n')
+    files['buildings'].write('{\n"type": "FeatureCollection",\n"name": "BUILDINGS",\n'
+                             '"crs": { "type": "name", "properties": { "name": "urn:ogc:def:crs:EPSG::2154" } },\n"features": [\n')
+    files['households'].write(XML_HEADER + f'<households {MATSIM_NAMESPACE} xsi:schemaLocation="http://www.matsim.org/files/dtd http://www.matsim.org/files/dtd/households_v2.0.xsd">\n')
+    files['persons'].write(config.PERSONS_CSV_SEPARATOR.join(PERSONS_CSV_COLUMNS) + '\n')
+    for name in ['plans', 'experienced_plans']:
+        files[name].write(XML_HEADER + '<!DOCTYPE population SYSTEM "http://www.matsim.org/files/dtd/population_v6.dtd">\n\n<population>\n' + CRS_ATTRIBUTES + '\n')
+    files['trips'].write(config.TRIPS_CSV_SEPARATOR.join(TRIPS_CSV_COLUMNS) + '\n')
+    files['legs'].write(';'.join(LEGS_CSV_COLUMNS) + '\n')
+    files['allvehicles'].write(XML_HEADER + f'<vehicleDefinitions {MATSIM_NAMESPACE} xsi:schemaLocation="http://www.matsim.org/files/dtd http://www.matsim.org/files/dtd/vehicleDefinitions_v2.0.xsd">\n'
+                               '\t<vehicleType id="car">\n'
+                               '\t\t<attributes>\n'
+                               '\t\t\t<attribute name="accessTimeInSecondsPerPerson" class="java.lang.Double">1.0</attribute>\n'
+                               '\t\t\t<attribute name="doorOperationMode" class="org.matsim.vehicles.VehicleType$DoorOperationMode">serial</attribute>\n'
+                               '\t\t\t<attribute name="egressTimeInSecondsPerPerson" class="java.lang.Double">1.0</attribute>\n'
+                               '\t\t</attributes>\n'
+                               '\t\t<capacity seats="4" standingRoomInPersons="0">\n\t\t</capacity>\n'
+                               '\t\t<length meter="7.5"/>\n'
+                               '\t\t<width meter="1.0"/>\n'
+                               '\t\t<passengerCarEquivalents pce="1.0"/>\n'
+                               '\t\t<networkMode networkMode="car"/>\n'
+                               '\t\t<flowEfficiencyFactor factor="1.0"/>\n'
+                               '\t</vehicleType>\n')
+
+
+def _writeFooters(files):
+    files['facilities'].write('</facilities>\n')
+    files['buildings'].write('\n]\n}\n')
+    files['households'].write('</households>\n')
+    for name in ['plans', 'experienced_plans']:
+        files[name].write('</population>\n')
+    files['allvehicles'].write('</vehicleDefinitions>\n')
+
+
+# Writes the facility and its building, a square around the facility
+def _writeFacility(files, facility, buildingId):
+    files['facilities'].write(f'\t<facility id="{facility["id"]}" linkId="{facility["linkId"]}" x="{facility["x"]}" y="{facility["y"]}">\n'
+                              f'\t\t<activity type="{facility["type"]}">\n\t\t</activity>\n\t</facility>\n')
+
+    x, y, halfSide = facility['x'], facility['y'], 6
+    building = {
+        'type': 'Feature',
+        'properties': {'PK': buildingId, 'HEIGHT': 3.0 * (1 + buildingId % 5)},
+        'geometry': {'type': 'Polygon', 'coordinates': [[[x - halfSide, y - halfSide], [x + halfSide, y - halfSide], [x + halfSide, y + halfSide], [x - halfSide, y + halfSide], [x - halfSide, y - halfSide]]]},
+    }
+    files['buildings'].write((',\n' if buildingId > 1 else '') + json.dumps(building))
+
+
+def _writeHousehold(files, household):
+    members = ''.join(f'\t\t\t<personId refId="{memberId}" />\n' for memberId in household['members'])
+    files['households'].write(f'\t<household id="{household["id"]}">\n'
+                              f'\t\t<members>\n{members}\t\t</members>\n'
+                              f'\t\t<income currency="EUR" period="month">{household["income"]}</income>\n'
+                              f'\t\t<attributes>\n'
+                              f'\t\t\t<attribute name="bikeAvailability" class="java.lang.String">{household["bikeAvailability"]}</attribute>\n'
+                              f'\t\t\t<attribute name="carAvailability" class="java.lang.String">{household["carAvailability"]}</attribute>\n'
+                              f'\t\t\t<attribute name="censusId" class="java.lang.Long">{household["id"]}</attribute>\n'
+                              f'\t\t\t<attribute name="household_income" class="java.lang.Double">{household["income"]}</attribute>\n'
+                              f'\t\t</attributes>\n\t</household>\n')
+
+
+def _writePerson(files, personId, household, age, hasLicense, carAvailability, score, employed):
+    home = household['home']
+    values = [personId, score, home['x'], home['y'], 'home', personId, 'mf'[personId % 2], household['bikeAvailability'],
+              household['id'], personId, employed, 'none', household['id'], hasLicense, carAvailability,
+              carAvailability == 'none', False, age, household['income'], household['id'], False]
+    files['persons'].write(config.PERSONS_CSV_SEPARATOR.join(_formatCsvValue(value) for value in values) + '\n')
+
+
+# Writes a person and its plans, the experienced plans have the start and end times of the activities,
+# the plans only the end times
+def _writePlans(file, personId, age, carAvailability, plans, experienced=False):
+    file.write(f'\t<person id="{personId}">\n')
+    if age is not None:
+        file.write(f'\t\t<attributes>\n'
+                   f'\t\t\t<attribute name="age" class="java.lang.Integer">{age}</attribute>\n'
+                   f'\t\t\t<attribute name="carAvailability" class="java.lang.String">{carAvailability}</attribute>\n'
+                   f'\t\t</attributes>\n')
+
+    for score, selected, activities, legs in plans:
+        file.write(f'\t\t<plan score="{score}" selected="{selected}">\n')
+        for index, (facility, startTime, endTime) in enumerate(activities):
+            if index > 0:
+                _writeLeg(file, personId, legs[index - 1])
+
+            times = ''
+            if experienced and startTime is not None:
+                times += f' start_time="{tools.getFormattedTime(startTime)}"'
+            if endTime is not None:
+                times += f' end_time="{tools.getFormattedTime(endTime)}"'
+            file.write(f'\t\t\t<activity type="{facility["type"]}" link="{facility["linkId"]}" facility="{facility["id"]}" '
+                       f'x="{facility["x"]}" y="{facility["y"]}"{times} >\n\t\t\t</activity>\n')
+        file.write('\t\t</plan>\n\n')
+
+    file.write('\t</person>\n\n')
+
+
+def _writeLeg(file, personId, leg):
+    departureTime = tools.getFormattedTime(leg['departureTime'])
+    travelTime = tools.getFormattedTime(leg['travelTime'])
+    startLinkId, endLinkId = leg['origin']['linkId'], leg['destination']['linkId']
+
+    file.write(f'\t\t\t<leg mode="{leg["mode"]}" dep_time="{departureTime}" trav_time="{travelTime}">\n')
+    if leg['route'] is not None:
+        file.write(f'\t\t\t\t<route type="links" start_link="{startLinkId}" end_link="{endLinkId}" trav_time="{travelTime}" '
+                   f'distance="{leg["distance"]}" vehicleRefId="{personId}">{" ".join(map(str, leg["route"]))}</route>\n')
+    else:
+        file.write(f'\t\t\t\t<route type="generic" start_link="{startLinkId}" end_link="{endLinkId}" trav_time="{travelTime}" distance="{leg["distance"]}"></route>\n')
+    file.write('\t\t\t</leg>\n')
+
+
+# Writes one trip (and its single leg) for each leg of the agent
+def _writeTrips(files, personId, activities, legs):
+    for index, leg in enumerate(legs):
+        origin, destination = leg['origin'], leg['destination']
+        tripId = f"{personId}_{index + 1}"
+        departureTime = tools.getFormattedTime(leg['departureTime'])
+        travelTime = tools.getFormattedTime(leg['travelTime'])
+        vehicleId = personId if leg['mode'] == 'car' else None
+
+        tripValues = [personId, index + 1, tripId, departureTime, travelTime, '00:00:00', round(leg['distance']), leg['euclideanDistance'],
+                      leg['mode'], leg['mode'], leg['mode'], origin['type'], destination['type'], origin['id'], origin['linkId'], origin['x'], origin['y'],
+                      destination['id'], destination['linkId'], destination['x'], destination['y'], None, None]
+        legValues = [personId, tripId, departureTime, travelTime, '00:00:00', round(leg['distance']), leg['mode'], origin['linkId'], origin['x'], origin['y'],
+                     destination['linkId'], destination['x'], destination['y'], None, None, None, None, vehicleId]
+        files['trips'].write(config.TRIPS_CSV_SEPARATOR.join(_formatCsvValue(value) for value in tripValues) + '\n')
+        files['legs'].write(';'.join(_formatCsvValue(value) for value in legValues) + '\n')
+
+
+def _formatCsvValue(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+# ----- Events -----
+
+# Adds the events of the agent to the time buckets of the events, the events of a bucket are sorted when they are written
+def _writeAgentEvents(eventsDirectory, eventsBuckets, personId, activities, legs):
+    events = []
+    for index, leg in enumerate(legs):
+        origin, destination = leg['origin'], leg['destination']
+        departureTime = leg['departureTime']
+        arrivalTime = departureTime + leg['travelTime']
+
+        events.append((departureTime, f'type="actend" person="{personId}" link="{origin["linkId"]}" actType="{origin["type"]}" facility="{origin["id"]}"'))
+        events.append((departureTime, f'type="departure" person="{personId}" link="{origin["linkId"]}" legMode="{leg["mode"]}"'))
+
+        if leg['mode'] == 'car':
+            events.append((departureTime, f'type="PersonEntersVehicle" person="{personId}" vehicle="{personId}"'))
+            events.append((departureTime, f'type="vehicle enters traffic" person="{personId}" link="{origin["linkId"]}" vehicle="{personId}" networkMode="car" relativePosition="1.0"'))
+            events.append((departureTime + 1, f'type="left link" link="{origin["linkId"]}" vehicle="{personId}"'))
+            for linkIndex, (linkId, enterTime, leaveTime) in enumerate(leg['linkTimes']):
+                events.append((enterTime, f'type="entered link" link="{linkId}" vehicle="{personId}"'))
+                if linkIndex < len(leg['linkTimes']) - 1:
+                    events.append((leaveTime, f'type="left link" link="{linkId}" vehicle="{personId}"'))
+            events.append((arrivalTime, f'type="vehicle leaves traffic" person="{personId}" link="{destination["linkId"]}" vehicle="{personId}" networkMode="car" relativePosition="1.0"'))
+            events.append((arrivalTime, f'type="PersonLeavesVehicle" person="{personId}" vehicle="{personId}"'))
+        else:
+            events.append((arrivalTime, f'type="travelled" person="{personId}" distance="{leg["distance"]}" mode="{leg["mode"]}"'))
+
+        events.append((arrivalTime, f'type="arrival" person="{personId}" link="{destination["linkId"]}" legMode="{leg["mode"]}"'))
+        events.append((arrivalTime, f'type="actstart" person="{personId}" link="{destination["linkId"]}" actType="{destination["type"]}" facility="{destination["id"]}"'))
+
+    for time, attributes in events:
+        bucket = time // config.GENERATOR_EVENTS_BUCKET_IN_SECONDS
+        if bucket not in eventsBuckets:
+            eventsBuckets[bucket] = open(os.path.join(eventsDirectory, f"{bucket}.txt"), 'w')
+        eventsBuckets[bucket].write(f'{time}\t{attributes}\n')
+
+
+# Writes the events file from the time buckets, the events of each bucket are sorted by time
+# (the sort is stable, the events of an agent at the same time stay in order)
+def _writeEvents(outputPath, eventsBuckets):
+    for bucketFile in eventsBuckets.values():
+        bucketFile.close()
+
+    with _openOutputFile(outputPath, 'events') as eventsFile:
+        eventsFile.write(XML_HEADER + '<events version="1.0">\n')
+        for bucket in sorted(eventsBuckets):
+            with open(eventsBuckets[bucket].name) as bucketFile:
+                events = [line.split('\t', 1) for line in bucketFile]
+            events.sort(key=lambda event: int(event[0]))
+            eventsFile.writelines(f'\t<event time="{time}.0" {attributes.rstrip()} />\n' for time, attributes in events)
+        eventsFile.write('</events>\n')
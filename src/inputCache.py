@@ -0,0 +1,63 @@
+from furbain import config
+from furbain import parquetCache
+import matsim.Facility as Facility
+import matsim.Network as Network
+import pandas as pd
+import os
+import shutil
+
+
+# Returns the network of the file (Network.read_network), parsed once then read from the cache
+def readNetwork(filePath):
+    def parseNetwork():
+        network = Network.read_network(filePath)
+        networkAttributes = pd.DataFrame({'name': list(network.network_attrs.keys()), 'value': list(network.network_attrs.values())}, dtype=object)
+        return {'nodes': network.nodes, 'links': network.links, 'nodeAttributes': network.node_attrs, 'linkAttributes': network.link_attrs, 'networkAttributes': networkAttributes}
+
+    dataframes = getParsedInput('network', filePath, parseNetwork)
+    networkAttributes = dict(zip(dataframes['networkAttributes']['name'], dataframes['networkAttributes']['value']))
+    return Network.Network(dataframes['nodes'], dataframes['links'], dataframes['nodeAttributes'], dataframes['linkAttributes'], networkAttributes)
+
+
+# Returns the facilities of the file (Facility.facility_reader), parsed once then read from the cache
+def readFacilities(filePath):
+    return getParsedInput('facilities', filePath, lambda: {'facilities': Facility.facility_reader(filePath).facilities})['facilities']
+
+
+# Returns the dataframes parsed from a matsim file, from the cache if the file has already been parsed, or parses them with parse() and stores them in the cache
+# parse() returns a dictionary of dataframes, name identifies the parser (eg: 'network')
+# the entry is identified by the name, the path, the size and the modification time of the file, a modified file is parsed again
+# The dataframes are stored as parquet files in config.INPUT_CACHE_DIRECTORY_PATH, the entries of the previous versions of the file are deleted
+#       the least recently used entries are deleted when the cache is bigger than config.INPUT_CACHE_MAX_SIZE_IN_MB
+# If config.USE_INPUT_CACHE is False, the file is always parsed
+def getParsedInput(name, filePath, parse):
+    if not config.USE_INPUT_CACHE:
+        return parse()
+
+    fileStat = os.stat(filePath)
+    fileId = parquetCache.getHash([name, os.path.abspath(filePath)])
+    key = parquetCache.getHash([fileId, fileStat.st_size, fileStat.st_mtime_ns])
+    entryPath = config.INPUT_CACHE_DIRECTORY_PATH / key
+
+    storedEntry = parquetCache.readEntry(entryPath)
+    if storedEntry is not None:
+        entry, dataframes = storedEntry
+        return dict(zip(entry["keys"], dataframes))
+
+    dataframes = parse()
+    try:
+        parquetCache.writeEntry(entryPath, dataframes, {"fileId": fileId})
+    except Exception as e:
+        # eg: a column with values of a type parquet can't store, the file is parsed again next time
+        print(f"WARNING : The parsed file {filePath} can't be stored in the input cache ({e})")
+        return dataframes
+
+    # the entries of the previous versions of the file are deleted
+    parquetCache.evictEntries(config.INPUT_CACHE_DIRECTORY_PATH, config.INPUT_CACHE_MAX_SIZE_IN_MB,
+                              lambda currentEntryPath, entry: entry["fileId"] == fileId and currentEntryPath.name != key)
+    return dataframes
+
+
+# Deletes every parsed file of the cache
+def clearCache():
+    shutil.rmtree(config.INPUT_CACHE_DIRECTORY_PATH, ignore_errors=True)
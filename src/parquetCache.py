@@ -0,0 +1,112 @@
+import pandas as pd
+import hashlib
+import json
+import os
+import shutil
+
+
+# Entries of the caches of furbain (see queryCache and inputCache) : each entry is a directory holding dataframes stored as parquet files
+# and the file ENTRY_FILENAME, holding the keys of the dataframes and the metadata of the entry (used to evict the outdated entries)
+ENTRY_FILENAME = 'entry.json'
+
+
+def getHash(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+# Returns the entry (dictionary of its metadata and "keys") and the list of its dataframes, or None if the entry doesn't exist or can't be read
+# the modification time of the entry file is the last time the entry was used
+def readEntry(entryPath):
+    try:
+        with open(entryPath / ENTRY_FILENAME) as f:
+            entry = json.load(f)
+
+        dataframes = [_decodeMixedColumns(pd.read_parquet(entryPath / f"{index}.parquet"), entry["mixedColumns"][index]) for index in range(len(entry["keys"]))]
+        os.utime(entryPath / ENTRY_FILENAME)
+    except (OSError, ValueError, KeyError):
+        shutil.rmtree(entryPath, ignore_errors=True)
+        return None
+    return entry, dataframes
+
+
+# Stores the dataframes (dictionary {key: dataframe}, the keys are stored as json) and the metadata (dictionary) in the entry
+# the files are written in a temporary directory then renamed, so an entry being written is never read
+# If a dataframe can't be stored, the temporary directory is deleted and the exception is raised
+def writeEntry(entryPath, dataframes, metadata):
+    temporaryPath = entryPath.with_name(f"{entryPath.name}.{os.getpid()}.tmp")
+    shutil.rmtree(temporaryPath, ignore_errors=True)
+    temporaryPath.mkdir(parents=True)
+
+    try:
+        mixedColumns = []
+        for index, dataframe in enumerate(dataframes.values()):
+            dataframe, columns = _encodeMixedColumns(dataframe)
+            dataframe.to_parquet(temporaryPath / f"{index}.parquet")
+            mixedColumns.append(columns)
+
+        with open(temporaryPath / ENTRY_FILENAME, 'w') as f:
+            json.dump({**metadata, "keys": list(dataframes.keys()), "mixedColumns": mixedColumns}, f)
+    except Exception:
+        shutil.rmtree(temporaryPath, ignore_errors=True)
+        raise
+
+    try:
+        os.rename(temporaryPath, entryPath)
+    except OSError:
+        # the same entry has been stored by another process
+        shutil.rmtree(temporaryPath, ignore_errors=True)
+
+
+# Deletes the outdated entries of the directory (isOutdated(entryPath, entry) is True),
+# then the least recently used entries until the directory is smaller than maxSizeInMB
+def evictEntries(directoryPath, maxSizeInMB, isOutdated):
+    entries = []
+    for entryPath in directoryPath.iterdir():
+        try:
+            with open(entryPath / ENTRY_FILENAME) as f:
+                entry = json.load(f)
+            lastUse = os.path.getmtime(entryPath / ENTRY_FILENAME)
+            size = sum(filePath.stat().st_size for filePath in entryPath.iterdir())
+        except (OSError, ValueError):
+            # entry being written
+            continue
+
+        if isOutdated(entryPath, entry):
+            shutil.rmtree(entryPath, ignore_errors=True)
+        else:
+            entries.append((lastUse, size, entryPath))
+
+    maxSize = maxSizeInMB * 1024 * 1024
+    cacheSize = sum(size for lastUse, size, entryPath in entries)
+    for lastUse, size, entryPath in sorted(entries, key=lambda entry: entry[0]):
+        if cacheSize <= maxSize:
+            break
+        shutil.rmtree(entryPath, ignore_errors=True)
+        cacheSize -= size
+
+
+# The columns mixing strings and numbers (eg: the values of the attributes of the network) can't be stored in parquet,
+# their values are stored as strings and their types in the column "{column}:type"
+# Returns the dataframe to store and the names of the encoded columns
+def _encodeMixedColumns(dataframe):
+    mixedColumns = []
+    for column in dataframe.columns[dataframe.dtypes == object]:
+        types = dataframe[column].map(lambda value: type(value).__name__)
+        # the other objects (eg: timedeltas) are stored by parquet
+        if types.isin(['str', 'NoneType']).all() or not types.isin(['int', 'float', 'str', 'bool', 'NoneType']).all():
+            continue
+
+        if not mixedColumns:
+            dataframe = dataframe.copy()
+        dataframe[column] = dataframe[column].map(lambda value: None if value is None else repr(value) if isinstance(value, float) else str(value))
+        dataframe[f'{column}:type'] = types.astype('category')
+        mixedColumns.append(column)
+    return dataframe, mixedColumns
+
+
+def _decodeMixedColumns(dataframe, mixedColumns):
+    decoders = {'int': int, 'float': float, 'str': str, 'bool': lambda value: value == 'True'}
+    for column in mixedColumns:
+        dataframe[column] = [None if value is None else decoders[valueType](value) for value, valueType in zip(dataframe[column], dataframe[f'{column}:type'])]
+        dataframe.drop(columns=[f'{column}:type'], inplace=True)
+    return dataframe
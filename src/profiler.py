@@ -0,0 +1,212 @@
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import contextlib
+import cProfile
+import datetime
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, the memory is not reported
+    resource = None
+
+
+MEMORY_SAMPLING_INTERVAL_IN_SECONDS = 0.01
+
+# Profile being recorded, the stages are only recorded inside profile()
+_currentProfile = None
+
+
+# Records the stages of the converters and queries called inside the block, yields the report (a dictionary)
+# each stage has its wall time, the time spent in database calls, its number of rows (if known), its throughput and its peak memory (RSS),
+# the stages called inside a stage are its children
+#
+# reportPath : if given, the report is written as json in this file at the end of the block
+# cProfileStage : name or path (eg: 'importTrips/read') of a stage to run under cProfile, the calls of every run of the stage are added
+# cProfilePath : file in which the cProfile statistics are written (see pstats), by default reportPath with the .prof extension
+#
+# eg: with profiler.profile('report.json'):
+#         converter.importActivities()
+def profile(reportPath=None, cProfileStage=None, cProfilePath=None):
+    global _currentProfile
+    if _currentProfile is not None:
+        raise Exception('A profile is already being recorded')
+
+    if cProfileStage is not None and cProfilePath is None:
+        if reportPath is None:
+            raise Exception('The path of the cProfile statistics (cProfilePath) has to be given')
+        cProfilePath = os.path.splitext(reportPath)[0] + '.prof'
+
+    return _recordProfile(reportPath, cProfileStage, cProfilePath)
+
+
+@contextlib.contextmanager
+def _recordProfile(reportPath, cProfileStage, cProfilePath):
+    global _currentProfile
+    report = {
+        'startedAt': datetime.datetime.now().isoformat(),
+        'wallTimeInSeconds': None,
+        'dbTimeInSeconds': 0.0,
+        'peakRSSInMB': _getRSSInMB(),
+        'stages': [],
+    }
+    _currentProfile = {
+        'report': report,
+        'openStages': [],
+        'lock': threading.Lock(),
+        'cProfileStage': cProfileStage,
+        'cProfiler': cProfile.Profile() if cProfileStage is not None else None,
+        'stopSampling': threading.Event(),
+    }
+
+    samplingThread = threading.Thread(target=_sampleMemory, args=(_currentProfile,), daemon=True)
+    samplingThread.start()
+    event.listen(Engine, 'before_cursor_execute', _beforeCursorExecute)
+    event.listen(Engine, 'after_cursor_execute', _afterCursorExecute)
+    startTime = time.perf_counter()
+
+    try:
+        yield report
+    finally:
+        report['wallTimeInSeconds'] = time.perf_counter() - startTime
+        event.remove(Engine, 'before_cursor_execute', _beforeCursorExecute)
+        event.remove(Engine, 'after_cursor_execute', _afterCursorExecute)
+        _currentProfile['stopSampling'].set()
+        samplingThread.join()
+
+        if _currentProfile['cProfiler'] is not None:
+            _currentProfile['cProfiler'].dump_stats(cProfilePath)
+        _currentProfile = None
+
+        if reportPath is not None:
+            with open(reportPath, 'w') as f:
+                json.dump(report, f, indent=4)
+
+
+# Records a stage of a converter or query, yields the dictionary of the stage, its "rows" can be set in the block
+# does nothing outside profile()
+#
+# eg: with profiler.stage('read') as currentStage:
+#         dataframe = pd.read_csv(path)
+#         currentStage['rows'] = len(dataframe)
+@contextlib.contextmanager
+def stage(name):
+    currentProfile = _currentProfile
+    if currentProfile is None:
+        yield {}
+        return
+
+    openStages = currentProfile['openStages']
+    parent = openStages[-1] if openStages else None
+    currentStage = {
+        'name': name,
+        'path': f"{parent['path']}/{name}" if parent else name,
+        'wallTimeInSeconds': None,
+        'dbTimeInSeconds': 0.0,
+        'rows': None,
+        'rowsPerSecond': None,
+        'peakRSSInMB': _getRSSInMB(),
+        'stages': [],
+    }
+    (parent or currentProfile['report'])['stages'].append(currentStage)
+
+    cProfiler = currentProfile['cProfiler']
+    isCProfiled = cProfiler is not None and currentProfile['cProfileStage'] in [name, currentStage['path']]
+
+    with currentProfile['lock']:
+        openStages.append(currentStage)
+    if isCProfiled:
+        cProfiler.enable()
+    startTime = time.perf_counter()
+
+    try:
+        yield currentStage
+    finally:
+        currentStage['wallTimeInSeconds'] = time.perf_counter() - startTime
+        if isCProfiled:
+            cProfiler.disable()
+        with currentProfile['lock']:
+            openStages.remove(currentStage)
+
+        if currentStage['rows'] is not None and currentStage['wallTimeInSeconds'] > 0:
+            currentStage['rowsPerSecond'] = currentStage['rows'] / currentStage['wallTimeInSeconds']
+        _updatePeakRSS(currentProfile, [currentStage])
+
+
+# Decorator recording each call of the function as a stage named after the function
+def profiled(function):
+    @functools.wraps(function)
+    def profiledFunction(*args, **kwargs):
+        with stage(function.__name__):
+            return function(*args, **kwargs)
+    return profiledFunction
+
+
+# Counts the time spent in the block as database time of the open stages,
+# for the database calls not going through sqlalchemy (eg: COPY on the dbapi connection)
+@contextlib.contextmanager
+def databaseTime():
+    startTime = time.perf_counter()
+    try:
+        yield
+    finally:
+        _addDatabaseTime(time.perf_counter() - startTime)
+
+
+def _beforeCursorExecute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('profilerStartTimes', []).append(time.perf_counter())
+
+
+def _afterCursorExecute(conn, cursor, statement, parameters, context, executemany):
+    startTimes = conn.info.get('profilerStartTimes')
+    if startTimes:
+        _addDatabaseTime(time.perf_counter() - startTimes.pop())
+
+
+# the database time is added to every open stage (the time of a stage includes the time of its children)
+def _addDatabaseTime(duration):
+    currentProfile = _currentProfile
+    if currentProfile is None:
+        return
+
+    with currentProfile['lock']:
+        currentProfile['report']['dbTimeInSeconds'] += duration
+        for openStage in currentProfile['openStages']:
+            openStage['dbTimeInSeconds'] += duration
+
+
+def _sampleMemory(currentProfile):
+    while not currentProfile['stopSampling'].wait(MEMORY_SAMPLING_INTERVAL_IN_SECONDS):
+        with currentProfile['lock']:
+            openStages = list(currentProfile['openStages'])
+        _updatePeakRSS(currentProfile, openStages)
+
+
+def _updatePeakRSS(currentProfile, stages):
+    rss = _getRSSInMB()
+    if rss is None:
+        return
+
+    for currentStage in stages + [currentProfile['report']]:
+        currentStage['peakRSSInMB'] = max(currentStage['peakRSSInMB'] or 0, rss)
+
+
+# Current memory (RSS) of the process, read from /proc on linux
+# on the other systems, the peak memory of the process is used (None if it is not available)
+def _getRSSInMB():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    if resource is None:
+        return None
+    peakRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peakRSS / (1024 * 1024) if sys.platform == 'darwin' else peakRSS / 1024
@@ -1,5 +1,44 @@
-from . import odMatrix, agentActivity, activitySequences
+import importlib
+import sys
+import types
 
-odMatrix = odMatrix.odMatrix
-agentActivity = agentActivity.agentActivity
-activitySequences = activitySequences.activitySequences
\ No newline at end of file
+# The queries are imported when they are first used, the dataframe and geometry libraries are only loaded by the called query
+# name of each query : module defining it
+_QUERIES = {
+    'odMatrix': 'odMatrix',
+    'odCube': 'odCube',
+    'ODCube': 'sparseCube',
+    'iterateAgentActivity': 'agentActivity',
+    'agentActivity': 'agentActivity',
+    'iterateActivitySequences': 'activitySequences',
+    'activitySequences': 'activitySequences',
+    'zoneActivityCounts': 'hourlyCounts',
+    'roadClassTraffic': 'hourlyCounts',
+}
+_SUBMODULES = sorted(set(_QUERIES.values()))
+
+
+# Importing a submodule binds its name to the module in the package,
+# the queries having the name of their module are kept bound to the function
+class _QueriesPackage(types.ModuleType):
+    def __setattr__(self, name, value):
+        if isinstance(value, types.ModuleType) and _QUERIES.get(name) == name:
+            value = getattr(value, name)
+        super().__setattr__(name, value)
+
+
+def __getattr__(name):
+    if name in _QUERIES:
+        query = getattr(importlib.import_module(f'.{_QUERIES[name]}', __name__), name)
+        globals()[name] = query
+        return query
+    if name in _SUBMODULES:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_QUERIES) + _SUBMODULES)
+
+
+sys.modules[__name__].__class__ = _QueriesPackage
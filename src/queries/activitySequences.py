@@ -1,279 +1,727 @@
 from furbain import config
 from furbain import tools
 from furbain import databaseTools
+from furbain import queryCache
+from furbain import profiler
 import geojson
 import pandas as pd
-import collections
+import numpy as np
 from sqlalchemy.sql import text
+from sqlalchemy import types
 import multiprocessing as mp
+import itertools
+from multiprocessing import shared_memory
 from datetime import datetime
 from tqdm import tqdm
 
 
-# Return the activity sequences for a every users during a given timespan (by default, 00:00:00 to 32:00:00) 
+# columns of the activities arrays, see _getActivitiesArrays
+_ACTIVITIES_COLUMNS = ["zoneId", "personId", "id", "startInSeconds", "startIsNull", "endInSeconds", "endIsNull", "spentInSeconds", "spentIsNull"]
+
+
+# Return the activity sequences for a every users during a given timespan (by default, 00:00:00 to 32:00:00)
 # with the given interval (by default, 60 minutes)
-# in the given zone (geojson file)
-# The batchSize parameter is used to speed up the process by splitting the users into batches of batchSize users
-# if createTableInDatabase is True, the function will create a table in the database with the activity sequences
-# nbAgentsToProcess is used to limit the number of agents to process, set to -1 to process all agents
-#       eg: if set to 1000, only the first 1000 agents will be processed
-def activitySequences(filePath, startTime='00:00:00', endTime='32:00:00', interval=15, batchSize=10, createTableInDatabase=False, nbAgentsToProcess=-1):
+# in every zone of the given geojson file, the zones are uploaded once and each activity is tagged with its zone in a single query
+# the sequences of an agent are computed for each zone where it has activities, using only the activities in the zone,
+#       the zoneId column holds the index of the zone in the geojson file
+# The users are split into batches processed in parallel, batchSize is the number of users per batch
+#       by default (None), the size of the batches and the number of processes depend on the number of users
+# if createTableInDatabase is True, the function will create a table in the database with the activity sequences,
+#       the batches are copied in the table as soon as they are computed
+# if returnDataframe is False, the batches are not kept in memory and the function returns None (to be used with createTableInDatabase)
+# nbAgentsToProcess is used to limit the number of agents to process in each zone, set to -1 to process all agents
+#       eg: if set to 1000, only the first 1000 agents (by order of id) of each zone will be processed
+# engine is used to choose where the activity sequences are computed :
+#       'python' : the activities are loaded and the sequences are computed by the processes of the pool
+#       'sql' : the sequences are computed by the database and stored in a new table without being transferred,
+#               the table is always created and batchSize and createTableInDatabase are not used
+# if useCache is True, the dataframe is read from the query cache if the same query has already been run on the same data (see queryCache)
+#       the cache is only used by the python engine when no table is created
+@profiler.profiled
+def activitySequences(filePath, startTime='00:00:00', endTime='32:00:00', interval=15, batchSize=None, createTableInDatabase=False, nbAgentsToProcess=-1, returnDataframe=True, engine='python', useCache=False):
+    if engine not in ['python', 'sql']:
+        raise Exception(f'The engine "{engine}" does not exist, use "python" or "sql"')
+
+    if useCache and engine == 'python' and returnDataframe and not createTableInDatabase:
+        parameters = {"startTime": startTime, "endTime": endTime, "interval": interval, "nbAgentsToProcess": nbAgentsToProcess}
+        return queryCache.getCachedResult("activitySequences", filePath, parameters,
+                                          lambda: activitySequences(filePath, startTime, endTime, interval, batchSize, nbAgentsToProcess=nbAgentsToProcess))
+
     with open(filePath) as f:
         conn = databaseTools.connectToDatabase()
+        databaseTools.checkTimesInSeconds(conn, config.DB_PLANS_TABLE)
         gjson = geojson.load(f)
-        
+
         geojsonEpsg = tools.getEPSGFromGeoJSON(gjson)
-                
-        coordinates, geometryType = tools.parseFeature(gjson["features"][0])
-        if coordinates is None or geometryType is None:
-            raise(f"ERROR : No geometry or coordinates were found")
-        
-        polygon = tools.formatGeoJSONPolygonToPostgisPolygon(coordinates, geometryType, geojsonEpsg)
-
-        # QUERIES
-        queryAllAgentsInZone = text(f"""SELECT distinct "personId"
-                                        from activity
-                                        where ST_Contains(ST_Transform(ST_GeomFromText(:currentPolygon, {geojsonEpsg}), {config.getDatabaseSRID()}), ST_SetSRID("location", {config.getDatabaseSRID()}))
-                                    """)
-        
-        queryGetActivitiesDuringTimeSpanAndZone = text(f"""SELECT *, 
-                                                                CASE
-                                                                    WHEN '{startTime}' <= start_time and '{endTime}' >= end_time then end_time - start_time
-                                                                    WHEN '{startTime}' >= start_time and '{endTime}' >= end_time then end_time - '{startTime}'
-                                                                    WHEN '{startTime}' > start_time and '{endTime}' < end_time then interval '{endTime}' - interval '{startTime}'
-                                                                    WHEN '{startTime}' <= start_time and '{endTime}' <= end_time then '{endTime}' - start_time
-                                                                    WHEN start_time is null and '{endTime}' >= end_time then end_time - '{startTime}'
-                                                                    WHEN start_time is null and '{endTime}' < end_time then interval '{endTime}' - interval '{startTime}'
-                                                                    WHEN '{startTime}' > start_time and end_time is null then interval '{endTime}' - interval '{startTime}'
-                                                                    WHEN '{startTime}' <= start_time and end_time is null then '{endTime}' - start_time
-                                                                    WHEN start_time is null and end_time is null then interval '{endTime}' - interval '{startTime}'
-                                                                END as activity_time_spent_in_interval
-                                                            from activity 
-                                                            where ST_Contains(ST_Transform(ST_GeomFromText(:currentPolygon, {geojsonEpsg}), {config.getDatabaseSRID()}), ST_SetSRID("location", {config.getDatabaseSRID()}))
-                                                            and (start_time between '{startTime}' and '{endTime}' or start_time is null)
-                                                            and (end_time between '{startTime}' and '{endTime}' or end_time is null)
-                                                            order by start_time asc
-                                                        """)
-        
-        print("Getting all agents in zone...")
-        queryAllAgentsInZone = queryAllAgentsInZone.bindparams(currentPolygon=polygon)
-        allAgentsInZoneDf = pd.read_sql(queryAllAgentsInZone, conn)
-        allAgentsInZone = allAgentsInZoneDf["personId"].tolist()
-        
-        if nbAgentsToProcess > 0:
-            allAgentsInZone = allAgentsInZone[:nbAgentsToProcess]
-        
-        print("Getting all activities during time span and zone...")
-        # Querying the database to get all activities of the current agent in the zone
-        queryGetActivitiesDuringTimeSpanAndZone = queryGetActivitiesDuringTimeSpanAndZone.bindparams(
-            currentPolygon=polygon,
-        )
-
-        allActivitiesDf = pd.read_sql(queryGetActivitiesDuringTimeSpanAndZone, conn)
-                
-        # dictionnary to store the activity sequences for each agent
-        # the main activity is the activity that takes the most time in the timespan
-        # the keys are: personId, periodStart, periodEnd, mainActivityId, startActivityId, endActivityId, mainActivityStartTime, mainActivityEndTime, timeSpentInMainActivity
-        activitySequencesDf = pd.DataFrame(columns=config.ACTIVITY_SEQUENCES_TABLE_COLUMNS)
-        
-        activitySequencesDict = collections.defaultdict(list)
-        
-        
+        zones = tools.getPolygonsFromFeatures(gjson["features"], geojsonEpsg)
+        with profiler.stage('zones') as currentStage:
+            databaseTools.createTemporaryZoneTable(conn, zones, geojsonEpsg)
+            currentStage['rows'] = len(zones)
+
+        queryAllAgentsInZones, queryGetActivitiesDuringTimeSpanAndZones = _getActivitySequencesQueries(nbAgentsToProcess)
+
         firstStartTimeInSeconds = tools.getTimeInSeconds(startTime)
         endTimeInSeconds = tools.getTimeInSeconds(endTime)
         intervalInSeconds = interval * 60
-        formattedInterval = tools.getFormattedTime(intervalInSeconds)
-        
-        # Create array with all the start times of the intervals + the end time
-        timeList = [x for x in range(0, endTimeInSeconds, intervalInSeconds)] + [endTimeInSeconds]
-        formattedTimeList = [tools.getFormattedTime(x) for x in timeList]
-        
-        # Create a dictionary with the start time of the interval as key and the formatted start time as value
-        timeDict = dict(zip(timeList, formattedTimeList))
-                
-        # Create batches of agents to process in parallel
-        batches = [allAgentsInZone[i:i + batchSize] for i in range(0, len(allAgentsInZone), batchSize)]
-        
-        # Process the batches in parallel
+        nbPeriods = len(range(firstStartTimeInSeconds, endTimeInSeconds, intervalInSeconds))
+
+        if engine == 'sql':
+            print("Calculating activity sequences in the database...")
+            tableName = _createTableInDatabaseWithSQLEngine(conn, queryAllAgentsInZones, queryGetActivitiesDuringTimeSpanAndZones,
+                                                            firstStartTimeInSeconds, endTimeInSeconds, intervalInSeconds, nbPeriods)
+            activitySequencesDf = _getActivitySequencesTableDataframe(conn, tableName) if returnDataframe else None
+            conn.close()
+            return activitySequencesDf
+
+        print("Getting all agents in zones...")
+        with profiler.stage('agents') as currentStage:
+            sequencesDf = pd.read_sql(text(queryAllAgentsInZones), conn)
+            currentStage['rows'] = len(sequencesDf)
+
+        print("Getting all activities during time span and zones...")
+        with profiler.stage('activities'):
+            if databaseTools.tableExists(conn, config.DB_AGENT_TIMELINES_TABLE):
+                # the activities are already sorted in the timelines of the agents, only their zones are queried
+                queryActivitiesInZones = text(f"""SELECT z.zone_id as "zoneId", a.id
+                                                  from activity a
+                                                  join "{config.QUERIES_ZONE_TABLE_NAME}" z on ST_Contains(z.geom, ST_SetSRID(a."location", {config.getDatabaseSRID()}))
+                                               """)
+                activitiesInZonesDf = pd.read_sql(queryActivitiesInZones, conn)
+                activities = _getActivitiesArraysFromTimelines(conn, sequencesDf, activitiesInZonesDf, firstStartTimeInSeconds, endTimeInSeconds)
+            else:
+                # the activities with the same start time are sorted by id, as in the sql engine
+                queryActivities = text(queryGetActivitiesDuringTimeSpanAndZones + "order by start_time_seconds asc, id asc")
+                allActivitiesDf = pd.read_sql(queryActivities.bindparams(startTimeSeconds=firstStartTimeInSeconds, endTimeSeconds=endTimeInSeconds), conn)
+                activities = _getActivitiesArrays(allActivitiesDf)
+                del allActivitiesDf
+
+            # The activities are partitioned by (zone, agent) once, the tasks only hold a range of sequences
+            activities = _partitionActivitiesBySequence(activities, sequencesDf)
+
+        nbAgents = len(sequencesDf)
+        nbProcesses, agentsPerTask = _getPoolConfiguration(nbAgents, batchSize)
+        tasks = [(first, min(first + agentsPerTask, nbAgents), firstStartTimeInSeconds, endTimeInSeconds, intervalInSeconds) for first in range(0, nbAgents, agentsPerTask)]
+
+        tableName = _createTableInDatabase(conn) if createTableInDatabase else None
+
+        # dictionaries of the tasks (by task index), with the same structure as the table
+        # the main activity is the activity that takes the most time in the timespan
+        # the columns are: id (index), zoneId, personId, periodStart, periodEnd, mainActivityId, startActivityId, endActivityId, mainActivityStartTime, mainActivityEndTime, timeSpentInMainActivity
+        activitySequencesDicts = {} if returnDataframe else None
+
+        # Each batch is written as soon as it is computed, while the next batches are still being computed
         print("Calculating activity sequences...")
-        with mp.Pool(mp.cpu_count()) as pool:           
-            results = pool.starmap(_getActivitySequencesOfAgentInZoneInTimespanInBatch, [(allActivitiesDf, agentsList, firstStartTimeInSeconds, endTimeInSeconds, intervalInSeconds, formattedInterval, timeDict) for agentsList in batches])
-            
-            for result in results:
-                activitySequencesDict = _mergeActivitySequencesDicts([activitySequencesDict, result])
-    
-    activitySequencesDf = pd.DataFrame(activitySequencesDict)
-        
-    if createTableInDatabase:
-        _createTableInDatabase(activitySequencesDf, conn)
-    
-    conn.close()    
-        
+        with profiler.stage('compute') as currentStage:
+            with tqdm(total=nbAgents) as pbar:
+                if nbProcesses <= 1:
+                    for taskIndex, task in enumerate(tasks):
+                        result = _getActivitySequencesOfAgentsRangeInTask(activities, taskIndex, *task)
+                        _writeActivitySequencesResult(result, tasks, nbPeriods, tableName, conn, activitySequencesDicts, pbar)
+                else:
+                    # The arrays are put in shared memory, the processes read them without copying them
+                    sharedMemories, sharedArraysSpecs = _createSharedArrays(activities)
+                    try:
+                        with mp.Pool(nbProcesses, initializer=_attachSharedArrays, initargs=(sharedArraysSpecs,)) as pool:
+                            for result in pool.imap_unordered(_getActivitySequencesOfAgentsRangeInProcess, enumerate(tasks)):
+                                _writeActivitySequencesResult(result, tasks, nbPeriods, tableName, conn, activitySequencesDicts, pbar)
+                    finally:
+                        for sharedMemory in sharedMemories:
+                            sharedMemory.close()
+                            sharedMemory.unlink()
+            currentStage['rows'] = nbAgents * nbPeriods
+
+    conn.close()
+
+    if activitySequencesDicts is None:
+        return None
+
+    # The lists of the tasks are concatenated in the order of the agents, the index of the dataframe matches the ids of the table
+    activitySequencesDf = pd.DataFrame({column: list(itertools.chain.from_iterable(activitySequencesDicts[taskIndex][column] for taskIndex in sorted(activitySequencesDicts)))
+                                        for column in list(config.ACTIVITY_SEQUENCES_TABLE_COLUMNS)[1:]})
+    activitySequencesDf.index.name = "id"
     return activitySequencesDf
 
 
-# Create a tablea in the database with the activity sequences
-def _createTableInDatabase(activitySequencesDf, conn):
-    # Set the table name
-    time = datetime.now().strftime(config.ACTIVITY_SEQUENCES_TABLE_TIME_FORMAT)
-    tableName = f"{config.ACTIVITY_SEQUENCES_TABLE_NAME}_{time}"
+# Same as activitySequences with engine='sql', but yields the sequences in dataframes of at most chunkSize rows (ordered by id)
+# the sequences are computed in a new table of the database, then read through a server-side cursor,
+# so the sequences of large zones can be processed in constant memory
+def iterateActivitySequences(filePath, startTime='00:00:00', endTime='32:00:00', interval=15, nbAgentsToProcess=-1, chunkSize=config.STREAM_CHUNK_SIZE):
+    with open(filePath) as f:
+        gjson = geojson.load(f)
+        geojsonEpsg = tools.getEPSGFromGeoJSON(gjson)
+        zones = tools.getPolygonsFromFeatures(gjson["features"], geojsonEpsg)
+
+    firstStartTimeInSeconds = tools.getTimeInSeconds(startTime)
+    endTimeInSeconds = tools.getTimeInSeconds(endTime)
+    intervalInSeconds = interval * 60
+    nbPeriods = len(range(firstStartTimeInSeconds, endTimeInSeconds, intervalInSeconds))
+
+    conn = databaseTools.connectToDatabase()
+    try:
+        databaseTools.checkTimesInSeconds(conn, config.DB_PLANS_TABLE)
+        databaseTools.createTemporaryZoneTable(conn, zones, geojsonEpsg)
+        queryAllAgentsInZones, queryGetActivitiesDuringTimeSpanAndZones = _getActivitySequencesQueries(nbAgentsToProcess)
+
+        print("Calculating activity sequences in the database...")
+        # the table only exists while the sequences are read
+        tableName = _createTableInDatabaseWithSQLEngine(conn, queryAllAgentsInZones, queryGetActivitiesDuringTimeSpanAndZones,
+                                                        firstStartTimeInSeconds, endTimeInSeconds, intervalInSeconds, nbPeriods, temporary=True)
+
+        activitySequencesChunks = databaseTools.iterateQuery(conn, text(f'SELECT * FROM "{tableName}" ORDER BY id'), chunkSize, index_col="id")
+        try:
+            for activitySequencesDf in activitySequencesChunks:
+                yield _formatIntervalColumns(activitySequencesDf)
+        finally:
+            # the cursor is closed before the table is dropped, the connection can be kept by the pool of the engine
+            activitySequencesChunks.close()
+            conn.execute(f'DROP TABLE IF EXISTS pg_temp."{tableName}";')
+    finally:
+        conn.close()
+
+
+# Returns the queries of the (zone, agent) pairs and of their activities during the timespan (:startTimeSeconds, :endTimeSeconds),
+# the zones must have been uploaded in the temporary zone table of the connection
+def _getActivitySequencesQueries(nbAgentsToProcess):
+    # (zone, agent) pairs, one sequence is computed for each pair
+    agentsLimitCondition = f'where "agentRank" <= {int(nbAgentsToProcess)}' if nbAgentsToProcess > 0 else ''
+    queryAllAgentsInZones = f"""SELECT "zoneId", "personId"
+                                from (
+                                    SELECT "zoneId", "personId", row_number() over (partition by "zoneId" order by "personId") as "agentRank"
+                                    from (
+                                        SELECT distinct z.zone_id as "zoneId", a."personId"
+                                        from activity a
+                                        join "{config.QUERIES_ZONE_TABLE_NAME}" z on ST_Contains(z.geom, ST_SetSRID(a."location", {config.getDatabaseSRID()}))
+                                    ) zonesAgents
+                                ) rankedZonesAgents
+                                {agentsLimitCondition}
+                                order by "zoneId", "personId"
+                            """
+
+    # the time spent in the timespan is the overlap of the activity with the timespan, a null start or end time is unbounded
+    queryGetActivitiesDuringTimeSpanAndZones = f"""SELECT z.zone_id as "zoneId", a.id, a."personId", a.start_time_seconds, a.end_time_seconds,
+                                                            LEAST(coalesce(end_time_seconds, :endTimeSeconds), :endTimeSeconds)
+                                                            - GREATEST(coalesce(start_time_seconds, :startTimeSeconds), :startTimeSeconds) as time_spent_in_interval_seconds
+                                                        from activity a
+                                                        join "{config.QUERIES_ZONE_TABLE_NAME}" z on ST_Contains(z.geom, ST_SetSRID(a."location", {config.getDatabaseSRID()}))
+                                                        where (start_time_seconds between :startTimeSeconds and :endTimeSeconds or start_time_seconds is null)
+                                                        and (end_time_seconds between :startTimeSeconds and :endTimeSeconds or end_time_seconds is null)
+                                                    """
+
+    return queryAllAgentsInZones, queryGetActivitiesDuringTimeSpanAndZones
+
+
+# Create an empty table in the database for the activity sequences, returns its name
+def _createTableInDatabase(conn):
+    tableName = _getActivitySequencesTableName()
     print(f"Creating table {tableName} in database...")
+
+    pd.DataFrame(columns=list(config.ACTIVITY_SEQUENCES_TABLE_COLUMNS)).to_sql(tableName, conn, if_exists="replace", index=False, dtype=config.ACTIVITY_SEQUENCES_TABLE_COLUMNS)
+    return tableName
+
+
+# Returns the name of a new activity sequences table
+def _getActivitySequencesTableName():
+    time = datetime.now().strftime(config.ACTIVITY_SEQUENCES_TABLE_TIME_FORMAT)
+    return f"{config.ACTIVITY_SEQUENCES_TABLE_NAME}_{time}"
+
+
+# Computes the activity sequences in the database and stores them in a new table (same structure as the table of the python engine), returns its name
+# queryAllAgentsInZones and queryActivities are the queries of the python engine, the grid is filled with the same rules as _getActivitySequencesOfAgents :
+#   - cells : every (zone, agent, interval) of the grid, generated with generate_series
+#   - groups : start, end and main activities of the intervals with activities, chosen with window functions
+#   - the intervals without activity carry the end activity of the last interval having activities (window over the intervals of the agent),
+#     or use the activity without start time of the agent, the first time the agent has no activity to carry
+# temporary : if true, the table is a temporary table, dropped when the connection is closed
+def _createTableInDatabaseWithSQLEngine(conn, queryAllAgentsInZones, queryActivities, firstStartTimeInSeconds, endTimeInSeconds, intervalInSeconds, nbPeriods, temporary=False):
+    tableName = _getActivitySequencesTableName()
+    print(f"Creating {'temporary ' if temporary else ''}table {tableName} in database...")
+
+    query = text(f"""CREATE {'TEMPORARY ' if temporary else ''}TABLE "{tableName}" AS
+                     WITH agents AS (
+                         {queryAllAgentsInZones}
+                     ),
+                     periods AS (
+                         SELECT period, :firstStartTime + period * :interval AS period_start, :firstStartTime + (period + 1) * :interval AS period_end
+                         FROM generate_series(0, :nbPeriods - 1) AS period
+                     ),
+                     activities AS (
+                         SELECT a."zoneId", a.id, a."personId",
+                                a.start_time_seconds AS start_s,
+                                a.end_time_seconds AS end_s,
+                                coalesce(a.time_spent_in_interval_seconds, 0) AS spent_s
+                         FROM ({queryActivities}) a
+                         JOIN agents g ON g."zoneId" = a."zoneId" and g."personId" = a."personId"
+                     ),
+                     ranked AS (
+                         SELECT *,
+                                row_number() OVER (PARTITION BY "zoneId", "personId", period ORDER BY start_s, id) AS start_rank,
+                                row_number() OVER (PARTITION BY "zoneId", "personId", period ORDER BY start_s DESC, id DESC) AS end_rank,
+                                row_number() OVER (PARTITION BY "zoneId", "personId", period ORDER BY spent_s DESC, start_s, id) AS main_rank
+                         FROM (SELECT *, (start_s - :firstStartTime) / :interval AS period
+                               FROM activities
+                               WHERE start_s >= :firstStartTime and start_s < :firstStartTime + :nbPeriods * :interval) a
+                     ),
+                     groups AS (
+                         SELECT "zoneId", "personId", period,
+                                max(id) FILTER (WHERE start_rank = 1) AS start_id,
+                                max(id) FILTER (WHERE end_rank = 1) AS end_id,
+                                max(end_s) FILTER (WHERE end_rank = 1) AS end_end_s,
+                                max(id) FILTER (WHERE main_rank = 1) AS main_id,
+                                max(start_s) FILTER (WHERE main_rank = 1) AS main_start_s,
+                                max(end_s) FILTER (WHERE main_rank = 1) AS main_end_s
+                         FROM ranked
+                         GROUP BY "zoneId", "personId", period
+                     ),
+                     null_start AS (
+                         SELECT DISTINCT ON ("zoneId", "personId") "zoneId", "personId", id, end_s
+                         FROM activities
+                         WHERE start_s is null
+                         ORDER BY "zoneId", "personId", id
+                     ),
+                     cells AS (
+                         SELECT g."zoneId", g."personId", p.period, p.period_start, p.period_end,
+                                gr.start_id, gr.end_id, gr.main_id, gr.main_start_s, gr.main_end_s,
+                                gr."personId" is not null AS has_activities,
+                                max(CASE WHEN gr."personId" is not null THEN p.period END) OVER (PARTITION BY g."zoneId", g."personId" ORDER BY p.period) AS last_period
+                         FROM agents g
+                         CROSS JOIN periods p
+                         LEFT JOIN groups gr ON gr."zoneId" = g."zoneId" and gr."personId" = g."personId" and gr.period = p.period
+                     ),
+                     carried AS (
+                         SELECT c.*, lg.end_id AS carried_id, lg.end_end_s AS carried_end_s, lg.main_start_s AS carried_main_start_s,
+                                ns.id AS null_start_id, ns.end_s AS null_start_end_s,
+                                not c.has_activities and (c.last_period is null or (lg.end_end_s is not null and lg.end_end_s < c.period_start)) AS nothing_to_carry
+                         FROM cells c
+                         LEFT JOIN groups lg ON lg."zoneId" = c."zoneId" and lg."personId" = c."personId" and lg.period = c.last_period
+                         LEFT JOIN null_start ns ON ns."zoneId" = c."zoneId" and ns."personId" = c."personId"
+                     ),
+                     states AS (
+                         SELECT *,
+                                CASE
+                                    WHEN has_activities THEN 'activities'
+                                    WHEN not nothing_to_carry THEN 'carried'
+                                    WHEN null_start_id is null THEN null
+                                    WHEN period = first_nothing_to_carry_period THEN 'nullStart'
+                                    WHEN period > first_nothing_to_carry_period and coalesce(last_period, -1) < first_nothing_to_carry_period
+                                         and (null_start_end_s is null or null_start_end_s >= period_start) THEN 'nullStartCarried'
+                                END AS state
+                         FROM (SELECT *, min(CASE WHEN nothing_to_carry THEN period END) OVER (PARTITION BY "zoneId", "personId") AS first_nothing_to_carry_period
+                               FROM carried) c
+                     ),
+                     filled AS (
+                         SELECT *,
+                                CASE state WHEN 'carried' THEN carried_id WHEN 'nullStartCarried' THEN null_start_id END AS fill_id,
+                                CASE state WHEN 'carried' THEN carried_main_start_s END AS fill_main_start_s,
+                                CASE state WHEN 'carried' THEN carried_end_s WHEN 'nullStartCarried' THEN null_start_end_s END AS fill_end_s,
+                                CASE state
+                                    WHEN 'carried' THEN carried_end_s is null or carried_end_s >= period_end
+                                    WHEN 'nullStartCarried' THEN null_start_end_s is null or null_start_end_s >= period_end
+                                    ELSE false
+                                END AS fill_ends_after_period
+                         FROM states
+                     )
+                     SELECT row_number() OVER (ORDER BY "zoneId", "personId", period) - 1 AS id,
+                            "zoneId",
+                            "personId",
+                            period_start * interval '1 second' AS "periodStart",
+                            period_end * interval '1 second' AS "periodEnd",
+                            CASE state WHEN 'activities' THEN main_id WHEN 'nullStart' THEN null_start_id ELSE fill_id END AS "mainActivityId",
+                            CASE state WHEN 'activities' THEN start_id WHEN 'nullStart' THEN null_start_id ELSE fill_id END AS "startActivityId",
+                            CASE state WHEN 'activities' THEN end_id WHEN 'nullStart' THEN null_start_id ELSE CASE WHEN fill_ends_after_period THEN fill_id END END AS "endActivityId",
+                            CASE state WHEN 'activities' THEN main_start_s ELSE fill_main_start_s END * interval '1 second' AS "mainActivityStartTime",
+                            CASE state WHEN 'activities' THEN main_end_s WHEN 'nullStart' THEN null_start_end_s ELSE fill_end_s END * interval '1 second' AS "mainActivityEndTime",
+                            CASE state
+                                WHEN 'activities' THEN CASE WHEN main_end_s is null or main_end_s >= period_end THEN period_end ELSE main_end_s END - main_start_s
+                                WHEN 'nullStart' THEN :interval
+                                ELSE CASE WHEN fill_ends_after_period THEN :interval ELSE fill_end_s - period_start END
+                            END * interval '1 second' AS "timeSpentInMainActivity"
+                     FROM filled
+                  """)
+
+    # the table is replaced if it exists, as in _createTableInDatabase
+    conn.execute(f'DROP TABLE IF EXISTS {"pg_temp." if temporary else ""}"{tableName}";')
+    conn.execute(query.bindparams(firstStartTime=firstStartTimeInSeconds, interval=intervalInSeconds, nbPeriods=nbPeriods,
+                                  startTimeSeconds=firstStartTimeInSeconds, endTimeSeconds=endTimeInSeconds))
+    return tableName
+
+
+# Returns the content of an activity sequences table, with the same types as the dataframe returned by the python engine
+def _getActivitySequencesTableDataframe(conn, tableName):
+    return _formatIntervalColumns(pd.read_sql(text(f'SELECT * FROM "{tableName}" ORDER BY id'), conn, index_col="id"))
+
+
+# Formats the interval columns of a chunk of an activity sequences table as the python engine does
+def _formatIntervalColumns(activitySequencesDf):
+    for column, columnType in config.ACTIVITY_SEQUENCES_TABLE_COLUMNS.items():
+        if columnType is types.Interval:
+            times = pd.to_timedelta(activitySequencesDf[column])
+            isNull = times.isna().to_numpy()
+            activitySequencesDf[column] = _formatTimes(np.where(isNull, 0, times.to_numpy(dtype="timedelta64[ns]").astype(np.int64) // 10**9), isNull)
+
+    return activitySequencesDf
+
+
+# Copies the result of a task in the table (if tableName is not None) and keeps it in activitySequencesDicts (if not None)
+# the ids of the rows come from the position of the agents of the task, they do not depend on the order in which the tasks are completed
+def _writeActivitySequencesResult(result, tasks, nbPeriods, tableName, conn, activitySequencesDicts, pbar):
+    taskIndex, activitySequencesDict = result
+    firstAgent, lastAgent = tasks[taskIndex][0], tasks[taskIndex][1]
+
+    if tableName is not None:
+        tableDf = pd.DataFrame(activitySequencesDict)
+        tableDf.insert(0, "id", np.arange(firstAgent * nbPeriods, lastAgent * nbPeriods))
+        # the missing ids make the columns float, they are written as integers
+        for column, columnType in config.ACTIVITY_SEQUENCES_TABLE_COLUMNS.items():
+            if columnType is types.Integer:
+                tableDf[column] = tableDf[column].astype("Int64")
+        databaseTools.copyDataframeToTable(conn, tableDf, tableName)
+
+    if activitySequencesDicts is not None:
+        activitySequencesDicts[taskIndex] = activitySequencesDict
+
+    pbar.update(lastAgent - firstAgent)
+
+
+# Returns the number of processes and the number of agents per task
+# if batchSize is None, the tasks are sized so that each process gets config.ACTIVITY_SEQUENCES_TASKS_PER_PROCESS tasks,
+# with at least config.ACTIVITY_SEQUENCES_MIN_AGENTS_PER_TASK agents per task, small zones are processed without a pool
+def _getPoolConfiguration(nbAgents, batchSize=None):
+    if batchSize is None:
+        agentsPerTask = max(config.ACTIVITY_SEQUENCES_MIN_AGENTS_PER_TASK, -(-nbAgents // (mp.cpu_count() * config.ACTIVITY_SEQUENCES_TASKS_PER_PROCESS)))
+    else:
+        agentsPerTask = max(1, batchSize)
     
-    # Creating the database in chunks to track the progress
-    activitySequencesDfLen = len(activitySequencesDf)
-    chunksize = int(activitySequencesDfLen * config.ACTIVITY_SEQUENCES_DB_PROGRESS_BAR_PERCENTAGE / 100)
-    with tqdm(total=activitySequencesDfLen) as pbar:
-        for i, cdf in enumerate(tools.chunker(activitySequencesDf, chunksize)):
-            replace = "replace" if i == 0 else "append"
-            cdf.to_sql(tableName, conn, if_exists=replace, index=True, dtype=config.ACTIVITY_SEQUENCES_TABLE_COLUMNS, chunksize=5000, method="multi")
-            pbar.update(chunksize)    
-    
+    nbTasks = -(-nbAgents // agentsPerTask)
+    return min(mp.cpu_count(), nbTasks), agentsPerTask
 
-# Function used to call _getActivitySequencesOfAgentInZoneInTimespan for each agent in the batch
-def _getActivitySequencesOfAgentInZoneInTimespanInBatch(allActivitiesDf, agentsList, firstStartTimeInSeconds, endTimeInSeconds, intervalInSeconds, formattedInterval, timeDict):
-    activitySequencesDict = collections.defaultdict(list)
 
-    for agent in agentsList:
-        currentAgentActivitySequencesDict = _getActivitySequencesOfAgentInZoneInTimespan(allActivitiesDf, agent, firstStartTimeInSeconds, endTimeInSeconds, intervalInSeconds, formattedInterval, timeDict)
-        activitySequencesDict = _mergeActivitySequencesDicts([activitySequencesDict, currentAgentActivitySequencesDict])
+# Keeps the activities of the sequences, sorted by sequence (in the order of sequencesDf) then start time (null start times last)
+# a sequence is a (zoneId, personId) pair, the activity is used in the sequence of its agent in its zone
+# "sequence" holds the position of the sequence of each activity, "sequencesZoneId" and "sequencesPersonId" the sequences
+# and "sequencesOffsets" the position of the first activity of each sequence (plus the total number of activities),
+# the activities of the sequences i to j are the rows sequencesOffsets[i] to sequencesOffsets[j]
+def _partitionActivitiesBySequence(activities, sequencesDf):
+    sequencesZoneId = sequencesDf["zoneId"].to_numpy(dtype=np.int64)
+    sequencesPersonId = sequencesDf["personId"].to_numpy(dtype=np.int64)
+    sequencesIndex = pd.MultiIndex.from_arrays([sequencesZoneId, sequencesPersonId])
+    activitiesSequences = sequencesIndex.get_indexer(pd.MultiIndex.from_arrays([activities["zoneId"], activities["personId"]]))
+    kept = np.flatnonzero(activitiesSequences >= 0)
+    kept = kept[np.lexsort((activities["startIsNull"][kept], activitiesSequences[kept]))]
+    
+    partitionedActivities = {column: np.ascontiguousarray(array[kept]) for column, array in activities.items()}
+    partitionedActivities["sequence"] = activitiesSequences[kept].astype(np.int64)
+    partitionedActivities["sequencesZoneId"] = sequencesZoneId
+    partitionedActivities["sequencesPersonId"] = sequencesPersonId
+    partitionedActivities["sequencesOffsets"] = np.searchsorted(partitionedActivities["sequence"], np.arange(len(sequencesDf) + 1)).astype(np.int64)
+    return partitionedActivities
 
+
+# Computes the activity sequences of the sequences firstSequence to lastSequence (excluded) of the partitioned activities
+# the activities of the range are views of the arrays, they are not copied
+def _getActivitySequencesOfAgentsRange(activities, firstSequence, lastSequence, firstStartTimeInSeconds, endTimeInSeconds, intervalInSeconds):
+    firstActivity = activities["sequencesOffsets"][firstSequence]
+    lastActivity = activities["sequencesOffsets"][lastSequence]
+    rangeActivities = {column: activities[column][firstActivity:lastActivity] for column in _ACTIVITIES_COLUMNS}
+    nbPeriods = len(range(firstStartTimeInSeconds, endTimeInSeconds, intervalInSeconds))
+    
+    activitySequencesDict = {"zoneId": np.repeat(activities["sequencesZoneId"][firstSequence:lastSequence], nbPeriods).tolist()}
+    activitySequencesDict.update(_getActivitySequencesOfAgents(rangeActivities, activities["sequence"][firstActivity:lastActivity] - firstSequence,
+                                                               activities["sequencesPersonId"][firstSequence:lastSequence], firstStartTimeInSeconds, endTimeInSeconds, intervalInSeconds))
     return activitySequencesDict
 
 
-# Function used to get the activity sequences of an agent in a zone in a timespan
-def _getActivitySequencesOfAgentInZoneInTimespan(allActivitiesDf, currentpersonId, firstStartTimeInSeconds, endTimeInSeconds, intervalInSeconds, formattedInterval, timeDict):
-    # get all activities of the current agent in the zone during the given timespan
-    agentActivitiesDf = allActivitiesDf[allActivitiesDf["personId"] == currentpersonId]
+# Copies each array in a shared memory block
+# returns the blocks (to be released by the caller) and the specs used by the processes to attach them : {column: (name, dtype, shape)}
+def _createSharedArrays(arrays):
+    sharedMemories = []
+    sharedArraysSpecs = {}
+    for column, array in arrays.items():
+        # a block can not be empty
+        sharedMemory = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+        sharedMemories.append(sharedMemory)
+        np.ndarray(array.shape, dtype=array.dtype, buffer=sharedMemory.buf)[:] = array
+        sharedArraysSpecs[column] = (sharedMemory.name, array.dtype.str, array.shape)
+    
+    return sharedMemories, sharedArraysSpecs
+
+
+# Initializer of the processes of the pool, attaches the shared memory blocks as numpy arrays
+def _attachSharedArrays(sharedArraysSpecs):
+    global _processSharedMemories, _processActivities
+    _processSharedMemories = []
+    _processActivities = {}
+    for column, (name, dtype, shape) in sharedArraysSpecs.items():
+        sharedMemory = shared_memory.SharedMemory(name=name)
+        _processSharedMemories.append(sharedMemory)
+        _processActivities[column] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=sharedMemory.buf)
+
+
+# Computes the activity sequences of a task, returns them with the index of the task
+def _getActivitySequencesOfAgentsRangeInTask(activities, taskIndex, firstAgent, lastAgent, firstStartTimeInSeconds, endTimeInSeconds, intervalInSeconds):
+    return taskIndex, _getActivitySequencesOfAgentsRange(activities, firstAgent, lastAgent, firstStartTimeInSeconds, endTimeInSeconds, intervalInSeconds)
+
+
+# Function used by the processes of the pool to compute the activity sequences of a task : (taskIndex, task)
+def _getActivitySequencesOfAgentsRangeInProcess(indexedTask):
+    taskIndex, task = indexedTask
+    return _getActivitySequencesOfAgentsRangeInTask(_processActivities, taskIndex, *task)
+
+
+# Converts the activities dataframe to numpy arrays, the times are already in seconds
+# the null times are flagged in the "...IsNull" arrays
+def _getActivitiesArrays(activitiesDf):
+    activities = {
+        "zoneId": activitiesDf["zoneId"].to_numpy(),
+        "personId": activitiesDf["personId"].to_numpy(),
+        "id": activitiesDf["id"].to_numpy(),
+    }
+    
+    for column, timeColumn in [("start", "start_time_seconds"), ("end", "end_time_seconds"), ("spent", "time_spent_in_interval_seconds")]:
+        times = activitiesDf[timeColumn].to_numpy(dtype=np.float64, na_value=np.nan)
+        activities[f"{column}IsNull"] = np.isnan(times)
+        activities[f"{column}InSeconds"] = np.where(activities[f"{column}IsNull"], 0, times).astype(np.int64)
+    
+    return activities
+
+
+# Returns the same arrays as _getActivitiesArrays from the timelines of the agents of the sequences (see converter.importAgentTimelines)
+# activitiesInZonesDf holds the zone of the activities ("zoneId", "id"), an activity is kept once for each of its zones
+# the activities are kept in the order of the timelines and filtered on the timespan, the time spent in the timespan is their overlap with it
+def _getActivitiesArraysFromTimelines(conn, sequencesDf, activitiesInZonesDf, firstStartTimeInSeconds, endTimeInSeconds):
+    queryTimelines = text(f"""SELECT "personId", "activityIds", "startTimes", "endTimes"
+                              from "{config.DB_AGENT_TIMELINES_TABLE}"
+                              where "personId" = ANY(:personIds)
+                           """).bindparams(personIds=sequencesDf["personId"].unique().tolist())
+    timelinesDf = pd.read_sql(queryTimelines, conn)
+    
+    # flattened timelines, in the order of the timelines
+    timelinesLengths = timelinesDf["activityIds"].str.len().to_numpy(dtype=np.int64) if len(timelinesDf) > 0 else np.array([], dtype=np.int64)
+    personId = np.repeat(timelinesDf["personId"].to_numpy(dtype=np.int64), timelinesLengths)
+    activityId = np.fromiter(itertools.chain.from_iterable(timelinesDf["activityIds"]), dtype=np.int64, count=timelinesLengths.sum())
+    startTimes = pd.Series(list(itertools.chain.from_iterable(timelinesDf["startTimes"])), dtype=np.float64).to_numpy()
+    endTimes = pd.Series(list(itertools.chain.from_iterable(timelinesDf["endTimes"])), dtype=np.float64).to_numpy()
+    startIsNull = np.isnan(startTimes)
+    endIsNull = np.isnan(endTimes)
+    startInSeconds = np.where(startIsNull, 0, startTimes).astype(np.int64)
+    endInSeconds = np.where(endIsNull, 0, endTimes).astype(np.int64)
+    
+    # position in the flattened timelines of each (zone, activity), sorted to keep the order of the timelines
+    timelinesOrder = np.argsort(activityId, kind="stable")
+    zonesActivitiesIds = activitiesInZonesDf["id"].to_numpy(dtype=np.int64)
+    positions = np.searchsorted(activityId[timelinesOrder], zonesActivitiesIds)
+    found = positions < len(activityId)
+    found[found] = activityId[timelinesOrder[positions[found]]] == zonesActivitiesIds[found]
+    zonesActivitiesPositions = timelinesOrder[positions[found]]
+    order = np.argsort(zonesActivitiesPositions, kind="stable")
+    kept = zonesActivitiesPositions[order]
+    zonesIds = activitiesInZonesDf["zoneId"].to_numpy(dtype=np.int64)[found][order]
+    
+    # activities during the timespan
+    inTimespan = ((startIsNull[kept] | ((startInSeconds[kept] >= firstStartTimeInSeconds) & (startInSeconds[kept] <= endTimeInSeconds)))
+                  & (endIsNull[kept] | ((endInSeconds[kept] >= firstStartTimeInSeconds) & (endInSeconds[kept] <= endTimeInSeconds))))
+    kept = kept[inTimespan]
+    zonesIds = zonesIds[inTimespan]
+    
+    spentInSeconds = np.where(endIsNull[kept], endTimeInSeconds, endInSeconds[kept]) - np.where(startIsNull[kept], firstStartTimeInSeconds, startInSeconds[kept])
+    
+    return {
+        "zoneId": zonesIds,
+        "personId": personId[kept],
+        "id": activityId[kept],
+        "startIsNull": startIsNull[kept],
+        "startInSeconds": startInSeconds[kept],
+        "endIsNull": endIsNull[kept],
+        "endInSeconds": endInSeconds[kept],
+        "spentIsNull": np.zeros(len(kept), dtype=bool),
+        "spentInSeconds": spentInSeconds
+    }
+
+
+# Computes the activity sequences of the agents of agentsList, every agent gets one row per interval
+# activitiesAgentsPositions is the position in agentsList of the agent of each activity (-1 for the activities to ignore)
+# the interval grid of all the agents is filled at once with array operations :
+#   - the activities are sorted by (agent, start time) and put in the interval containing their start time
+#   - the intervals with activities take their start, end and main activities from their activities
+#   - the intervals without activity carry the end activity of the last interval having activities,
+#     or use the activity without start time of the agent, the first time the agent has no activity to carry
+def _getActivitySequencesOfAgents(activities, activitiesAgentsPositions, agentsList, firstStartTimeInSeconds, endTimeInSeconds, intervalInSeconds):
+    agents = np.asarray(agentsList)
+    nbAgents = len(agents)
+    periodsStartTimes = np.arange(firstStartTimeInSeconds, endTimeInSeconds, intervalInSeconds, dtype=np.int64)
+    nbPeriods = len(periodsStartTimes)
+    nbCells = nbAgents * nbPeriods
+    
+    # periods of each cell of the (agent, period) grid, flattened
+    cellsStartTimes = np.tile(periodsStartTimes, nbAgents)
+    cellsEndTimes = cellsStartTimes + intervalInSeconds
+    cellsPeriods = np.tile(np.arange(nbPeriods), nbAgents)
+    
+    # Keeping the activities of the agents, sorted by agent then start time (null start times last), the order of the dataframe is kept for ties
+    agentsPositions = np.asarray(activitiesAgentsPositions)
+    kept = np.flatnonzero(agentsPositions >= 0)
+    kept = kept[np.lexsort((activities["startIsNull"][kept], agentsPositions[kept]))]
+    
+    activityAgent = agentsPositions[kept]
+    activityId = activities["id"][kept]
+    activityStart = activities["startInSeconds"][kept]
+    activityStartIsNull = activities["startIsNull"][kept]
+    activityEnd = activities["endInSeconds"][kept]
+    activityEndIsNull = activities["endIsNull"][kept]
+    activitySpent = activities["spentInSeconds"][kept]
+    
+    # ----- Intervals with activities -----
+    # index of the interval containing the start time of each activity
+    activityPeriod = np.where(activityStartIsNull, -1, (activityStart - firstStartTimeInSeconds) // intervalInSeconds)
+    inGrid = np.flatnonzero(~activityStartIsNull & (activityStart >= firstStartTimeInSeconds) & (activityPeriod < nbPeriods))
+    activityCell = activityAgent[inGrid] * nbPeriods + activityPeriod[inGrid]
+    
+    # the activities of a cell are contiguous
+    groupsFirst = np.flatnonzero(np.r_[True, activityCell[1:] != activityCell[:-1]]) if len(inGrid) > 0 else np.array([], dtype=np.int64)
+    groupsLast = np.r_[groupsFirst[1:], len(inGrid)] - 1 if len(inGrid) > 0 else np.array([], dtype=np.int64)
+    groupsCells = activityCell[groupsFirst]
+    
+    # main activity : first activity having the most time spent in the timespan
+    groupsSpent = activitySpent[inGrid]
+    groupsMaxSpent = np.maximum.reduceat(groupsSpent, groupsFirst) if len(groupsFirst) > 0 else groupsSpent
+    groupOfActivity = np.repeat(np.arange(len(groupsFirst)), groupsLast - groupsFirst + 1)
+    maxPositions = np.flatnonzero(groupsSpent == groupsMaxSpent[groupOfActivity])
+    _, firstMaxPositions = np.unique(groupOfActivity[maxPositions], return_index=True)
+    groupsMain = inGrid[maxPositions[firstMaxPositions]]
+    groupsFirst = inGrid[groupsFirst]
+    groupsLast = inGrid[groupsLast]
+    
+    # ----- Output grid -----
+    startActivityId = np.full(nbCells, None, dtype=object)
+    endActivityId = np.full(nbCells, None, dtype=object)
+    mainActivityId = np.full(nbCells, None, dtype=object)
+    mainActivityStartTime = np.zeros(nbCells, dtype=np.int64)
+    mainActivityStartTimeIsNull = np.ones(nbCells, dtype=bool)
+    mainActivityEndTime = np.zeros(nbCells, dtype=np.int64)
+    mainActivityEndTimeIsNull = np.ones(nbCells, dtype=bool)
+    timeSpentInMainActivity = np.zeros(nbCells, dtype=np.int64)
+    timeSpentInMainActivityIsNull = np.ones(nbCells, dtype=bool)
+    
+    startActivityId[groupsCells] = activityId[groupsFirst]
+    endActivityId[groupsCells] = activityId[groupsLast]
+    mainActivityId[groupsCells] = activityId[groupsMain]
+    mainActivityStartTime[groupsCells] = activityStart[groupsMain]
+    mainActivityStartTimeIsNull[groupsCells] = False
+    mainActivityEndTime[groupsCells] = activityEnd[groupsMain]
+    mainActivityEndTimeIsNull[groupsCells] = activityEndIsNull[groupsMain]
+    
+    # the time spent is counted until the end of the main activity, or the end of the interval if the activity ends after it
+    mainEndsAfterPeriod = activityEndIsNull[groupsMain] | (activityEnd[groupsMain] >= cellsEndTimes[groupsCells])
+    timeSpentInMainActivity[groupsCells] = np.where(mainEndsAfterPeriod, cellsEndTimes[groupsCells], activityEnd[groupsMain]) - activityStart[groupsMain]
+    timeSpentInMainActivityIsNull[groupsCells] = False
+    
+    # ----- Intervals without activity -----
+    # last interval with activities of the agent before each cell (-1 if none)
+    cellsWithActivities = np.zeros(nbCells, dtype=bool)
+    cellsWithActivities[groupsCells] = True
+    lastCellWithActivities = np.where(cellsWithActivities, np.arange(nbCells), -1).reshape(nbAgents, nbPeriods)
+    lastCellWithActivities = np.maximum.accumulate(lastCellWithActivities, axis=1).ravel()
+    
+    # end activity of the last interval with activities
+    cellGroup = np.full(nbCells, -1, dtype=np.int64)
+    cellGroup[groupsCells] = np.arange(len(groupsCells))
+    carriedGroup = np.where(lastCellWithActivities >= 0, cellGroup[np.maximum(lastCellWithActivities, 0)], -1)
+    carriedActivity = np.where(carriedGroup >= 0, groupsLast[np.maximum(carriedGroup, 0)] if len(groupsLast) > 0 else -1, -1)
+    carriedEnd = np.where(carriedActivity >= 0, activityEnd[np.maximum(carriedActivity, 0)] if len(activityEnd) > 0 else 0, 0)
+    carriedEndIsNull = np.where(carriedActivity >= 0, activityEndIsNull[np.maximum(carriedActivity, 0)] if len(activityEnd) > 0 else False, False)
+    
+    emptyCells = ~cellsWithActivities
+    # the carried activity is over before the interval starts (or there is no activity to carry)
+    nothingToCarry = emptyCells & ((carriedActivity < 0) | (~carriedEndIsNull & (carriedEnd < cellsStartTimes)))
+    carried = emptyCells & ~nothingToCarry
+    
+    carriedActivityCells = np.flatnonzero(carried)
+    carriedActivityIndexes = carriedActivity[carriedActivityCells]
+    carriedMain = groupsMain[carriedGroup[carriedActivityCells]]
+    _fillCarriedCells(carriedActivityCells, activityId[carriedActivityIndexes], activityStart[carriedMain], np.zeros(len(carriedActivityCells), dtype=bool),
+                      carriedEnd[carriedActivityCells], carriedEndIsNull[carriedActivityCells], cellsStartTimes, cellsEndTimes,
+                      startActivityId, endActivityId, mainActivityId, mainActivityStartTime, mainActivityStartTimeIsNull,
+                      mainActivityEndTime, mainActivityEndTimeIsNull, timeSpentInMainActivity, timeSpentInMainActivityIsNull, intervalInSeconds)
+    
+    # the activity without start time is used the first time the agent has nothing to carry
+    # then it is carried like any other activity until the next interval with activities
+    nullStartActivities = np.flatnonzero(activityStartIsNull)
+    agentsHavingNullStart, firstNullStartPositions = np.unique(activityAgent[nullStartActivities], return_index=True)
+    nullStartActivityOfAgent = np.full(nbAgents, -1, dtype=np.int64)
+    nullStartActivityOfAgent[agentsHavingNullStart] = nullStartActivities[firstNullStartPositions]
+    
+    nothingToCarryGrid = nothingToCarry.reshape(nbAgents, nbPeriods)
+    agentsFirstNothingToCarry = np.argmax(nothingToCarryGrid, axis=1)
+    agentsUsingNullStart = np.flatnonzero(nothingToCarryGrid.any(axis=1) & (nullStartActivityOfAgent >= 0))
+    
+    nullStartCells = agentsUsingNullStart * nbPeriods + agentsFirstNothingToCarry[agentsUsingNullStart]
+    nullStartActivity = nullStartActivityOfAgent[agentsUsingNullStart]
+    startActivityId[nullStartCells] = activityId[nullStartActivity]
+    endActivityId[nullStartCells] = activityId[nullStartActivity]
+    mainActivityId[nullStartCells] = activityId[nullStartActivity]
+    mainActivityEndTime[nullStartCells] = activityEnd[nullStartActivity]
+    mainActivityEndTimeIsNull[nullStartCells] = activityEndIsNull[nullStartActivity]
+    timeSpentInMainActivity[nullStartCells] = intervalInSeconds
+    timeSpentInMainActivityIsNull[nullStartCells] = False
+    
+    # following intervals without activity (same last interval with activities)
+    cellsNullStartActivity = np.full(nbCells, -1, dtype=np.int64)
+    cellsNullStartCell = np.full(nbCells, -1, dtype=np.int64)
+    agentOfCell = np.repeat(np.arange(nbAgents), nbPeriods)
+    cellsNullStartActivity[nullStartCells] = nullStartActivity
+    nullStartCellOfAgent = np.full(nbAgents, -1, dtype=np.int64)
+    nullStartCellOfAgent[agentsUsingNullStart] = nullStartCells
+    cellsNullStartCell = nullStartCellOfAgent[agentOfCell]
+    
+    nullStartCarried = np.flatnonzero(nothingToCarry & (cellsNullStartCell >= 0) & (np.arange(nbCells) > cellsNullStartCell)
+                                      & (lastCellWithActivities == lastCellWithActivities[np.maximum(cellsNullStartCell, 0)]))
+    nullStartCarriedActivity = nullStartActivityOfAgent[agentOfCell[nullStartCarried]]
+    nullStartCarriedEnd = activityEnd[nullStartCarriedActivity]
+    nullStartCarriedEndIsNull = activityEndIsNull[nullStartCarriedActivity]
+    stillCarried = nullStartCarriedEndIsNull | (nullStartCarriedEnd >= cellsStartTimes[nullStartCarried])
+    nullStartCarried = nullStartCarried[stillCarried]
+    _fillCarriedCells(nullStartCarried, activityId[nullStartCarriedActivity[stillCarried]], np.zeros(len(nullStartCarried), dtype=np.int64), np.ones(len(nullStartCarried), dtype=bool),
+                      nullStartCarriedEnd[stillCarried], nullStartCarriedEndIsNull[stillCarried], cellsStartTimes, cellsEndTimes,
+                      startActivityId, endActivityId, mainActivityId, mainActivityStartTime, mainActivityStartTimeIsNull,
+                      mainActivityEndTime, mainActivityEndTimeIsNull, timeSpentInMainActivity, timeSpentInMainActivityIsNull, intervalInSeconds)
     
     # dictionary with the same structure as the activitySequencesDf
-    # the keys are: personId, periodStart, periodEnd, mainActivityId, startActivityId, endActivityId, mainActivityStartTime, mainActivityEndTime, timeSpentInMainActivity
-    agentActivitySequencesDict = collections.defaultdict(list)
-    currentStartTimeInSeconds = firstStartTimeInSeconds
-    
-    # Parse the activities
-    currentAgentPreviousEndActivityId = None
-    currentAgentPreviousEndActivityEndTime = None
-    alreadyAddedNullStartActivity = False
-
-    nullStartTimeActivities = agentActivitiesDf[agentActivitiesDf["start_time"].isnull()]
-
-    while currentStartTimeInSeconds < endTimeInSeconds:
-        currentEndTimeInSeconds = currentStartTimeInSeconds + intervalInSeconds
-        currentStartTimeFormatted = timeDict[currentStartTimeInSeconds]
-        currentEndTimeFormatted = timeDict[currentEndTimeInSeconds]
-        
-        currentAgentStartActivityId = None
-        currentAgentEndActivityId = None
-        currentAgentEndActivityEndTime = None
-        currentAgentMainActivityId = None
-        currentAgentMainActivityStartTime = None
-        currentAgentMainActivityEndTime = None
-        currentAgentTimeSpentInMainActivity = None
-        
-        if currentAgentPreviousEndActivityEndTime is not None:
-            if type(currentAgentPreviousEndActivityEndTime) is str:
-                currentAgentPreviousEndActivityEndTimeInSeconds = tools.getTimeInSeconds(currentAgentPreviousEndActivityEndTime)
-            elif type(currentAgentPreviousEndActivityEndTime) is pd._libs.tslibs.timedeltas.Timedelta:
-                currentAgentPreviousEndActivityEndTimeInSeconds = int(currentAgentPreviousEndActivityEndTime.total_seconds())
-            elif type(currentAgentPreviousEndActivityEndTime) is pd._libs.tslibs.nattype.NaTType:
-                pass
-            else:
-                print(f"{currentStartTimeFormatted} - {currentEndTimeFormatted}")
-                print(f"{currentpersonId} - {currentAgentPreviousEndActivityEndTime}")
-                print(f"unknown type: {type(currentAgentPreviousEndActivityEndTime)}")
-        else:
-            currentAgentPreviousEndActivityEndTimeInSeconds = -1
-            
-        activitiesDf = agentActivitiesDf[(agentActivitiesDf["start_time"] >= currentStartTimeFormatted) & (agentActivitiesDf["start_time"] < currentEndTimeFormatted)]
-        
-        # if the agent has no activity in the current interval, we check if the previous end activity ends during or after
-        # the current interval. If it does, we use the previous end activity as the current activity
-        if activitiesDf.empty:
-            if currentAgentPreviousEndActivityEndTimeInSeconds >= currentStartTimeInSeconds or type(currentAgentPreviousEndActivityEndTime) is pd._libs.tslibs.nattype.NaTType:
-                currentAgentStartActivityId = currentAgentPreviousEndActivityId
-                currentAgentMainActivityId = currentAgentPreviousEndActivityId
-                currentAgentMainActivityStartTime = currentAgentPreviousMainActivityStartTime
-                currentAgentMainActivityEndTime = currentAgentPreviousEndActivityEndTime
-                
-                
-                if currentAgentPreviousEndActivityEndTimeInSeconds >= currentEndTimeInSeconds or type(currentAgentPreviousEndActivityEndTime) is pd._libs.tslibs.nattype.NaTType:
-                    # case where the previous end activity ends after the current interval
-                    currentAgentTimeSpentInMainActivity = formattedInterval
-                    currentAgentEndActivityId = currentAgentPreviousEndActivityId
-                    currentAgentEndActivityEndTime = currentAgentPreviousEndActivityEndTime
-                else:
-                    # case where the previous end activity ends during the current interval
-                    currentAgentTimeSpentInMainActivity = tools.getFormattedTime(currentAgentPreviousEndActivityEndTimeInSeconds - currentStartTimeInSeconds)
-                    currentAgentEndActivityId = None
-                    currentAgentEndActivityEndTime = None
-            else:
-                # case where the agent has no activity in the current interval and the previous end activity ends before the current interval
-                                
-                if not nullStartTimeActivities.empty and not alreadyAddedNullStartActivity:
-                    # case where the agents has a starting activity with no start time
-                    currentAgentMainActivityId = nullStartTimeActivities.iloc[0]["id"]
-                    currentAgentMainActivityStartTime = nullStartTimeActivities.iloc[0]["start_time"]
-                    currentAgentMainActivityEndTime = nullStartTimeActivities.iloc[0]["end_time"]
-                    currentAgentTimeSpentInMainActivity = tools.getFormattedTime(intervalInSeconds)
-                    currentAgentEndActivityId = currentAgentMainActivityId
-                    currentAgentEndActivityEndTime = currentAgentMainActivityEndTime
-                    currentAgentStartActivityId = currentAgentMainActivityId
-                    alreadyAddedNullStartActivity = True
-
-        else:
-            # use the activity that takes the most time in the interval as the main activity
-            mostTimeSpentActivity = activitiesDf[activitiesDf["activity_time_spent_in_interval"] == activitiesDf["activity_time_spent_in_interval"].max()]
-            
-            currentAgentMainActivityId = mostTimeSpentActivity["id"].iloc[0]
-            currentAgentMainActivityStartTime = mostTimeSpentActivity["start_time"].iloc[0]
-            currentAgentMainActivityEndTime = mostTimeSpentActivity["end_time"].iloc[0]            
-            currentAgentStartActivityId = activitiesDf["id"].iloc[0]
-            currentAgentEndActivityId = activitiesDf["id"].iloc[-1]
-            currentAgentEndActivityEndTime = activitiesDf["end_time"].iloc[-1]
-            
-            if currentAgentMainActivityEndTime.total_seconds() >= currentEndTimeInSeconds or type(currentAgentMainActivityEndTime) is pd._libs.tslibs.nattype.NaTType:
-                currentAgentTimeSpentInMainActivity = tools.getFormattedTime(currentEndTimeInSeconds - currentAgentMainActivityStartTime.total_seconds())
-            else:
-                currentAgentTimeSpentInMainActivity = tools.getFormattedTime(currentAgentMainActivityEndTime.total_seconds() - currentAgentMainActivityStartTime.total_seconds())
-
-        if type(currentAgentMainActivityStartTime) == pd._libs.tslibs.timedeltas.Timedelta:
-            currentAgentMainActivityStartTime = tools.getFormattedTime(currentAgentMainActivityStartTime.total_seconds())
-        if type(currentAgentMainActivityEndTime) == pd._libs.tslibs.timedeltas.Timedelta:
-            currentAgentMainActivityEndTime = tools.getFormattedTime(currentAgentMainActivityEndTime.total_seconds())
-        
-        if type(currentAgentMainActivityStartTime) == pd._libs.tslibs.nattype.NaTType:
-            currentAgentMainActivityStartTime = None
-        if type(currentAgentMainActivityEndTime) == pd._libs.tslibs.nattype.NaTType:
-            currentAgentMainActivityEndTime = None
-        
-        # add the current activity sequence to the dictionary
-        agentActivitySequencesDict["personId"].append(currentpersonId)
-        agentActivitySequencesDict["periodStart"].append(currentStartTimeFormatted)
-        agentActivitySequencesDict["periodEnd"].append(currentEndTimeFormatted)
-        agentActivitySequencesDict["mainActivityId"].append(currentAgentMainActivityId)
-        agentActivitySequencesDict["startActivityId"].append(currentAgentStartActivityId)
-        agentActivitySequencesDict["endActivityId"].append(currentAgentEndActivityId)
-        agentActivitySequencesDict["mainActivityStartTime"].append(currentAgentMainActivityStartTime)
-        agentActivitySequencesDict["mainActivityEndTime"].append(currentAgentMainActivityEndTime)
-        agentActivitySequencesDict["timeSpentInMainActivity"].append(currentAgentTimeSpentInMainActivity)
-        
-        # update the previous values
-        currentAgentPreviousMainActivityStartTime = currentAgentMainActivityStartTime
-        currentAgentPreviousEndActivityId = currentAgentEndActivityId
-        currentAgentPreviousEndActivityEndTime = currentAgentEndActivityEndTime
-        
-        # add interval to startTime
-        currentStartTimeInSeconds += intervalInSeconds
-    
-    # create the dataframe
-    return agentActivitySequencesDict
-
-
-
-# Merge a list of activity sequences dictionaries into a single dictionary
-def _mergeActivitySequencesDicts(activitySequencesDicts):
-    mergedActivitySequencesDict = collections.defaultdict(list)
-    for activitySequencesDict in activitySequencesDicts:
-        for key, value in activitySequencesDict.items():
-            mergedActivitySequencesDict[key].extend(value)
-    return mergedActivitySequencesDict
\ No newline at end of file
+    activitySequencesDict = {
+        "personId": np.repeat(agents, nbPeriods),
+        "periodStart": _formatTimes(cellsStartTimes, np.zeros(nbCells, dtype=bool)),
+        "periodEnd": _formatTimes(cellsEndTimes, np.zeros(nbCells, dtype=bool)),
+        "mainActivityId": mainActivityId,
+        "startActivityId": startActivityId,
+        "endActivityId": endActivityId,
+        "mainActivityStartTime": _formatTimes(mainActivityStartTime, mainActivityStartTimeIsNull),
+        "mainActivityEndTime": _formatTimes(mainActivityEndTime, mainActivityEndTimeIsNull),
+        "timeSpentInMainActivity": _formatTimes(timeSpentInMainActivity, timeSpentInMainActivityIsNull)
+    }
+    
+    return {key: value.tolist() for key, value in activitySequencesDict.items()}
+
+
+# Fills the cells carrying an activity that started before the interval
+# if the activity ends after the interval, the agent spends the whole interval in it and it is also the end activity of the interval
+# otherwise the agent spends the time until the end of the activity in it, and there is no end activity
+def _fillCarriedCells(cells, carriedId, carriedMainStart, carriedMainStartIsNull, carriedEnd, carriedEndIsNull, cellsStartTimes, cellsEndTimes,
+                      startActivityId, endActivityId, mainActivityId, mainActivityStartTime, mainActivityStartTimeIsNull,
+                      mainActivityEndTime, mainActivityEndTimeIsNull, timeSpentInMainActivity, timeSpentInMainActivityIsNull, intervalInSeconds):
+    endsAfterPeriod = carriedEndIsNull | (carriedEnd >= cellsEndTimes[cells])
+    
+    startActivityId[cells] = carriedId
+    mainActivityId[cells] = carriedId
+    endActivityId[cells] = np.where(endsAfterPeriod, carriedId, None)
+    mainActivityStartTime[cells] = carriedMainStart
+    mainActivityStartTimeIsNull[cells] = carriedMainStartIsNull
+    mainActivityEndTime[cells] = carriedEnd
+    mainActivityEndTimeIsNull[cells] = carriedEndIsNull
+    timeSpentInMainActivity[cells] = np.where(endsAfterPeriod, intervalInSeconds, carriedEnd - cellsStartTimes[cells])
+    timeSpentInMainActivityIsNull[cells] = False
+
+
+# Returns the times formatted in hh:mm:ss (None for null times), each distinct time is formatted once
+def _formatTimes(timesInSeconds, isNull):
+    uniqueTimes, inverse = np.unique(timesInSeconds, return_inverse=True)
+    formattedTimes = np.array([tools.getFormattedTime(int(x)) for x in uniqueTimes], dtype=object)[inverse.ravel()] if len(uniqueTimes) > 0 else np.array([], dtype=object)
+    formattedTimes[isNull] = None
+    return formattedTimes
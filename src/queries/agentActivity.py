@@ -1,16 +1,25 @@
 from furbain import config
 from furbain import tools
 from furbain import databaseTools
+from furbain import profiler
+from furbain import queryCache
 import geojson
 import pandas as pd
 from sqlalchemy.sql import text
 
 
+# Columns added to the activities, the total time spent in the activity and the time spent in the [startTime, endTime] interval
+# the time spent in the interval is the overlap of the activity with the interval, a null start or end time is unbounded
+TIME_SPENT_IN_INTERVAL_COLUMNS = """(end_time_seconds - start_time_seconds) * interval '1 second' as total_time_spent,
+                                (LEAST(coalesce(end_time_seconds, :endTimeSeconds), :endTimeSeconds)
+                                 - GREATEST(coalesce(start_time_seconds, :startTimeSeconds), :startTimeSeconds)) * interval '1 second' as time_spent_in_interval"""
+
+
 # get activities of all agents in given zones and time interval
 # Return an array of dataframes for each zone
 #
 # Options:
-# eg: startTime = :startTime and endTime = '19:00:00'
+# eg: startTime = '18:00:00' and endTime = '19:00:00'
 # strictTime :  if true, only activities that start and end in the time interval are considered
 #                   eg: an activity starting at 18:30:00 and ending at 19:00:00 is considered
 #                       an activity starting at 18:30:00 and ending at 19:15:00 is NOT considered
@@ -22,55 +31,104 @@ from sqlalchemy.sql import text
 #                       an activity starting at 18:00:00 and ending at null is considered
 #                       an activity starting at 17:00:00 and ending at 18:00:00 or later is considered
 #                       an activity starting at 19:00:00 and ending at xx:xx:xx is NOT considered
-
-def agentActivity(filePath, startTime='00:00:00', endTime='32:00:00', strictTime=False):
-    conn = databaseTools.connectToDatabase()
-    allZonesDataframes = [] # list dataframes for all zones
+#
+# batched :     if true, the zones are uploaded once and all the activities are tagged with their zone in a single query
+#               returns a single dataframe with a "zoneId" column (index of the zone in the geojson file)
+# groupByZone : only used if batched is true, returns a dictionary {zoneId: dataframe} instead of the single dataframe
+# concurrency : number of queries running in parallel, each on its own connection
+#               the zones are queried in parallel (or split in concurrency chunks of zones if batched is true)
+#               the results are always returned in the order of the zones in the geojson file
+# useCache :    if true, the result is read from the query cache if the same query has already been run on the same data (see queryCache)
+@profiler.profiled
+def agentActivity(filePath, startTime='00:00:00', endTime='32:00:00', strictTime=False, batched=False, groupByZone=False, concurrency=1, useCache=False):
+    if useCache:
+        parameters = {"startTime": startTime, "endTime": endTime, "strictTime": strictTime, "batched": batched, "groupByZone": groupByZone}
+        return queryCache.getCachedResult("agentActivity", filePath, parameters,
+                                          lambda: agentActivity(filePath, startTime, endTime, strictTime, batched, groupByZone, concurrency))
     
     with open(filePath) as f:
         gjson = geojson.load(f)
         features = gjson["features"]
-        nbFeatures = len(features)
         
         geojsonEpsg = tools.getEPSGFromGeoJSON(gjson)
+        zones = tools.getPolygonsFromFeatures(features, geojsonEpsg)
+    
+    conn = databaseTools.connectToDatabase()
+    databaseTools.checkTimesInSeconds(conn, config.DB_PLANS_TABLE)
+    conn.close()
+    
+    if batched:
+        query = _getBatchedQuery(startTime, endTime, strictTime)
         
-        queryTemplate = f"""SELECT *, end_time - start_time as total_time_spent, 
-                                CASE
-                                    WHEN :startTime <= start_time and :endTime >= end_time then end_time - start_time
-                                    WHEN :startTime >= start_time and :endTime >= end_time then end_time - :startTime
-                                    WHEN :startTime > start_time and :endTime < end_time then interval :endTime - interval :startTime
-                                    WHEN :startTime <= start_time and :endTime <= end_time then :endTime - start_time
-                                    WHEN start_time is null and :endTime >= end_time then end_time - :startTime
-                                    WHEN start_time is null and :endTime < end_time then interval :endTime - interval :startTime
-                                    WHEN :startTime > start_time and end_time is null then interval :endTime - interval :startTime
-                                    WHEN :startTime <= start_time and end_time is null then :endTime - start_time
-                                    WHEN start_time is null and end_time is null then interval :endTime - interval :startTime
-                                END as time_spent_in_interval
-                            from activity 
-                            where ST_Contains(ST_Transform(ST_GeomFromText(:currentPolygon, {geojsonEpsg}), {config.getDatabaseSRID()}), ST_SetSRID("location", {config.getDatabaseSRID()}))
-                        """
-        # Changing query depending on strictTime option
-        if strictTime:
-            query = text(queryTemplate + """and start_time between :startTime and :endTime
-                                            and end_time between :startTime and :endTime""")
-        else:
-            query = text(queryTemplate + """and (start_time < :endTime or start_time is null)
-                                            and (end_time > :startTime or end_time is null)""")
+        def getZonesChunkDataframe(conn, zonesChunk):
+            databaseTools.createTemporaryZoneTable(conn, zonesChunk, geojsonEpsg)
+            return pd.read_sql(query, conn)
         
-        for i in range(nbFeatures):
-            currentFeature = features[i]            
-            currentCoordinates, currentGeometryType = tools.parseFeature(currentFeature)
-            
-            if currentCoordinates is None or currentGeometryType is None:
-                print(f"Skipped feature {i} of the list (starting at 0) because no geometry or coordinates were found")
-                continue
-            
-            currentPolygon = tools.formatGeoJSONPolygonToPostgisPolygon(currentCoordinates, currentGeometryType, geojsonEpsg)
-            
-            query = query.bindparams(currentPolygon=currentPolygon, startTime=startTime, endTime=endTime)
-            dataframe = pd.read_sql(query, conn)
-            allZonesDataframes.append(dataframe)
+        zonesChunks = tools.splitInChunks(zones, concurrency) or [zones]
+        dataframe = pd.concat(databaseTools.runConcurrently(getZonesChunkDataframe, zonesChunks, concurrency), ignore_index=True)
+        
+        if groupByZone:
+            return _groupDataframeByZone(dataframe, [zoneId for zoneId, polygon in zones])
+        return dataframe
     
-    conn.close()
+    query = text(f"""SELECT *, {TIME_SPENT_IN_INTERVAL_COLUMNS}
+                    from activity 
+                    where ST_Contains(ST_Transform(ST_GeomFromText(:currentPolygon, {geojsonEpsg}), {config.getDatabaseSRID()}), ST_SetSRID("location", {config.getDatabaseSRID()}))
+                    and {_getTimeCondition(strictTime)}
+                """)
+    
+    def getZoneDataframe(conn, zone):
+        zoneId, currentPolygon = zone
+        return pd.read_sql(query.bindparams(currentPolygon=currentPolygon, startTimeSeconds=tools.getTimeInSeconds(startTime), endTimeSeconds=tools.getTimeInSeconds(endTime)), conn)
+    
+    # list dataframes for all zones
+    allZonesDataframes = databaseTools.runConcurrently(getZoneDataframe, zones, concurrency)
+    
+    return allZonesDataframes
+
+
+# Same as agentActivity with batched=True, but yields the activities in dataframes of at most chunkSize rows
+# the activities are read through a server-side cursor, so the activities of large zones can be processed in constant memory
+def iterateAgentActivity(filePath, startTime='00:00:00', endTime='32:00:00', strictTime=False, chunkSize=config.STREAM_CHUNK_SIZE):
+    with open(filePath) as f:
+        gjson = geojson.load(f)
+        geojsonEpsg = tools.getEPSGFromGeoJSON(gjson)
+        zones = tools.getPolygonsFromFeatures(gjson["features"], geojsonEpsg)
+    
+    conn = databaseTools.connectToDatabase()
+    try:
+        databaseTools.checkTimesInSeconds(conn, config.DB_PLANS_TABLE)
+        databaseTools.createTemporaryZoneTable(conn, zones, geojsonEpsg)
+        yield from databaseTools.iterateQuery(conn, _getBatchedQuery(startTime, endTime, strictTime), chunkSize)
+    finally:
+        conn.close()
+
+
+# Query of the activities of the zones uploaded in the temporary zone table, each activity is tagged with its zone
+def _getBatchedQuery(startTime, endTime, strictTime):
+    query = text(f"""SELECT a.*, z.zone_id as "zoneId", {TIME_SPENT_IN_INTERVAL_COLUMNS}
+                    from activity a
+                    join "{config.QUERIES_ZONE_TABLE_NAME}" z ON ST_Contains(z.geom, ST_SetSRID(a."location", {config.getDatabaseSRID()}))
+                    where {_getTimeCondition(strictTime)}
+                """)
+    return query.bindparams(startTimeSeconds=tools.getTimeInSeconds(startTime), endTimeSeconds=tools.getTimeInSeconds(endTime))
+
+
+# Changing the time condition depending on strictTime option
+# the conditions use the integer seconds columns, which are indexed
+def _getTimeCondition(strictTime):
+    if strictTime:
+        return """start_time_seconds between :startTimeSeconds and :endTimeSeconds
+                and end_time_seconds between :startTimeSeconds and :endTimeSeconds"""
+    else:
+        return """(start_time_seconds < :endTimeSeconds or start_time_seconds is null)
+                and (end_time_seconds > :startTimeSeconds or end_time_seconds is null)"""
+
+
+# Split the dataframe of the batched query in one dataframe per zone
+# zones without activities get an empty dataframe
+def _groupDataframeByZone(dataframe, zonesIds):
+    zonesDataframes = {zoneId: zoneDataframe.drop(columns=["zoneId"]).reset_index(drop=True) for zoneId, zoneDataframe in dataframe.groupby("zoneId")}
+    emptyDataframe = dataframe.drop(columns=["zoneId"]).iloc[0:0]
     
-    return allZonesDataframes
\ No newline at end of file
+    return {zoneId: zonesDataframes.get(zoneId, emptyDataframe) for zoneId in zonesIds}
\ No newline at end of file
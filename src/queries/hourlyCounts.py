@@ -0,0 +1,104 @@
+from furbain import config
+from furbain import tools
+from furbain import databaseTools
+from furbain import profiler
+from furbain.queries.odMatrix import getFacilityZoneQuery
+import geojson
+import pandas as pd
+from sqlalchemy.sql import text
+
+
+# get the number of activities starting in each zone during each hour, by type of activity
+# Returns a dataframe with the columns zoneId (index of the zone in the geojson file), hour (start time of the activities divided by one hour),
+# type and activityCount, sorted by zone, hour and type
+# The activities are located by their facility, the activities without start time or facility are not counted
+#
+# Options:
+# eg: startTime = '08:00:00' and endTime = '10:00:00' counts the activities starting in [08:00:00, 10:00:00[, in the hours 8 and 9
+# useAggregates : if true, the activities are counted from the aggregate table of the activities (see converter.importAggregates)
+#                 when it exists and startTime and endTime are multiples of one hour, from the activity table otherwise
+@profiler.profiled
+def zoneActivityCounts(filePath, startTime='00:00:00', endTime='32:00:00', useAggregates=True):
+    with open(filePath) as f:
+        gjson = geojson.load(f)
+        features = gjson["features"]
+
+        geojsonEpsg = tools.getEPSGFromGeoJSON(gjson)
+        zones = tools.getPolygonsFromFeatures(features, geojsonEpsg)
+
+    conn = databaseTools.connectToDatabase()
+    try:
+        databaseTools.checkTimesInSeconds(conn, config.DB_PLANS_TABLE)
+        with profiler.stage('zones'):
+            databaseTools.createTemporaryZoneTable(conn, zones, geojsonEpsg)
+
+        with profiler.stage('activities') as currentStage:
+            # the aggregate table has one row per facility, hour and type
+            if (useAggregates
+                and tools.getTimeInSeconds(startTime) % 3600 == 0 and tools.getTimeInSeconds(endTime) % 3600 == 0
+                and databaseTools.tableExists(conn, config.DB_ACTIVITIES_AGGREGATE_TABLE)):
+                activitiesQuery = f"""SELECT a."facilityId", a.hour, a.type, a."activityCount"
+                                      from "{config.DB_ACTIVITIES_AGGREGATE_TABLE}" a
+                                      where a.hour >= :startTimeSeconds / 3600 and a.hour < :endTimeSeconds / 3600"""
+            else:
+                activitiesQuery = f"""SELECT a."facilityId", a.start_time_seconds / 3600 as hour, a.type, 1 as "activityCount"
+                                      from "{config.DB_PLANS_TABLE}" a
+                                      where a.start_time_seconds >= :startTimeSeconds and a.start_time_seconds < :endTimeSeconds
+                                      and a."facilityId" is not null"""
+
+            query = f"""WITH "facilityZone" AS (
+                            {getFacilityZoneQuery()}
+                        )
+                        SELECT fz.zone_id as "zoneId", a.hour, a.type, sum(a."activityCount")::bigint as "activityCount"
+                        from ({activitiesQuery}) a
+                        join "facilityZone" fz ON a."facilityId" = fz.facility_id
+                        group by fz.zone_id, a.hour, a.type
+                        order by fz.zone_id, a.hour, a.type"""
+            parameters = {"startTimeSeconds": tools.getTimeInSeconds(startTime), "endTimeSeconds": tools.getTimeInSeconds(endTime)}
+            activityCountsDataframe = pd.read_sql(text(query), conn, params=parameters)
+            currentStage['rows'] = len(activityCountsDataframe)
+    finally:
+        conn.close()
+
+    return activityCountsDataframe
+
+
+# get the traffic of each road class (osm_way_highway of the links) during each hour
+# Returns a dataframe with the columns hour (start time of the time steps divided by one hour), osm_way_highway,
+# vehicleCount and meanSpeed (mean speed of the time steps weighted by their number of vehicles), sorted by hour and road class
+# The network links have to be imported with the traffic
+#
+# Options:
+# eg: startTime = '08:00:00' and endTime = '10:00:00' reads the time steps starting in [08:00:00, 10:00:00[, in the hours 8 and 9
+# useAggregates : if true, the traffic is read from the aggregate table of the traffic (see converter.importAggregates)
+#                 when it exists and startTime and endTime are multiples of one hour, from the networkLinkTraffic table otherwise
+@profiler.profiled
+def roadClassTraffic(startTime='00:00:00', endTime='32:00:00', useAggregates=True):
+    conn = databaseTools.connectToDatabase()
+    try:
+        databaseTools.checkTimesInSeconds(conn, config.DB_EVENTS_TABLE)
+
+        if (useAggregates
+            and tools.getTimeInSeconds(startTime) % 3600 == 0 and tools.getTimeInSeconds(endTime) % 3600 == 0
+            and databaseTools.tableExists(conn, config.DB_LINK_TRAFFIC_AGGREGATE_TABLE)):
+            query = f"""SELECT t.hour, t.osm_way_highway, t."vehicleCount", t."meanSpeed"
+                        from "{config.DB_LINK_TRAFFIC_AGGREGATE_TABLE}" t
+                        where t.hour >= :startTimeSeconds / 3600 and t.hour < :endTimeSeconds / 3600
+                        order by t.hour, t.osm_way_highway"""
+        else:
+            if not databaseTools.tableExists(conn, config.DB_NETWORK_TABLE):
+                raise Exception(f'The table "{config.DB_NETWORK_TABLE}" does not exist, the network links have to be imported to read the road classes.')
+            # same values as the aggregate table (see converter.aggregates.importLinkTrafficAggregate)
+            query = f"""SELECT t."startTimeSeconds" / 3600 as hour, l.osm_way_highway,
+                               sum(t."vehicleCount") as "vehicleCount",
+                               sum(t."meanSpeed" * t."vehicleCount") / nullif(sum(t."vehicleCount"), 0) as "meanSpeed"
+                        from "{config.DB_EVENTS_TABLE}" t
+                        join "{config.DB_NETWORK_TABLE}" l ON l.id = t."linkId"
+                        where t."startTimeSeconds" >= :startTimeSeconds and t."startTimeSeconds" < :endTimeSeconds
+                        group by t."startTimeSeconds" / 3600, l.osm_way_highway
+                        order by hour, l.osm_way_highway"""
+
+        parameters = {"startTimeSeconds": tools.getTimeInSeconds(startTime), "endTimeSeconds": tools.getTimeInSeconds(endTime)}
+        return pd.read_sql(text(query), conn, params=parameters)
+    finally:
+        conn.close()
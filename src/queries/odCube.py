@@ -0,0 +1,55 @@
+from furbain import config
+from furbain import tools
+from furbain import databaseTools
+from furbain import profiler
+from furbain.queries.odMatrix import getODCountsDataframe
+from furbain.queries.sparseCube import createODCube
+import geojson
+
+
+# get OD cube of all agents between given zones, split in time bins and optionally by mode
+# the trips are counted in one query, each trip is put in the bin of its departure time
+#
+# Options:
+# binSize : size of the time bins in minutes, the first bin starts at startTime
+#   eg: startTime = '06:00:00', endTime = '10:00:00' and binSize = 60 gives 4 bins : 06:00:00, 07:00:00, 08:00:00 and 09:00:00
+# breakdowns : list of trip columns used as additional dimensions of the cube, see config.OD_CUBE_BREAKDOWNS
+#   eg: ['main_mode'] gives a zone x zone x bin x main_mode cube
+# ignoreArrivalTime : same as odMatrix
+# unlike odMatrix, trips departing before startTime are never considered
+@profiler.profiled
+def odCube(filePath, startTime='00:00:00', endTime='32:00:00', binSize=60, breakdowns=None, ignoreArrivalTime=True):
+    if breakdowns is None:
+        breakdowns = []
+
+    for breakdown in breakdowns:
+        if breakdown not in config.OD_CUBE_BREAKDOWNS:
+            raise Exception(f'The breakdown "{breakdown}" is not supported, use one of {config.OD_CUBE_BREAKDOWNS}')
+
+    if binSize <= 0:
+        raise Exception('The bin size has to be > 0')
+
+    startTimeInSeconds = tools.getTimeInSeconds(startTime)
+    endTimeInSeconds = tools.getTimeInSeconds(endTime)
+    binSizeInSeconds = binSize * 60
+    binsLabels = [tools.getFormattedTime(x) for x in range(startTimeInSeconds, endTimeInSeconds, binSizeInSeconds)]
+
+    conn = databaseTools.connectToDatabase()
+
+    with open(filePath) as f:
+        gjson = geojson.load(f)
+        geojsonEpsg = tools.getEPSGFromGeoJSON(gjson)
+        zones = tools.getPolygonsFromFeatures(gjson["features"], geojsonEpsg)
+
+        databaseTools.createTemporaryZoneTable(conn, zones, geojsonEpsg)
+
+        groupBy = {"bin": f"(t.dep_time_seconds - {startTimeInSeconds}) / {binSizeInSeconds}"}
+        for breakdown in breakdowns:
+            groupBy[breakdown] = f"t.{breakdown}"
+
+        odCountsDf = getODCountsDataframe(conn, startTime, endTime, ignoreArrivalTime, groupBy=groupBy, conditions=["t.dep_time_seconds >= :startTimeSeconds"],
+                                          useAggregates=binSizeInSeconds % 3600 == 0)
+
+    conn.close()
+
+    return createODCube(odCountsDf, zones, geojsonEpsg, indexedDimensions={"bin": binsLabels}, labelledDimensions=breakdowns)
\ No newline at end of file
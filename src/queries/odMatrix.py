@@ -1,11 +1,13 @@
 from furbain import config
 from furbain import tools
 from furbain import databaseTools
+from furbain import profiler
+from furbain import queryCache
 import geojson
+from furbain.queries.sparseCube import createODCube
 import pandas as pd
-from pyproj import Proj, transform
 from sqlalchemy.sql import text
-from shapely import wkt
+import uuid
 
 
 # get OD Matrix of all agents between given zones and time interval
@@ -19,140 +21,161 @@ from shapely import wkt
 #   eg : a trip having dep_time = 18:00:00 and trav_time = 00:30:00 is considered
 #        a trip having dep_time = 18:00:00 and trav_time = 01:30:00 is considered
 # in both cases, if a trip has a dep_time < 18:00:00 it will not be considered
-def odMatrix(filePath, startTime='00:00:00', endTime='32:00:00', ignoreArrivalTime=True, generateArabesqueFiles=False):
-    conn = databaseTools.connectToDatabase()
-    
+# sparse : if true, returns an ODCube (see odCube) storing only the non-zero counts instead of the dense 2D array
+# concurrency : number of queries running in parallel, each on its own connection
+#   the origin zones are split in concurrency chunks, the trips leaving each chunk are counted in parallel
+# useCache : if true, the counts of trips are read from the query cache if the same query has already been run on the same data (see queryCache)
+@profiler.profiled
+def odMatrix(filePath, startTime='00:00:00', endTime='32:00:00', ignoreArrivalTime=True, generateArabesqueFiles=False, sparse=False, concurrency=1, useCache=False):
     with open(filePath) as f:
         gjson = geojson.load(f)
         features = gjson["features"]
         
         geojsonEpsg = tools.getEPSGFromGeoJSON(gjson)
         # print(f"GeoJSON EPSG : {gjsonEpsg}")
-
-        # init OD matrix
-        nbFeatures = len(features)
-        finalODMatrix = [[-1 for x in range(nbFeatures)] for y in range(nbFeatures)]
-        
-        zonesCentroids = []
-        
-        # Setting up the query
-        query = f"""SELECT count(*)
-                    from trip
-                    where trip.id IN (SELECT t.id
-                            from facility f
-                            join trip t ON t.start_facility_id = f.id
-                            where ST_Contains(ST_Transform(ST_GeomFromText(:startingPolygon, {geojsonEpsg}), {config.getDatabaseSRID()}), ST_SetSRID("location", {config.getDatabaseSRID()})))
-                    AND trip.id IN  (SELECT t.id
-                            from facility f
-                            join trip t ON t.end_facility_id = f.id
-                            where ST_Contains(ST_Transform(ST_GeomFromText(:endingPolygon, {geojsonEpsg}), {config.getDatabaseSRID()}), ST_SetSRID("location", {config.getDatabaseSRID()})))
-                    AND dep_time < :endTime
-                """
-        
-        if not ignoreArrivalTime:
-            query += """ and (dep_time + trav_time) > :startTime
-                        and (dep_time + trav_time) < :endTime """
         
-        query = text(query)
-                
-        for i in range(nbFeatures):
-            startingFeature = features[i]
-            startingCoordinates, startingGeometryType = tools.parseFeature(startingFeature)
-            
-            if startingCoordinates is None or startingGeometryType is None:
-                print(f"Skipped feature (origin {i}) of the list (starting at 0) because no geometry or coordinates were found")
-                continue
-            
-            startingPolygon = tools.formatGeoJSONPolygonToPostgisPolygon(startingCoordinates, startingGeometryType, geojsonEpsg)
-
-            # Adding coordinates of the centroid of the zone
-            zonesCentroids.append(wkt.loads(startingPolygon).centroid)
-            
-            
-            # creating OD matrix of count of trips between each points
-            for j in range(nbFeatures):
-                endingFeature = features[j]
-                endingCoordinates, endingGeometryType = tools.parseFeature(endingFeature)
+        zones = tools.getPolygonsFromFeatures(features, geojsonEpsg)
+    
+    # Counting the trips of every couple of zones in a single query,
+    # or, if concurrency > 1, the trips leaving each chunk of origin zones in parallel
+    def getODCountsOfAllZonesDataframe():
+        conn = databaseTools.connectToDatabase()
+        try:
+            databaseTools.createTemporaryZoneTable(conn, zones, geojsonEpsg)
+            if concurrency <= 1:
+                return getODCountsDataframe(conn, startTime, endTime, ignoreArrivalTime)
             
-                if endingCoordinates is None or endingGeometryType is None:
-                    print(f"Skipped feature (destination {j}) of the list (starting at 0) because no geometry or coordinates were found")
-                    continue
-
-                endingPolygon = tools.formatGeoJSONPolygonToPostgisPolygon(endingCoordinates, endingGeometryType, geojsonEpsg)                    
+            # the facilities are assigned to their zones once, the connections of the chunks read the same table
+            facilityZoneTable = createFacilityZoneTable(conn)
+            try:
+                def getOriginsChunkODCountsDataframe(chunkConn, originZonesIds):
+                    return getODCountsDataframe(chunkConn, startTime, endTime, ignoreArrivalTime, originZonesIds=originZonesIds, facilityZoneTable=facilityZoneTable)
                 
-                if ignoreArrivalTime:
-                    query = query.bindparams(startingPolygon=startingPolygon, endingPolygon=endingPolygon, endTime=endTime)
-                else:
-                    query = query.bindparams(startingPolygon=startingPolygon, endingPolygon=endingPolygon, startTime=startTime, endTime=endTime)
-
-                result = conn.execute(query)
-                
-                finalODMatrix[i][j] = result.fetchone()[0]
- 
-    conn.close()
+                originsChunks = tools.splitInChunks([zoneId for zoneId, polygon in zones], concurrency) or [[]]
+                return pd.concat(databaseTools.runConcurrently(getOriginsChunkODCountsDataframe, originsChunks, concurrency), ignore_index=True)
+            finally:
+                conn.execute(f'DROP TABLE IF EXISTS "{facilityZoneTable}";')
+        finally:
+            conn.close()
+    
+    with profiler.stage('query') as currentStage:
+        if useCache:
+            parameters = {"startTime": startTime, "endTime": endTime, "ignoreArrivalTime": ignoreArrivalTime}
+            odCountsDf = queryCache.getCachedResult("odMatrix", filePath, parameters, getODCountsOfAllZonesDataframe)
+        else:
+            odCountsDf = getODCountsOfAllZonesDataframe()
+        currentStage['rows'] = len(odCountsDf)
+    
+    with profiler.stage('compute'):
+        sparseODMatrix = createODCube(odCountsDf, zones, geojsonEpsg)
     
     if generateArabesqueFiles:
-        locationDf, flowDf = _getArabesqueDataframesFromODMatrix(finalODMatrix, zonesCentroids, geojsonEpsg)
-        _generateArabesqueFiles(config.ARABESQUE_GENERATED_FILES_DIRECTORY_PATH, locationDf, flowDf)
+        sparseODMatrix.toArabesqueFiles(config.ARABESQUE_GENERATED_FILES_DIRECTORY_PATH)
+    
+    if sparse:
+        return sparseODMatrix
+    
+    # init OD matrix, every couple of zones having a geometry has at least 0 trips
+    nbFeatures = len(features)
+    finalODMatrix = [[-1 for x in range(nbFeatures)] for y in range(nbFeatures)]
+    
+    zonesIds = [zoneId for zoneId, polygon in zones]
+    for i in zonesIds:
+        for j in zonesIds:
+            finalODMatrix[i][j] = 0
+    
+    for origin, destination, value in zip(odCountsDf["origin"], odCountsDf["destination"], odCountsDf["value"]):
+        finalODMatrix[origin][destination] = int(value)
     
     return finalODMatrix
 
 
-# return two dataframes from the odMatrix
-# locationDf : contains the centroids of the zones with their latitudes and longitudes
-# flowDf : contains the flows between each zones
-# converts the coordinates to the Arabesque default EPSG
-def _getArabesqueDataframesFromODMatrix(odMatrix, zonesCentroids, geojsonEpsg):
-    locationDict = {
-        "id": [],
-        "lat": [],
-        "lng": []
-    }
-    
-    flowDict = {
-        "origin": [],
-        "destination": [],
-        "value": []
-    }
-    
-    nbZones = len(zonesCentroids)
-    
-    # config for the transformation of the coordinates
-    inEpsg = f'epsg:{geojsonEpsg}'
-    outEpsg = f'epsg:{config.ARABESQUE_DEFAULT_SRID}'
-    inProj = Proj(inEpsg)
-    outProj = Proj(outEpsg)
-    
-    for startZone in range(nbZones):
-        # transform the coordinates
-        x, y = zonesCentroids[startZone].x, zonesCentroids[startZone].y
-        if inEpsg != outEpsg:
-            x, y = transform(inProj, outProj, x, y)
-        
-        locationDict["id"].append(startZone)
-        locationDict["lat"].append(x)
-        locationDict["lng"].append(y)
-        
-        for endZone in range(nbZones):
-            if odMatrix[startZone][endZone] > 0:
-                flowDict["origin"].append(startZone)
-                flowDict["destination"].append(endZone)
-                flowDict["value"].append(odMatrix[startZone][endZone])
+# Returns a dataframe with the number of trips ("value") for each couple of zones ("origin", "destination")
+# The zones must have been uploaded in the temporary zone table of the connection (see databaseTools.createTemporaryZoneTable)
+# Each facility is assigned to its zones once, the trips are then joined to their origin and destination zones
+# Couples of zones without trips are not returned
+#
+# groupBy : dictionary {columnName: sqlExpression} of additional dimensions to count the trips by,
+#           the expressions can use the columns of the trip table through the "t" alias
+# conditions : list of additional sql conditions on the trips, they can use the :startTimeSeconds and :endTimeSeconds parameters (in seconds)
+# originZonesIds : if given, only the trips leaving these zones are counted
+# facilityZoneTable : if given, the zones of the facilities are read from this table (see createFacilityZoneTable)
+#                     instead of being computed in the query from the temporary zone table
+# useAggregates : if true, the trips are counted from the aggregate table of the trips (see converter.importAggregates)
+#                 when it exists, the arrival time is ignored and startTime and endTime are multiples of one hour
+#                 set it to false if groupBy or conditions need a finer time than the hour of departure
+def getODCountsDataframe(conn, startTime='00:00:00', endTime='32:00:00', ignoreArrivalTime=True, groupBy=None, conditions=None, originZonesIds=None, useAggregates=True, facilityZoneTable=None):
+    if groupBy is None:
+        groupBy = {}
+    if conditions is None:
+        conditions = []
+    databaseTools.checkTimesInSeconds(conn, config.DB_TRIPS_TABLE)
     
-    locationDf = pd.DataFrame(locationDict)
-    flowDf = pd.DataFrame(flowDict)
+    # the aggregate table has the same columns as the trip table, dep_time_seconds being the start of the hour of departure
+    tripsTable = config.DB_TRIPS_TABLE
+    tripsCount = "count(*)"
+    if (useAggregates and ignoreArrivalTime
+        and tools.getTimeInSeconds(startTime) % 3600 == 0 and tools.getTimeInSeconds(endTime) % 3600 == 0
+        and databaseTools.tableExists(conn, config.DB_TRIPS_AGGREGATE_TABLE)):
+        tripsTable = config.DB_TRIPS_AGGREGATE_TABLE
+        tripsCount = 'sum(t."tripCount")::bigint'
     
-    return locationDf, flowDf
-
-
-# generate the files for Arabesque
-def _generateArabesqueFiles(filePath, locationDf, flowDf):
-    if filePath[-1] != '/':
-        filePath += '/'
+    additionalColumns = "".join(f', {expression} as "{columnName}"' for columnName, expression in groupBy.items())
+    additionalGroupBy = "".join(f', {expression}' for expression in groupBy.values())
     
-    locationDf.to_csv(filePath + "location.csv", index=False)
-    flowDf.to_csv(filePath + "flow.csv", index=False)
+    if facilityZoneTable is None:
+        facilityZoneQuery = getFacilityZoneQuery()
+    else:
+        facilityZoneQuery = f'SELECT z.facility_id, z.zone_id from "{facilityZoneTable}" z'
     
-    print(f"Arabesque files generated, you can find them in {filePath}")
+    # the origin zones are assigned separately when only some of them are needed
+    if originZonesIds is None:
+        originFacilityZoneQuery = ""
+        originFacilityZoneTable = "facilityZone"
+    else:
+        originZonesIdsList = ", ".join(str(int(zoneId)) for zoneId in originZonesIds) or "NULL"
+        originFacilityZoneQuery = f""", "originFacilityZone" AS (
+                    {facilityZoneQuery}
+                    where z.zone_id IN ({originZonesIdsList})
+                )"""
+        originFacilityZoneTable = "originFacilityZone"
     
-    return 1
\ No newline at end of file
+    query = f"""WITH "facilityZone" AS (
+                    {facilityZoneQuery}
+                ){originFacilityZoneQuery}
+                SELECT origin.zone_id as origin, destination.zone_id as destination{additionalColumns}, {tripsCount} as value
+                from "{tripsTable}" t
+                join "{originFacilityZoneTable}" origin ON t.start_facility_id = origin.facility_id
+                join "facilityZone" destination ON t.end_facility_id = destination.facility_id
+                where t.dep_time_seconds < :endTimeSeconds
+            """
+    
+    if not ignoreArrivalTime:
+        query += """ and (t.dep_time_seconds + t.trav_time_seconds) > :startTimeSeconds
+                    and (t.dep_time_seconds + t.trav_time_seconds) < :endTimeSeconds """
+    
+    for condition in conditions:
+        query += f" and {condition}"
+    
+    query += f" group by origin.zone_id, destination.zone_id{additionalGroupBy}"
+    
+    # both times are always passed, the parameters not used by the query are ignored
+    parameters = {"startTimeSeconds": tools.getTimeInSeconds(startTime), "endTimeSeconds": tools.getTimeInSeconds(endTime)}
+    return pd.read_sql(text(query), conn, params=parameters)
+
+
+# Stores the zones of the facilities (facility_id, zone_id) in a new table, readable by the other connections, returns its name
+# The zones must have been uploaded in the temporary zone table of the connection, the table has to be dropped by the caller
+def createFacilityZoneTable(conn):
+    tableName = f"{config.QUERIES_FACILITY_ZONE_TABLE_NAME}_{uuid.uuid4().hex}"
+    conn.execute(f'CREATE UNLOGGED TABLE "{tableName}" AS {getFacilityZoneQuery()};')
+    conn.execute(f'CREATE INDEX ON "{tableName}" (facility_id);')
+    conn.execute(f'ANALYZE "{tableName}";')
+    return tableName
+
+
+# Query of the zone of each facility (facility_id, zone_id), the zones must have been uploaded in the temporary zone table of the connection
+def getFacilityZoneQuery():
+    return f"""SELECT f.id as facility_id, z.zone_id
+               from "{config.DB_FACILITIES_TABLE}" f
+               join "{config.QUERIES_ZONE_TABLE_NAME}" z ON ST_Contains(z.geom, ST_SetSRID(f."location", {config.getDatabaseSRID()}))"""
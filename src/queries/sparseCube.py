@@ -0,0 +1,216 @@
+from furbain import config
+from furbain import tools
+import numpy as np
+import pandas as pd
+from shapely import wkt
+
+
+# Sparse zone x zone (x bin x breakdowns) count of trips
+# The cube only stores the non-zero cells: for each dimension, "coordinates" holds the index of the cell in the "labels" of the dimension
+# zonesCentroids holds the id and the centroid ("x", "y" in the epsg projection) of every zone, they are used by the exports
+#
+# eg: cube.matrix(bin='08:00:00', main_mode='car') returns the dense zone x zone matrix of car trips departing in the 08:00:00 bin
+#     cube.sel(main_mode=['car', 'pt']).sum(['bin']) returns a zone x zone x main_mode cube of car and pt trips
+class ODCube:
+    def __init__(self, labels, coordinates, values, zonesCentroids=None, epsg=None):
+        self.dimensions = list(labels.keys())
+        self.labels = labels
+        self.coordinates = coordinates
+        self.values = values
+        self.zonesCentroids = zonesCentroids
+        self.epsg = epsg
+
+    @property
+    def shape(self):
+        return tuple(len(self.labels[dimension]) for dimension in self.dimensions)
+
+    @property
+    def nnz(self):
+        return len(self.values)
+
+    # Returns a cube with only the cells matching the selection
+    # selection : {dimension: label or list of labels}, the selected dimensions keep only the selected labels
+    def sel(self, **selection):
+        mask = np.ones(len(self.values), dtype=bool)
+        labels = dict(self.labels)
+        remapping = {}
+
+        for dimension, selectedLabels in selection.items():
+            if dimension not in self.labels:
+                raise Exception(f'The dimension "{dimension}" does not exist, the dimensions are {self.dimensions}')
+
+            if np.ndim(selectedLabels) == 0:
+                selectedLabels = [selectedLabels]
+
+            selectedIndexes = np.array([self._getLabelIndex(dimension, label) for label in selectedLabels], dtype=np.int64)
+
+            # new position of each selected label in the dimension
+            newPositions = np.full(len(self.labels[dimension]), -1, dtype=np.int64)
+            newPositions[selectedIndexes] = np.arange(len(selectedIndexes))
+
+            mask &= newPositions[self.coordinates[dimension]] >= 0
+            labels[dimension] = self.labels[dimension][selectedIndexes]
+            remapping[dimension] = newPositions
+
+        coordinates = {}
+        for dimension in self.dimensions:
+            coordinates[dimension] = self.coordinates[dimension][mask]
+            if dimension in remapping:
+                coordinates[dimension] = remapping[dimension][coordinates[dimension]]
+
+        return ODCube(labels, coordinates, self.values[mask], self.zonesCentroids, self.epsg)
+
+    # Returns a cube without the given dimensions, the counts are summed over them
+    def sum(self, dimensions):
+        keptDimensions = [dimension for dimension in self.dimensions if dimension not in dimensions]
+        labels = {dimension: self.labels[dimension] for dimension in keptDimensions}
+
+        if len(self.values) == 0:
+            coordinates = {dimension: np.array([], dtype=np.int64) for dimension in keptDimensions}
+            return ODCube(labels, coordinates, np.array([], dtype=np.int64), self.zonesCentroids, self.epsg)
+
+        keptShape = tuple(len(labels[dimension]) for dimension in keptDimensions)
+        flatIndexes = np.ravel_multi_index([self.coordinates[dimension] for dimension in keptDimensions], keptShape)
+        uniqueFlatIndexes, inverse = np.unique(flatIndexes, return_inverse=True)
+        values = np.bincount(inverse, weights=self.values).astype(np.int64)
+
+        keptCoordinates = np.unravel_index(uniqueFlatIndexes, keptShape)
+        coordinates = {dimension: keptCoordinates[i].astype(np.int64) for i, dimension in enumerate(keptDimensions)}
+
+        return ODCube(labels, coordinates, values, self.zonesCentroids, self.epsg)
+
+    # Returns the dense zone x zone matrix (numpy array) of the selected cells, summed over the other dimensions
+    def matrix(self, **selection):
+        cube = self.sel(**selection) if selection else self
+        cube = cube.sum([dimension for dimension in cube.dimensions if dimension not in ["origin", "destination"]])
+        return cube.toDense()
+
+    # Returns the dense numpy array of the cube
+    def toDense(self):
+        dense = np.zeros(self.shape, dtype=np.int64)
+        np.add.at(dense, tuple(self.coordinates[dimension] for dimension in self.dimensions), self.values)
+        return dense
+
+    # Returns a dataframe with one row per non-zero cell, with the labels of each dimension and the count of trips ("value")
+    def toDataframe(self):
+        cubeDict = {dimension: self.labels[dimension][self.coordinates[dimension]] for dimension in self.dimensions}
+        cubeDict["value"] = self.values
+        return pd.DataFrame(cubeDict)
+
+    # Returns the two dataframes used by Arabesque, the flows are summed over every dimension other than origin and destination
+    # locationDf : contains the centroids of the zones with their latitudes and longitudes (converted to the Arabesque default EPSG)
+    # flowDf : contains the flows between each zones
+    def toArabesqueDataframes(self):
+        if self.zonesCentroids is None:
+            raise Exception('The cube has no zones centroids, it can not be exported to Arabesque')
+
+        lat, lng = tools.transformCoordinates(self.zonesCentroids["x"], self.zonesCentroids["y"], self.epsg, config.ARABESQUE_DEFAULT_SRID)
+        locationDf = pd.DataFrame({
+            "id": self.zonesCentroids["id"],
+            "lat": lat,
+            "lng": lng
+        })
+
+        flows = self.sum([dimension for dimension in self.dimensions if dimension not in ["origin", "destination"]])
+        origins = flows.labels["origin"][flows.coordinates["origin"]]
+        destinations = flows.labels["destination"][flows.coordinates["destination"]]
+        order = np.lexsort((destinations, origins))
+        flowDf = pd.DataFrame({
+            "origin": origins[order],
+            "destination": destinations[order],
+            "value": flows.values[order]
+        })
+
+        return locationDf, flowDf
+
+    # generate the files for Arabesque (location.csv and flow.csv) in the given directory
+    def toArabesqueFiles(self, directoryPath=config.ARABESQUE_GENERATED_FILES_DIRECTORY_PATH):
+        if directoryPath[-1] != '/':
+            directoryPath += '/'
+
+        locationDf, flowDf = self.toArabesqueDataframes()
+        locationDf.to_csv(directoryPath + "location.csv", index=False)
+        flowDf.to_csv(directoryPath + "flow.csv", index=False)
+
+        print(f"Arabesque files generated, you can find them in {directoryPath}")
+
+    # Save the cube in a compressed numpy file (.npz), one array per dimension labels and coordinates
+    def save(self, filePath):
+        arrays = {
+            "dimensions": np.array(self.dimensions, dtype=str),
+            "values": self.values,
+        }
+        for dimension in self.dimensions:
+            arrays[f"labels_{dimension}"] = _toSerializableArray(self.labels[dimension])
+            arrays[f"coordinates_{dimension}"] = self.coordinates[dimension]
+
+        if self.zonesCentroids is not None:
+            for key, array in self.zonesCentroids.items():
+                arrays[f"zonesCentroids_{key}"] = array
+            arrays["epsg"] = np.array(str(self.epsg))
+
+        np.savez_compressed(filePath, **arrays)
+
+    # Load a cube saved with ODCube.save
+    @staticmethod
+    def load(filePath):
+        with np.load(filePath) as arrays:
+            dimensions = [str(dimension) for dimension in arrays["dimensions"]]
+            labels = {dimension: arrays[f"labels_{dimension}"] for dimension in dimensions}
+            coordinates = {dimension: arrays[f"coordinates_{dimension}"] for dimension in dimensions}
+
+            zonesCentroids = None
+            epsg = None
+            if "epsg" in arrays:
+                zonesCentroids = {key: arrays[f"zonesCentroids_{key}"] for key in ["id", "x", "y"]}
+                epsg = str(arrays["epsg"])
+
+            return ODCube(labels, coordinates, arrays["values"], zonesCentroids, epsg)
+
+    def _getLabelIndex(self, dimension, label):
+        indexes = np.flatnonzero(self.labels[dimension] == label)
+        if len(indexes) == 0:
+            raise Exception(f'The label "{label}" does not exist in the dimension "{dimension}"')
+        return indexes[0]
+
+
+# Returns an ODCube from a dataframe returned by getODCountsDataframe
+# zones : list of (zoneId, polygon) uploaded for the query, the centroids of the polygons are kept for the exports
+# indexedDimensions : {dimension: labels} of the additional columns already holding the index of their label (eg: the time bins)
+# labelledDimensions : list of the additional columns holding labels (eg: the modes), the labels are sorted
+def createODCube(odCountsDf, zones, geojsonEpsg, indexedDimensions=None, labelledDimensions=None):
+    if indexedDimensions is None:
+        indexedDimensions = {}
+    if labelledDimensions is None:
+        labelledDimensions = []
+
+    zonesIds = np.array([zoneId for zoneId, polygon in zones], dtype=np.int64)
+    zonesCentroidsPoints = [wkt.loads(polygon).centroid for zoneId, polygon in zones]
+    zonesCentroids = {
+        "id": zonesIds,
+        "x": np.array([point.x for point in zonesCentroidsPoints], dtype=np.float64),
+        "y": np.array([point.y for point in zonesCentroidsPoints], dtype=np.float64)
+    }
+
+    labels = {"origin": zonesIds, "destination": zonesIds}
+    coordinates = {
+        "origin": np.searchsorted(zonesIds, odCountsDf["origin"].to_numpy(dtype=np.int64)),
+        "destination": np.searchsorted(zonesIds, odCountsDf["destination"].to_numpy(dtype=np.int64))
+    }
+
+    for dimension, dimensionLabels in indexedDimensions.items():
+        labels[dimension] = np.asarray(dimensionLabels)
+        coordinates[dimension] = odCountsDf[dimension].to_numpy(dtype=np.int64)
+
+    for dimension in labelledDimensions:
+        values = odCountsDf[dimension].fillna(config.OD_CUBE_UNKNOWN_LABEL).astype(str).to_numpy()
+        labels[dimension], coordinates[dimension] = np.unique(values, return_inverse=True)
+
+    return ODCube(labels, coordinates, odCountsDf["value"].to_numpy(dtype=np.int64), zonesCentroids, geojsonEpsg)
+
+
+# object arrays can not be saved without pickle, the labels are saved as strings
+def _toSerializableArray(array):
+    if array.dtype == object:
+        return array.astype(str)
+    return array
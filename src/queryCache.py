@@ -0,0 +1,87 @@
+from furbain import config
+from furbain import databaseTools
+from furbain import parquetCache
+import pandas as pd
+import hashlib
+import shutil
+
+
+# Returns the result of a query from the cache, or computes it with computeResult() and stores it in the cache
+# the result is identified by queryName, the parameters (dictionary) of the query, the content of the zone file (filePath)
+# and the data version of the database, which is its import manifest (see databaseTools.recordTableImport)
+# Importing a table again changes the data version, the results of the previous versions of the database are deleted
+# The results are dataframes, lists of dataframes or dictionaries of dataframes, stored as parquet files
+#       the least recently used results are deleted when the cache is bigger than config.QUERY_CACHE_MAX_SIZE_IN_MB
+# If the database has no import manifest, the results can't be invalidated and the cache is not used
+def getCachedResult(queryName, filePath, parameters, computeResult):
+    conn = databaseTools.connectToDatabase()
+    manifest = databaseTools.getImportManifest(conn)
+    conn.close()
+
+    if manifest is None:
+        print("WARNING : The database has no import manifest, the result is not cached (the manifest is created when a table is imported)")
+        return computeResult()
+
+    databaseId = parquetCache.getHash([config.getDatabaseHost(), config.getDatabasePort(), config.DB_DBNAME])
+    dataVersion = parquetCache.getHash(manifest)
+    key = parquetCache.getHash([queryName, _getFileHash(filePath), parameters, databaseId, dataVersion])
+    entryPath = config.QUERY_CACHE_DIRECTORY_PATH / key
+
+    result = _readResult(entryPath)
+    if result is not None:
+        return result
+
+    result = computeResult()
+    try:
+        _writeResult(entryPath, result, databaseId, dataVersion)
+    except Exception as e:
+        # eg: a column with values of a type parquet can't store, the query is run again next time
+        print(f"WARNING : The result of {queryName} can't be stored in the query cache ({e})")
+        return result
+
+    # the results of the previous versions of the database are deleted
+    parquetCache.evictEntries(config.QUERY_CACHE_DIRECTORY_PATH, config.QUERY_CACHE_MAX_SIZE_IN_MB,
+                              lambda entryPath, entry: entry["databaseId"] == databaseId and entry["dataVersion"] != dataVersion)
+    return result
+
+
+# Deletes every result of the cache
+def clearCache():
+    shutil.rmtree(config.QUERY_CACHE_DIRECTORY_PATH, ignore_errors=True)
+
+
+def _getFileHash(filePath):
+    fileHash = hashlib.sha256()
+    with open(filePath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            fileHash.update(block)
+    return fileHash.hexdigest()
+
+
+# Returns the result stored in the entry, or None if the entry doesn't exist or can't be read
+def _readResult(entryPath):
+    storedEntry = parquetCache.readEntry(entryPath)
+    if storedEntry is None:
+        return None
+
+    entry, dataframes = storedEntry
+    if entry["type"] == "dataframe":
+        return dataframes[0]
+    elif entry["type"] == "list":
+        return dataframes
+    else:
+        return dict(zip(entry["keys"], dataframes))
+
+
+# Stores the result (a dataframe, a list or a dictionary of dataframes) in the entry
+def _writeResult(entryPath, result, databaseId, dataVersion):
+    if isinstance(result, pd.DataFrame):
+        resultType, dataframes = "dataframe", {None: result}
+    elif isinstance(result, list):
+        resultType, dataframes = "list", dict(enumerate(result))
+    elif isinstance(result, dict):
+        resultType, dataframes = "dict", result
+    else:
+        raise Exception(f'The result of type "{type(result).__name__}" can\'t be cached')
+
+    parquetCache.writeEntry(entryPath, dataframes, {"type": resultType, "databaseId": databaseId, "dataVersion": dataVersion})
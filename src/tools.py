@@ -1,4 +1,5 @@
 from furbain import config
+from functools import lru_cache
 
 
 # Converts hh:mm:ss time to x days x hours x minutes x seconds
@@ -99,6 +100,13 @@ def chunker(seq, size):
     # from http://stackoverflow.com/a/434328
     return (seq[pos:pos + size] for pos in range(0, len(seq), size))
 
+
+# splits the sequence in nbChunks chunks of (almost) the same size, keeping the order of the elements
+# empty chunks are not returned
+def splitInChunks(seq, nbChunks):
+    chunkSize = max(1, -(-len(seq) // max(1, nbChunks)))
+    return list(chunker(seq, chunkSize))
+
 # returns the coordinates and geometry type of the geojson feature
 def parseFeature(feature):
     coordinates = None
@@ -114,4 +122,37 @@ def parseFeature(feature):
             geometryType = geometry["type"]
     
     
-    return coordinates, geometryType
\ No newline at end of file
+    return coordinates, geometryType
+
+# returns a list of (featureIndex, polygon) for every feature of the geojson having a geometry
+# the polygon is formatted for postgis, features without geometry or coordinates are skipped
+def getPolygonsFromFeatures(features, geojsonEpsg):
+    polygons = []
+    
+    for i, feature in enumerate(features):
+        coordinates, geometryType = parseFeature(feature)
+        
+        if coordinates is None or geometryType is None:
+            print(f"Skipped feature {i} of the list (starting at 0) because no geometry or coordinates were found")
+            continue
+        
+        polygons.append((i, formatGeoJSONPolygonToPostgisPolygon(coordinates, geometryType, geojsonEpsg)))
+    
+    return polygons
+
+
+
+# returns the transformer from inEpsg to outEpsg, transformers are cached as creating them is slow
+@lru_cache(maxsize=None)
+def getCoordinatesTransformer(inEpsg, outEpsg):
+    # imported here, so the functions on times do not load pyproj
+    from pyproj import Transformer
+    return Transformer.from_crs(f'epsg:{inEpsg}', f'epsg:{outEpsg}')
+
+
+# transforms arrays of coordinates from inEpsg to outEpsg in one call
+# the axis order of the EPSGs is kept (eg: epsg:4326 returns latitudes then longitudes)
+def transformCoordinates(xs, ys, inEpsg, outEpsg):
+    if str(inEpsg) == str(outEpsg):
+        return xs, ys
+    return getCoordinatesTransformer(str(inEpsg), str(outEpsg)).transform(xs, ys)
\ No newline at end of file
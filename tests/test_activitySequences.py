@@ -0,0 +1,251 @@
+from furbain import tools
+from furbain.queries.activitySequences import _createTableInDatabaseWithSQLEngine, _getActivitiesArrays, _getActivitySequencesOfAgentsRange, _getActivitySequencesTableDataframe, _partitionActivitiesBySequence
+from sqlalchemy.sql import text
+import collections
+import numpy as np
+import pandas as pd
+import pytest
+
+
+START_TIME_IN_SECONDS = 0
+END_TIME_IN_SECONDS = 32 * 3600
+
+
+# Activities of nbAgents agents, with the rows and the order of the activities query of activitySequences (one zone, ordered by start time then id)
+# each agent has an activity without start time (its first activity), the last activity of most agents has no end time,
+# some agents have two activities with the same time spent in an interval, and long activities leave intervals without activity
+def generateActivities(nbAgents, seed):
+    rng = np.random.default_rng(seed)
+    rows = []
+    activityId = 0
+    for personId in range(nbAgents):
+        time = int(rng.integers(0, 10 * 3600))
+        rows.append((personId, activityId, None, time))
+        activityId += 1
+
+        for activityIndex in range(int(rng.integers(0, 8))):
+            time += int(rng.choice([0, 60, 600, 1800, 3 * 3600]))
+            duration = int(rng.choice([0, 300, 600, 900, 2700, 4 * 3600]))
+            if rng.random() < 0.3:
+                # two activities of the same duration in the same interval
+                rows.append((personId, activityId, time, time + duration))
+                activityId += 1
+            rows.append((personId, activityId, time, time + duration))
+            activityId += 1
+            time += duration
+
+        if rng.random() < 0.8:
+            rows.append((personId, activityId, time + int(rng.integers(0, 3600)), None))
+            activityId += 1
+
+    activitiesDf = pd.DataFrame(rows, columns=["personId", "id", "start_time_seconds", "end_time_seconds"]).astype({"start_time_seconds": "Int64", "end_time_seconds": "Int64"})
+    activitiesDf.insert(0, "zoneId", 0)
+    # activities during the timespan, the time spent in the timespan is their overlap with it
+    activitiesDf = activitiesDf[(activitiesDf["start_time_seconds"].between(START_TIME_IN_SECONDS, END_TIME_IN_SECONDS) | activitiesDf["start_time_seconds"].isna())
+                                & (activitiesDf["end_time_seconds"].between(START_TIME_IN_SECONDS, END_TIME_IN_SECONDS) | activitiesDf["end_time_seconds"].isna())]
+    activitiesDf["time_spent_in_interval_seconds"] = (activitiesDf["end_time_seconds"].fillna(END_TIME_IN_SECONDS).clip(upper=END_TIME_IN_SECONDS)
+                                                      - activitiesDf["start_time_seconds"].fillna(START_TIME_IN_SECONDS).clip(lower=START_TIME_IN_SECONDS))
+    return activitiesDf.sort_values(["start_time_seconds", "id"], na_position="last").reset_index(drop=True)
+
+
+def getActivitySequences(activitiesDf, intervalInSeconds, sequencesDf=None, startTimeInSeconds=START_TIME_IN_SECONDS, endTimeInSeconds=END_TIME_IN_SECONDS):
+    if sequencesDf is None:
+        sequencesDf = pd.DataFrame({"zoneId": 0, "personId": np.sort(activitiesDf["personId"].unique())})
+    activities = _partitionActivitiesBySequence(_getActivitiesArrays(activitiesDf), sequencesDf)
+    activitySequencesDict = _getActivitySequencesOfAgentsRange(activities, 0, len(sequencesDf), startTimeInSeconds, endTimeInSeconds, intervalInSeconds)
+    return pd.DataFrame(activitySequencesDict)
+
+
+# Activity sequences computed agent by agent by the first implementation of activitySequences, with the times as intervals
+def getReferenceActivitySequences(activitiesDf, intervalInSeconds):
+    referenceActivitiesDf = activitiesDf.rename(columns={"start_time_seconds": "start_time", "end_time_seconds": "end_time", "time_spent_in_interval_seconds": "activity_time_spent_in_interval"})
+    for column in ["start_time", "end_time", "activity_time_spent_in_interval"]:
+        referenceActivitiesDf[column] = pd.to_timedelta(referenceActivitiesDf[column].astype("float64"), unit="s")
+
+    timeList = [x for x in range(0, END_TIME_IN_SECONDS, intervalInSeconds)] + [END_TIME_IN_SECONDS]
+    timeDict = dict(zip(timeList, [tools.getFormattedTime(x) for x in timeList]))
+    activitySequencesDict = collections.defaultdict(list)
+    for personId in np.sort(activitiesDf["personId"].unique()):
+        agentActivitySequencesDict = _getReferenceActivitySequencesOfAgent(referenceActivitiesDf, personId, START_TIME_IN_SECONDS, END_TIME_IN_SECONDS,
+                                                                           intervalInSeconds, tools.getFormattedTime(intervalInSeconds), timeDict)
+        for key, value in agentActivitySequencesDict.items():
+            activitySequencesDict[key].extend(value)
+    return pd.DataFrame(activitySequencesDict)
+
+
+# _getActivitySequencesOfAgentInZoneInTimespan before the vectorized engine
+def _getReferenceActivitySequencesOfAgent(allActivitiesDf, currentpersonId, firstStartTimeInSeconds, endTimeInSeconds, intervalInSeconds, formattedInterval, timeDict):
+    agentActivitiesDf = allActivitiesDf[allActivitiesDf["personId"] == currentpersonId]
+    agentActivitySequencesDict = collections.defaultdict(list)
+    currentStartTimeInSeconds = firstStartTimeInSeconds
+
+    currentAgentPreviousEndActivityId = None
+    currentAgentPreviousEndActivityEndTime = None
+    alreadyAddedNullStartActivity = False
+
+    nullStartTimeActivities = agentActivitiesDf[agentActivitiesDf["start_time"].isnull()]
+
+    while currentStartTimeInSeconds < endTimeInSeconds:
+        currentEndTimeInSeconds = currentStartTimeInSeconds + intervalInSeconds
+        currentStartTimeFormatted = timeDict[currentStartTimeInSeconds]
+        currentEndTimeFormatted = timeDict[currentEndTimeInSeconds]
+
+        currentAgentStartActivityId = None
+        currentAgentEndActivityId = None
+        currentAgentEndActivityEndTime = None
+        currentAgentMainActivityId = None
+        currentAgentMainActivityStartTime = None
+        currentAgentMainActivityEndTime = None
+        currentAgentTimeSpentInMainActivity = None
+
+        if currentAgentPreviousEndActivityEndTime is not None:
+            if type(currentAgentPreviousEndActivityEndTime) is str:
+                currentAgentPreviousEndActivityEndTimeInSeconds = tools.getTimeInSeconds(currentAgentPreviousEndActivityEndTime)
+            elif type(currentAgentPreviousEndActivityEndTime) is pd._libs.tslibs.timedeltas.Timedelta:
+                currentAgentPreviousEndActivityEndTimeInSeconds = int(currentAgentPreviousEndActivityEndTime.total_seconds())
+        else:
+            currentAgentPreviousEndActivityEndTimeInSeconds = -1
+
+        activitiesDf = agentActivitiesDf[(agentActivitiesDf["start_time"] >= currentStartTimeFormatted) & (agentActivitiesDf["start_time"] < currentEndTimeFormatted)]
+
+        if activitiesDf.empty:
+            if currentAgentPreviousEndActivityEndTimeInSeconds >= currentStartTimeInSeconds or type(currentAgentPreviousEndActivityEndTime) is pd._libs.tslibs.nattype.NaTType:
+                currentAgentStartActivityId = currentAgentPreviousEndActivityId
+                currentAgentMainActivityId = currentAgentPreviousEndActivityId
+                currentAgentMainActivityStartTime = currentAgentPreviousMainActivityStartTime
+                currentAgentMainActivityEndTime = currentAgentPreviousEndActivityEndTime
+
+                if currentAgentPreviousEndActivityEndTimeInSeconds >= currentEndTimeInSeconds or type(currentAgentPreviousEndActivityEndTime) is pd._libs.tslibs.nattype.NaTType:
+                    currentAgentTimeSpentInMainActivity = formattedInterval
+                    currentAgentEndActivityId = currentAgentPreviousEndActivityId
+                    currentAgentEndActivityEndTime = currentAgentPreviousEndActivityEndTime
+                else:
+                    currentAgentTimeSpentInMainActivity = tools.getFormattedTime(currentAgentPreviousEndActivityEndTimeInSeconds - currentStartTimeInSeconds)
+            elif not nullStartTimeActivities.empty and not alreadyAddedNullStartActivity:
+                currentAgentMainActivityId = nullStartTimeActivities.iloc[0]["id"]
+                currentAgentMainActivityStartTime = nullStartTimeActivities.iloc[0]["start_time"]
+                currentAgentMainActivityEndTime = nullStartTimeActivities.iloc[0]["end_time"]
+                currentAgentTimeSpentInMainActivity = tools.getFormattedTime(intervalInSeconds)
+                currentAgentEndActivityId = currentAgentMainActivityId
+                currentAgentEndActivityEndTime = currentAgentMainActivityEndTime
+                currentAgentStartActivityId = currentAgentMainActivityId
+                alreadyAddedNullStartActivity = True
+        else:
+            mostTimeSpentActivity = activitiesDf[activitiesDf["activity_time_spent_in_interval"] == activitiesDf["activity_time_spent_in_interval"].max()]
+
+            currentAgentMainActivityId = mostTimeSpentActivity["id"].iloc[0]
+            currentAgentMainActivityStartTime = mostTimeSpentActivity["start_time"].iloc[0]
+            currentAgentMainActivityEndTime = mostTimeSpentActivity["end_time"].iloc[0]
+            currentAgentStartActivityId = activitiesDf["id"].iloc[0]
+            currentAgentEndActivityId = activitiesDf["id"].iloc[-1]
+            currentAgentEndActivityEndTime = activitiesDf["end_time"].iloc[-1]
+
+            if currentAgentMainActivityEndTime.total_seconds() >= currentEndTimeInSeconds or type(currentAgentMainActivityEndTime) is pd._libs.tslibs.nattype.NaTType:
+                currentAgentTimeSpentInMainActivity = tools.getFormattedTime(currentEndTimeInSeconds - currentAgentMainActivityStartTime.total_seconds())
+            else:
+                currentAgentTimeSpentInMainActivity = tools.getFormattedTime(currentAgentMainActivityEndTime.total_seconds() - currentAgentMainActivityStartTime.total_seconds())
+
+        if type(currentAgentMainActivityStartTime) == pd._libs.tslibs.timedeltas.Timedelta:
+            currentAgentMainActivityStartTime = tools.getFormattedTime(currentAgentMainActivityStartTime.total_seconds())
+        if type(currentAgentMainActivityEndTime) == pd._libs.tslibs.timedeltas.Timedelta:
+            currentAgentMainActivityEndTime = tools.getFormattedTime(currentAgentMainActivityEndTime.total_seconds())
+
+        if type(currentAgentMainActivityStartTime) == pd._libs.tslibs.nattype.NaTType:
+            currentAgentMainActivityStartTime = None
+        if type(currentAgentMainActivityEndTime) == pd._libs.tslibs.nattype.NaTType:
+            currentAgentMainActivityEndTime = None
+
+        agentActivitySequencesDict["personId"].append(currentpersonId)
+        agentActivitySequencesDict["periodStart"].append(currentStartTimeFormatted)
+        agentActivitySequencesDict["periodEnd"].append(currentEndTimeFormatted)
+        agentActivitySequencesDict["mainActivityId"].append(currentAgentMainActivityId)
+        agentActivitySequencesDict["startActivityId"].append(currentAgentStartActivityId)
+        agentActivitySequencesDict["endActivityId"].append(currentAgentEndActivityId)
+        agentActivitySequencesDict["mainActivityStartTime"].append(currentAgentMainActivityStartTime)
+        agentActivitySequencesDict["mainActivityEndTime"].append(currentAgentMainActivityEndTime)
+        agentActivitySequencesDict["timeSpentInMainActivity"].append(currentAgentTimeSpentInMainActivity)
+
+        currentAgentPreviousMainActivityStartTime = currentAgentMainActivityStartTime
+        currentAgentPreviousEndActivityId = currentAgentEndActivityId
+        currentAgentPreviousEndActivityEndTime = currentAgentEndActivityEndTime
+
+        currentStartTimeInSeconds += intervalInSeconds
+
+    return agentActivitySequencesDict
+
+
+def assertSameActivitySequences(activitySequencesDf, referenceDf):
+    for column in ["mainActivityId", "startActivityId", "endActivityId"]:
+        activitySequencesDf[column] = activitySequencesDf[column].astype("Int64")
+        referenceDf[column] = referenceDf[column].astype("Int64")
+    pd.testing.assert_frame_equal(activitySequencesDf, referenceDf, check_dtype=False)
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('interval', [15, 60])
+def testVectorizedEngineMatchesReference(seed, interval):
+    activitiesDf = generateActivities(40, seed)
+
+    activitySequencesDf = getActivitySequences(activitiesDf, interval * 60).drop(columns=["zoneId"])
+    referenceDf = getReferenceActivitySequences(activitiesDf, interval * 60)
+
+    assert len(activitySequencesDf) == 40 * END_TIME_IN_SECONDS // (interval * 60)
+    assertSameActivitySequences(activitySequencesDf, referenceDf)
+
+
+def testVectorizedEngineCases():
+    # 0 : activity without start time until 02:00, nothing until 03:00, then two activities of 30 minutes in the same hour (tie), the first is the main one
+    # 1 : only an activity without start time nor end time
+    # 2 : activity from 01:10 to 05:20 carried in the next intervals, then no activity
+    activitiesDf = pd.DataFrame([(0, 0, None, 7200), (0, 1, 10800, 12600), (0, 2, 12600, 14400),
+                                 (1, 3, None, None),
+                                 (2, 4, 4200, 19200)],
+                                columns=["personId", "id", "start_time_seconds", "end_time_seconds"]).astype({"start_time_seconds": "Int64", "end_time_seconds": "Int64"})
+    activitiesDf.insert(0, "zoneId", 0)
+    activitiesDf["time_spent_in_interval_seconds"] = activitiesDf["end_time_seconds"].fillna(END_TIME_IN_SECONDS) - activitiesDf["start_time_seconds"].fillna(START_TIME_IN_SECONDS)
+    activitiesDf = activitiesDf.sort_values(["start_time_seconds", "id"], na_position="last").reset_index(drop=True)
+
+    activitySequencesDf = getActivitySequences(activitiesDf, 3600).drop(columns=["zoneId"])
+    referenceDf = getReferenceActivitySequences(activitiesDf, 3600)
+
+    assertSameActivitySequences(activitySequencesDf, referenceDf)
+    mainActivitiesIds = activitySequencesDf.groupby("personId")["mainActivityId"].apply(lambda ids: ids.fillna(-1).tolist())
+    assert mainActivitiesIds[0][:7] == [0, 0, 0, 1, 2, -1, -1]
+    assert mainActivitiesIds[1] == [3] * 32
+    assert mainActivitiesIds[2][:7] == [-1, 4, 4, 4, 4, 4, -1]
+    # the periods without activity
+    assert activitySequencesDf["mainActivityId"].isna().sum() == (32 - 5) + (32 - 5)
+
+
+# The queries of activitySequences on a table "act" holding the zone of the activities, instead of the zones of a geojson file
+AGENTS_QUERY = 'SELECT distinct "zoneId", "personId" from act order by "zoneId", "personId"'
+ACTIVITIES_QUERY = """SELECT "zoneId", id, "personId", start_time_seconds, end_time_seconds,
+                             LEAST(coalesce(end_time_seconds, :endTimeSeconds), :endTimeSeconds)
+                             - GREATEST(coalesce(start_time_seconds, :startTimeSeconds), :startTimeSeconds) as time_spent_in_interval_seconds
+                      from act
+                      where (start_time_seconds between :startTimeSeconds and :endTimeSeconds or start_time_seconds is null)
+                      and (end_time_seconds between :startTimeSeconds and :endTimeSeconds or end_time_seconds is null)
+                   """
+
+
+@pytest.mark.parametrize('startTime, endTime, interval', [('00:00:00', '32:00:00', 15), ('06:00:00', '10:00:00', 60)])
+def testSQLEngineMatchesPythonEngine(database, startTime, endTime, interval):
+    # the agents have activities in one of three zones, some of them also in a fourth zone (eg: overlapping zones)
+    activitiesDf = generateActivities(40, 0)[["zoneId", "id", "personId", "start_time_seconds", "end_time_seconds"]]
+    activitiesDf["zoneId"] = activitiesDf["personId"] % 3
+    activitiesDf = pd.concat([activitiesDf, activitiesDf[activitiesDf["personId"] % 5 == 0].assign(zoneId=3)])
+    activitiesDf.to_sql("act", database, index=False)
+    firstStartTimeInSeconds = tools.getTimeInSeconds(startTime)
+    endTimeInSeconds = tools.getTimeInSeconds(endTime)
+    intervalInSeconds = interval * 60
+    nbPeriods = len(range(firstStartTimeInSeconds, endTimeInSeconds, intervalInSeconds))
+
+    sequencesDf = pd.read_sql(text(AGENTS_QUERY), database)
+    pythonActivitiesDf = pd.read_sql(text(ACTIVITIES_QUERY + "order by start_time_seconds asc, id asc").bindparams(startTimeSeconds=firstStartTimeInSeconds, endTimeSeconds=endTimeInSeconds), database)
+    pythonDf = getActivitySequences(pythonActivitiesDf, intervalInSeconds, sequencesDf, firstStartTimeInSeconds, endTimeInSeconds)
+
+    tableName = _createTableInDatabaseWithSQLEngine(database, AGENTS_QUERY, ACTIVITIES_QUERY, firstStartTimeInSeconds, endTimeInSeconds, intervalInSeconds, nbPeriods, temporary=True)
+    sqlDf = _getActivitySequencesTableDataframe(database, tableName).reset_index(drop=True)
+
+    assert len(sqlDf) == len(sequencesDf) * nbPeriods
+    assertSameActivitySequences(sqlDf, pythonDf)
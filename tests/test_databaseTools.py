@@ -0,0 +1,168 @@
+from furbain import config, databaseTools
+import pandas as pd
+import pytest
+
+
+def createTables(conn, partitioning=None):
+    partitionByClause = databaseTools.getPartitionByClause(partitioning, timeColumn='dep_time_seconds')
+    primaryKey = '(id, dep_time_seconds)' if partitioning == 'time' else '(id)'
+    conn.execute('CREATE TABLE person (id integer PRIMARY KEY);')
+    conn.execute(f"""CREATE TABLE trip (id integer NOT NULL, "personId" integer NOT NULL REFERENCES person (id), dep_time_seconds integer NOT NULL,
+                                        CONSTRAINT "tripTimeCheck" CHECK (dep_time_seconds >= 0), PRIMARY KEY {primaryKey}) {partitionByClause};""")
+    conn.execute('CREATE INDEX "tripPersonIndex" ON trip ("personId");')
+    databaseTools.createPartitions(conn, 'trip', partitioning, pd.Series([0]))
+    conn.execute('CREATE TABLE "tripNote" (id integer PRIMARY KEY, "tripId" integer, "tripTime" integer, FOREIGN KEY ("tripId", "tripTime") REFERENCES trip (id, dep_time_seconds));'
+                 if partitioning == 'time' else
+                 'CREATE TABLE "tripNote" (id integer PRIMARY KEY, "tripId" integer REFERENCES trip (id));')
+    conn.execute(f"INSERT INTO person SELECT generate_series(0, 9);")
+
+
+def getTrips(ids, personId=0):
+    return pd.DataFrame({'id': ids, 'personId': personId, 'dep_time_seconds': [id * 3600 for id in ids]})
+
+
+# names of the relations and indexes of the trip tables, names and definitions of the constraints
+# the constraints of the partitions (eg: the foreign keys referencing each partition) are created with their partitions, they are not returned
+def getSchema(conn):
+    relations = conn.execute("""SELECT relname, relkind FROM pg_class
+                                WHERE relnamespace = 'public'::regnamespace and relkind in ('r', 'p', 'i', 'I') and relname like 'trip%%'
+                                ORDER BY relname""").fetchall()
+    constraints = conn.execute("""SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid) FROM pg_constraint
+                                  WHERE connamespace = 'public'::regnamespace and conparentid = 0 and conislocal
+                                  ORDER BY 1, 2""").fetchall()
+    return relations, constraints
+
+
+def getTableOid(conn, tableName):
+    return conn.execute(f"SELECT '\"{tableName}\"'::regclass::oid").scalar()
+
+
+def getTripsIds(conn):
+    return conn.execute('SELECT coalesce(array_agg(id ORDER BY id), ARRAY[]::integer[]) FROM trip').scalar()
+
+
+def getStagingTablesCount(conn):
+    return conn.execute("SELECT count(*) FROM pg_class WHERE relname like '%%staging%%'").scalar()
+
+
+def assertForeignKeysChecked(conn, partitioning):
+    with pytest.raises(Exception):
+        conn.execute('INSERT INTO "tripNote" VALUES (1, 100, 100000);' if partitioning else 'INSERT INTO "tripNote" VALUES (1, 100);')
+    with pytest.raises(Exception):
+        conn.execute('INSERT INTO trip VALUES (100, 100, 0);')
+
+
+# the relations of the new partitions are named after them, like the partitions created by createPartitions
+def assertSameSchema(conn, schema, newTrips, partitioning):
+    relations, constraints = schema
+    newRelations, newConstraints = getSchema(conn)
+    assert newConstraints == constraints
+    if partitioning is None:
+        assert newRelations == relations
+    else:
+        newPartitionsNames = [f'trip_{start}' for start in sorted(databaseTools.getTimePartitionKeys(newTrips['dep_time_seconds']).unique()) if start != 0]
+        assert newPartitionsNames
+        assert set(relations) <= set(newRelations)
+        assert {name for name, kind in newRelations if kind == 'r'} == {name for name, kind in relations if kind == 'r'} | set(newPartitionsNames)
+        assert all(name.startswith(tuple(newPartitionsNames)) for name, kind in set(newRelations) - set(relations))
+
+
+@pytest.mark.parametrize('partitioning', [None, 'time'])
+def testLoadInEmptyTableKeepsNamesAndForeignKeys(database, monkeypatch, partitioning):
+    monkeypatch.setattr(config, 'LOAD_CHUNK_SIZE', 3)
+    createTables(database, partitioning)
+    schema = getSchema(database)
+
+    # the times of the rows are in new time partitions
+    newTrips = getTrips(range(0, 10))
+    rowsCount = databaseTools.copyDataframesToTableConcurrently([newTrips.iloc[:5], newTrips.iloc[5:]], 'trip', concurrency=2, timeColumn='dep_time_seconds' if partitioning else None)
+
+    assert rowsCount == 10
+    assert getTripsIds(database) == list(range(0, 10))
+    assert getStagingTablesCount(database) == 0
+    assertSameSchema(database, schema, newTrips, partitioning)
+    assertForeignKeysChecked(database, partitioning)
+
+
+@pytest.mark.parametrize('partitioning', [None, 'time'])
+def testAppendKeepsTable(database, monkeypatch, partitioning):
+    monkeypatch.setattr(config, 'LOAD_CHUNK_SIZE', 3)
+    createTables(database, partitioning)
+    databaseTools.copyDataframeToTable(database, getTrips([0, 1]), 'trip')
+    database.execute('INSERT INTO "tripNote" VALUES (0, 1, 3600);' if partitioning else 'INSERT INTO "tripNote" VALUES (0, 1);')
+    database.execute('CREATE VIEW "tripPerson" AS SELECT id, "personId" FROM trip;')
+    database.execute("COMMENT ON TABLE trip IS 'trips of the persons';")
+    tableOid = getTableOid(database, 'trip')
+    schema = getSchema(database)
+
+    newTrips = getTrips(range(2, 12))
+    rowsCount = databaseTools.copyDataframesToTableConcurrently([newTrips], 'trip', concurrency=2, timeColumn='dep_time_seconds' if partitioning else None)
+
+    assert rowsCount == 10
+    assert getTripsIds(database) == list(range(0, 12))
+    assert database.execute('SELECT count(*) FROM "tripPerson"').scalar() == 12
+    # the table is not rebuilt
+    assert getTableOid(database, 'trip') == tableOid
+    assert database.execute("SELECT obj_description('trip'::regclass, 'pg_class')").scalar() == 'trips of the persons'
+    assert getStagingTablesCount(database) == 0
+    assertSameSchema(database, schema, newTrips, partitioning)
+    assertForeignKeysChecked(database, partitioning)
+
+
+@pytest.mark.parametrize('hasRows', [False, True])
+def testRowsAreNotVisibleDuringLoad(database, monkeypatch, hasRows):
+    monkeypatch.setattr(config, 'LOAD_CHUNK_SIZE', 3)
+    createTables(database)
+    tripsIds = [0, 1] if hasRows else []
+    databaseTools.copyDataframeToTable(database, getTrips(tripsIds), 'trip')
+    visibleTripsIds = []
+
+    def getDataframes():
+        yield getTrips(range(2, 6))
+        yield getTrips(range(6, 10))
+        visibleTripsIds.append(getTripsIds(database))
+        yield getTrips(range(10, 14))
+
+    databaseTools.copyDataframesToTableConcurrently(getDataframes(), 'trip', concurrency=2)
+
+    assert visibleTripsIds == [tripsIds]
+    assert getTripsIds(database) == tripsIds + list(range(2, 14))
+
+
+@pytest.mark.parametrize('hasRows', [False, True])
+def testFailedLoadKeepsTable(database, monkeypatch, hasRows):
+    monkeypatch.setattr(config, 'LOAD_CHUNK_SIZE', 3)
+    createTables(database)
+    tripsIds = [0, 1] if hasRows else []
+    databaseTools.copyDataframeToTable(database, getTrips(tripsIds), 'trip')
+    schema = getSchema(database)
+
+    # the last chunk references an unknown person
+    with pytest.raises(Exception):
+        databaseTools.copyDataframesToTableConcurrently([getTrips(range(2, 11)), getTrips([11], personId=100)], 'trip', concurrency=2)
+    # the new rows have the ids of rows of the table
+    with pytest.raises(Exception):
+        databaseTools.copyDataframesToTableConcurrently([getTrips(range(1, 5)), getTrips(range(4, 7))], 'trip', concurrency=2)
+
+    assert getTripsIds(database) == tripsIds
+    assert getSchema(database) == schema
+    assert getStagingTablesCount(database) == 0
+
+
+# the process loading the rows is stopped (eg: killed) after some chunks have been copied, the next load starts again
+def testStoppedLoadKeepsTable(database, monkeypatch):
+    monkeypatch.setattr(config, 'LOAD_CHUNK_SIZE', 3)
+    createTables(database)
+
+    def getDataframes():
+        yield getTrips(range(0, 5))
+        yield getTrips(range(5, 10))
+        raise KeyboardInterrupt()
+
+    with pytest.raises(KeyboardInterrupt):
+        databaseTools.copyDataframesToTableConcurrently(getDataframes(), 'trip', concurrency=2)
+    assert getTripsIds(database) == []
+
+    databaseTools.copyDataframesToTableConcurrently([getTrips(range(0, 10))], 'trip', concurrency=2)
+    assert getTripsIds(database) == list(range(0, 10))
+    assert getStagingTablesCount(database) == 0
@@ -0,0 +1,60 @@
+from furbain import config, databaseTools
+from furbain.converter.aggregates import importLinkTrafficAggregate
+from furbain.queries.hourlyCounts import roadClassTraffic
+import pandas as pd
+import pytest
+
+
+# links of two road classes, traffic by time steps of 30 minutes between 07:00:00 and 10:00:00
+def createTrafficTables(conn, withNetworkLinks=True):
+    if withNetworkLinks:
+        conn.execute(f'CREATE TABLE "{config.DB_NETWORK_TABLE}" (id character varying(40) PRIMARY KEY, osm_way_highway character varying(40));')
+        conn.execute(f"""INSERT INTO "{config.DB_NETWORK_TABLE}" VALUES ('a', 'primary'), ('b', 'primary'), ('c', 'residential');""")
+    conn.execute(f"""CREATE TABLE "{config.DB_EVENTS_TABLE}" ("linkId" character varying(40) NOT NULL, "startTimeSeconds" integer NOT NULL,
+                                                             "endTimeSeconds" integer NOT NULL, "vehicleCount" integer, "meanSpeed" double precision);""")
+    traffic = pd.DataFrame([(linkId, startTime, startTime + 1800, (index + startTime // 1800) % 4, 5.0 + index + startTime / 3600)
+                            for index, linkId in enumerate(['a', 'b', 'c'])
+                            for startTime in range(7 * 3600, 10 * 3600, 1800)],
+                           columns=['linkId', 'startTimeSeconds', 'endTimeSeconds', 'vehicleCount', 'meanSpeed'])
+    databaseTools.copyDataframeToTable(conn, traffic, config.DB_EVENTS_TABLE)
+
+
+@pytest.mark.parametrize('startTime, endTime', [('00:00:00', '32:00:00'), ('08:00:00', '10:00:00')])
+def testRoadClassTrafficFromAggregateIsSameAsFromTraffic(database, startTime, endTime):
+    createTrafficTables(database)
+    importLinkTrafficAggregate()
+    assert databaseTools.tableExists(database, config.DB_LINK_TRAFFIC_AGGREGATE_TABLE)
+
+    aggregateTraffic = roadClassTraffic(startTime, endTime)
+    traffic = roadClassTraffic(startTime, endTime, useAggregates=False)
+
+    pd.testing.assert_frame_equal(aggregateTraffic, traffic)
+    firstHour = int(startTime[:2]) if startTime != '00:00:00' else 7
+    assert sorted(traffic['hour'].unique()) == list(range(firstHour, 10))
+    assert sorted(traffic['osm_way_highway'].unique()) == ['primary', 'residential']
+
+
+# the time steps are not split in hours, a time window starting inside an hour is read from the traffic table
+def testRoadClassTrafficOfTimeWindowInsideHour(database):
+    createTrafficTables(database)
+    importLinkTrafficAggregate()
+
+    traffic = roadClassTraffic('08:30:00', '09:00:00')
+
+    assert list(traffic['hour']) == [8, 8]
+    assert list(traffic['vehicleCount']) == [database.execute(f"""SELECT sum("vehicleCount") FROM "{config.DB_EVENTS_TABLE}"
+                                                                   WHERE "startTimeSeconds" = 30600 and "linkId" in ('a', 'b')""").scalar(),
+                                             database.execute(f"""SELECT "vehicleCount" FROM "{config.DB_EVENTS_TABLE}"
+                                                                   WHERE "startTimeSeconds" = 30600 and "linkId" = 'c'""").scalar()]
+
+
+# the traffic imported without network links does not fail, the aggregate of a previous import is deleted
+def testLinkTrafficAggregateNeedsNetworkLinks(database):
+    createTrafficTables(database, withNetworkLinks=False)
+    database.execute(f'CREATE TABLE "{config.DB_LINK_TRAFFIC_AGGREGATE_TABLE}" (hour integer);')
+
+    importLinkTrafficAggregate()
+
+    assert not databaseTools.tableExists(database, config.DB_LINK_TRAFFIC_AGGREGATE_TABLE)
+    with pytest.raises(Exception):
+        roadClassTraffic()